@@ -0,0 +1,348 @@
+"""
+Benchmark scenarios for the bookstore API, driven by the benchmark management command
+Data is seeded with set-based SQL so large catalogs load quickly. Each scenario times individual requests, either
+in-process through the django test client or over HTTP against a running server, and reports throughput and
+latency percentiles as plain dicts ready to be dumped as JSON.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from . import stock
+from .models import Book, Customer
+from .renderers import ORJSONRenderer
+from .serializers import BOOK_FIELDS, BookSerializer, BookstoreTokenObtainPairSerializer, book_rows
+
+WORDS = [
+    "history", "rome", "empire", "garden", "python", "ocean", "winter", "dragon", "kitchen", "music",
+    "war", "peace", "science", "mystery", "river", "mountain", "city", "love", "night", "star",
+]
+GENRES = ["History", "Fiction", "Science", "Cooking", "Mystery", "Fantasy", "Poetry", "Travel"]
+# bench0 is the staff user
+USERNAMES = r"^bench[0-9]+$"
+
+
+def seed(books, customers):
+    """
+    Insert books with titles drawn from WORDS, and customers (plus one staff user) that can reserve without limit
+    The users get an unusable password, the benchmark signs their tokens itself (see access_token).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO bookstoreapi_book (id, title, author, genre, popularity, quantity, stock_shards, shard_reserved)
+            SELECT gen_random_uuid(),
+                   initcap(w[1 + i %% n] || ' ' || w[1 + (i / n) %% n] || ' ' || w[1 + (i / (n * n)) %% n]) || ' ' || i,
+                   'Author ' || (i %% 5000),
+                   g[1 + i %% array_length(g, 1)],
+                   (i * 7919) %% 1000,
+                   1000000, 0, 0
+            FROM generate_series(1, %s) AS i, (SELECT %s::text[] AS w, %s::text[] AS g, %s AS n) AS vocabulary
+            """,
+            [books, WORDS, GENRES, len(WORDS)],
+        )
+        cursor.execute(
+            """
+            INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email, is_staff, is_active,
+                                   date_joined)
+            SELECT %s, false, 'bench' || i, 'Bench', 'User ' || i, 'bench' || i || '@example.com', i = 0, true, now()
+            FROM generate_series(0, %s) AS i
+            """,
+            [make_password(None), customers],
+        )
+        cursor.execute(
+            """
+            INSERT INTO bookstoreapi_customer (id, user_id, mailing_address, max_reservations, current_reservations)
+            SELECT gen_random_uuid(), id, '1 Benchmark Way', 2147483647, 0 FROM auth_user WHERE username ~ %s
+            """,
+            [USERNAMES],
+        )
+        cursor.execute("ANALYZE")
+
+
+def unseed():
+    """
+    Delete what seed inserted, along with the reservations the scenarios left behind
+    Only for a database that had no books or customers before seeding, every book and customer goes.
+    """
+    Book.objects.all().delete()
+    Customer.objects.all().delete()
+    User.objects.filter(username__regex=USERNAMES).delete()
+
+
+def seeded_customers():
+    """
+    The customers seed inserted, the staff one first
+    """
+    return Customer.objects.select_related("user").filter(user__username__regex=USERNAMES).order_by("user__username")
+
+
+def access_token(customer):
+    return str(BookstoreTokenObtainPairSerializer.get_token(customer.user).access_token)
+
+
+class InProcessClient:
+    """
+    Requests through the django test client, measures the server side only
+    """
+
+    def __init__(self, token):
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def request(self, method, path, data=None):
+        if method == "get":
+            response = self.client.get(path)
+        else:
+            response = getattr(self.client, method)(path, json.dumps(data), content_type="application/json")
+        return response.status_code, response.content
+
+
+class HttpClient:
+    """
+    Requests over HTTP to a running server, one keep-alive session per client
+    """
+
+    def __init__(self, token, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method, path, data=None):
+        response = self.session.request(method, f"{self.base_url}{path}", json=data)
+        return response.status_code, response.content
+
+
+def summarize(latencies, elapsed, errors=0):
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p95_ms": round(percentiles[94] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def timed_requests(client, calls, expected):
+    """
+    Run (method, path, data) calls one after the other, counting responses not in expected as errors
+    """
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for method, path, data in calls:
+        request_started = time.perf_counter()
+        status, _ = client.request(method, path, data)
+        latencies.append(time.perf_counter() - request_started)
+        errors += status not in expected
+    return latencies, time.perf_counter() - started, errors
+
+
+class Benchmark:
+    """
+    The scenarios, all of them read their fixtures from the seeded database
+    """
+
+    def __init__(self, make_client, iterations, concurrency, seed=0):
+        self.make_client = make_client
+        self.requests = iterations
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        customers = list(seeded_customers()[: concurrency + 1])
+        self.staff, self.customers = customers[0], customers[1:]
+        self.client = make_client(access_token(self.customers[0]))
+        self.staff_client = make_client(access_token(self.staff))
+        self.book_ids = [str(id) for id in Book.objects.values_list("id", flat=True)[:10000]]
+
+    def scenarios(self):
+        return {
+            "search": self.search,
+            "suggest": self.suggest,
+            "popular": self.popular,
+            "list": self.list,
+            "book_detail": self.book_detail,
+            "customer_lookup": self.customer_lookup,
+            "reservation_create_delete": self.reservation_create_delete,
+            "serialization": self.serialization,
+            "concurrent_reads": self.concurrent_reads,
+            "concurrent_reservations": self.concurrent_reservations,
+            "concurrent_hot_title": self.concurrent_hot_title,
+        }
+
+    def run(self, names=None):
+        results = {}
+        for name, scenario in self.scenarios().items():
+            if names and name not in names:
+                continue
+            results[name] = scenario()
+        return results
+
+    def query(self, url_name, **params):
+        return f"{reverse(url_name)}?{urlencode(params)}" if params else reverse(url_name)
+
+    def search(self):
+        calls = [("get", self.query("books_search", query=self.random.choice(WORDS)), None) for _ in range(self.requests)]
+        return summarize(*timed_requests(self.client, calls, {200}))
+
+    def suggest(self):
+        """
+        Prefixes as typed into the search box, one to six characters of a word
+        """
+        calls = [
+            ("get", self.query("books_suggest", prefix=self.random.choice(WORDS)[: self.random.randint(1, 6)]), None)
+            for _ in range(self.requests)
+        ]
+        return summarize(*timed_requests(self.client, calls, {200}))
+
+    def popular(self):
+        calls = [("get", self.query("books_popular", page=self.random.randint(1, 20)), None) for _ in range(self.requests)]
+        return summarize(*timed_requests(self.client, calls, {200}))
+
+    def list(self):
+        calls = [("get", self.query("books", page=self.random.randint(1, 20)), None) for _ in range(self.requests)]
+        return summarize(*timed_requests(self.staff_client, calls, {200}))
+
+    def book_detail(self):
+        calls = [
+            ("get", reverse("book_detail", kwargs={"id": self.random.choice(self.book_ids)}), None)
+            for _ in range(self.requests)
+        ]
+        return summarize(*timed_requests(self.client, calls, {200}))
+
+    def customer_lookup(self):
+        calls = [
+            ("get", self.query("customer_lookup", username=self.random.choice(self.customers).user.username), None)
+            for _ in range(self.requests)
+        ]
+        return summarize(*timed_requests(self.client, calls, {200}))
+
+    def reservation_create_delete(self):
+        customer = self.customers[0]
+        create, delete, errors = [], [], 0
+        for _ in range(self.requests):
+            data = {"book": self.random.choice(self.book_ids), "customer": str(customer.id), "quantity": 1}
+            request_started = time.perf_counter()
+            status, body = self.client.request("post", reverse("reservations"), data)
+            create.append(time.perf_counter() - request_started)
+            if status != 201:
+                errors += 1
+                continue
+            reservation = json.loads(body)["id"]
+            request_started = time.perf_counter()
+            status, _ = self.client.request("delete", reverse("reservation_delete", kwargs={"id": reservation}))
+            delete.append(time.perf_counter() - request_started)
+            errors += status != 200
+        return {"create": summarize(create, sum(create), errors), "delete": summarize(delete, sum(delete))}
+
+    def serialization(self, page_size=50):
+        """
+        Rows per second through fetching, serializing and rendering list pages, the ModelSerializer and JSONRenderer
+        path against the values() and orjson path the list endpoints take, measured in this process
+        """
+        pages = [self.book_ids[i : i + page_size] for i in range(0, len(self.book_ids), page_size)]
+        pages = [self.random.choice(pages) for _ in range(self.requests)]
+
+        def model_serializer(ids):
+            return JSONRenderer().render(BookSerializer(Book.objects.filter(pk__in=ids), many=True).data)
+
+        def values(ids):
+            return ORJSONRenderer().render(book_rows(Book.objects.filter(pk__in=ids).values(*BOOK_FIELDS)))
+
+        rows = sum(len(ids) for ids in pages)
+        result = {}
+        for name, render in [("model_serializer", model_serializer), ("values", values)]:
+            started = time.perf_counter()
+            for ids in pages:
+                render(ids)
+            result[f"{name}_rows_per_s"] = round(rows / (time.perf_counter() - started))
+        result["speedup"] = round(result["values_rows_per_s"] / result["model_serializer_rows_per_s"], 2)
+        return result
+
+    def concurrently(self, calls, expected):
+        """
+        One client per customer runs calls(customer) at the same time, returns the summary over all of them
+        """
+        barrier = threading.Barrier(self.concurrency)
+        outcomes = []
+
+        def worker(customer):
+            client = self.make_client(access_token(customer))
+            try:
+                barrier.wait()
+                outcomes.append(timed_requests(client, calls(customer), expected))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(customer,)) for customer in self.customers]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for outcome in outcomes for latency in outcome[0]]
+        result = summarize(latencies, elapsed, sum(outcome[2] for outcome in outcomes))
+        result["concurrency"] = self.concurrency
+        return result
+
+    def concurrent_reads(self):
+        """
+        Every client mixes the read endpoints the app calls most, this is where multiple workers pay off
+        """
+        paths = [
+            self.query("books_search", query=self.random.choice(WORDS)),
+            self.query("books_popular", page=self.random.randint(1, 20)),
+            reverse("book_detail", kwargs={"id": self.random.choice(self.book_ids)}),
+            reverse("reservations"),
+        ]
+        return self.concurrently(lambda customer: [("get", path, None) for path in paths] * self.requests, {200})
+
+    def concurrent_reservations(self, book_id=None):
+        """
+        Every client reserves the same hot book at once, the stock covers all requests so none should fail
+        """
+        book_id = book_id or self.book_ids[0]
+        Book.objects.filter(pk=book_id).update(quantity=self.concurrency * self.requests)
+        stock.reset(book_id)
+        before = stock.available(book_id)
+
+        def calls(customer):
+            data = {"book": book_id, "customer": str(customer.id), "quantity": 1}
+            return [("post", reverse("reservations"), data)] * self.requests
+
+        result = self.concurrently(calls, {201})
+        result["stock_taken"] = before - stock.available(book_id)
+        return result
+
+    def concurrent_hot_title(self):
+        """
+        concurrent_reservations on a book with its stock in the book row, then with its stock sharded
+        """
+        book_id = self.book_ids[0]
+        result = {"unsharded": self.concurrent_reservations(book_id)}
+        stock.shard(book_id)
+        try:
+            result["sharded"] = self.concurrent_reservations(book_id)
+        finally:
+            stock.unshard(book_id)
+        result["shards"] = stock.SHARDS
+        # summarize leaves the throughput out when no request completed
+        sharded, unsharded = result["sharded"].get("throughput_rps"), result["unsharded"].get("throughput_rps")
+        result["speedup"] = round(sharded / unsharded, 2) if sharded and unsharded else None
+        return result
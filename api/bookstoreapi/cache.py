@@ -0,0 +1,231 @@
+"""
+Read-through cache for the catalog
+Every key embeds the catalog version, bumping it on any change to the books invalidates everything at once without
+having to find the keys, stale entries just expire. Serialized books are cached one per key, search and popular
+pages only cache the ids of their books (plus the pagination links) and read the books from those keys.
+Reservations only change the stock and popularity of the books they touch, so they don't bump the catalog version:
+the entries of those books are deleted, and the stock version embedded in the keys of the lists ordered or filtered
+by stock or popularity (popular pages, in_stock searches and facets) is bumped. Other search pages keep their ids.
+The ETag of a list or a book is derived from its key and the books in it, so it changes exactly when they do.
+A change also marks the catalog as recently changed for REPLICA_PIN_SECONDS. While the mark is set, entries read
+from a replica, which may not have caught up yet, are only cached for that long. The user of a request that wrote is
+remembered for as long, their next requests read from the primary, see router.py.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import router
+from .models import Book
+from .serializers import BOOK_FIELDS, book_rows
+
+VERSION_KEY = "catalog:version"
+STOCK_VERSION_KEY = "catalog:stock-version"
+CHANGED_KEY = "catalog:changed"
+TIMEOUT = 300
+
+
+def bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted or never set, start from a value that can't collide with an earlier version
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def current(key):
+    version = cache.get(key)
+    if version is None:
+        bump(key)
+        version = cache.get(key)
+    return version
+
+
+def mark_changed():
+    if settings.REPLICA_PIN_SECONDS:
+        cache.set(CHANGED_KEY, True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def writer_key(user_id):
+    return f"{CHANGED_KEY}:{user_id}"
+
+
+def remember_writer(user_id):
+    """
+    Pin the next requests of a user who just wrote to the primary for REPLICA_PIN_SECONDS, see ReplicaRoutingMiddleware
+    """
+    if settings.REPLICA_PIN_SECONDS:
+        cache.set(writer_key(user_id), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+async def aremember_writer(user_id):
+    if settings.REPLICA_PIN_SECONDS:
+        await cache.aset(writer_key(user_id), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def pin_writer(user):
+    """
+    Pin the request to the primary if its user wrote less than REPLICA_PIN_SECONDS ago, for sync catalog reads
+    """
+    if settings.REPLICA_PIN_SECONDS and user.is_authenticated and cache.get(writer_key(user.id)):
+        router.pin_primary()
+
+
+def bump_catalog_version():
+    bump(VERSION_KEY)
+    mark_changed()
+
+
+def bump_stock_version(book_ids):
+    version = cache.get(VERSION_KEY)
+    if version is not None:
+        cache.delete_many([catalog_key(version, "book", id) for id in book_ids])
+    bump(STOCK_VERSION_KEY)
+    mark_changed()
+
+
+def invalidate_catalog():
+    """
+    Call on every change to books other than to their stock and popularity
+    The version is bumped right away and again once the transaction commits, so a request that re-cached the old
+    rows in between doesn't keep them.
+    """
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+def invalidate_stock(book_ids):
+    """
+    Call when only the stock and popularity of the books of book_ids changed, right away and again on commit too
+    """
+    book_ids = [str(id) for id in book_ids]
+    bump_stock_version(book_ids)
+    transaction.on_commit(lambda: bump_stock_version(book_ids))
+
+
+def catalog_key(version, *parts):
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"catalog:{version}:{digest}"
+
+
+def make_etag(*parts):
+    """
+    Strong ETag for a representation identified by parts
+    """
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def not_modified(request, etag):
+    """
+    Whether If-None-Match has etag, compared weakly as RFC 9110 asks so it still matches after compression
+    weakened it, see CompressionMiddleware
+    """
+    tags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+class CatalogCache:
+    """
+    Catalog cache as of the version current when it is created, use one per request
+    The catalog views are async, open it with aopen()
+    """
+
+    timeout = TIMEOUT
+
+    def __init__(self, version=None, stock_version=None):
+        self.version = current(VERSION_KEY) if version is None else version
+        self.stock_version = current(STOCK_VERSION_KEY) if stock_version is None else stock_version
+
+    @classmethod
+    async def aopen(cls, user):
+        """
+        Open the cache for a request of user, pinning it to the primary if user just wrote
+        """
+        found = await cache.aget_many([VERSION_KEY, STOCK_VERSION_KEY, CHANGED_KEY, writer_key(user.id)])
+        if writer_key(user.id) in found:
+            router.pin_primary()
+        if VERSION_KEY not in found or STOCK_VERSION_KEY not in found:
+            catalog = await sync_to_async(cls)(found.get(VERSION_KEY), found.get(STOCK_VERSION_KEY))
+        else:
+            catalog = cls(found[VERSION_KEY], found[STOCK_VERSION_KEY])
+        if CHANGED_KEY in found and router.replica_configured() and not router.pinned():
+            # the replica may not have the change yet, don't keep what is read from it for longer than it may lag
+            catalog.timeout = settings.REPLICA_PIN_SECONDS
+        return catalog
+
+    def key(self, *parts):
+        return catalog_key(self.version, *parts)
+
+    def stock_key(self, *parts):
+        """
+        Key of an entry that depends on the stock or popularity of the books, not just on the books it lists
+        """
+        return self.key("stock", self.stock_version, *parts)
+
+    def etag(self, key, *books):
+        return make_etag(key, *books)
+
+    async def aget_books(self, ids):
+        """
+        Serialized books in the order of ids, missing ones are loaded with a single query and cached
+        Ids of books that don't exist are skipped
+        """
+        keys = {str(id): self.key("book", id) for id in ids}
+        cached = await cache.aget_many(keys.values())
+        books = {id: cached[key] for id, key in keys.items() if key in cached}
+        missing = [id for id in keys if id not in books]
+        if missing:
+            loaded = book_rows([book async for book in Book.objects.filter(pk__in=missing).values(*BOOK_FIELDS)])
+            await cache.aset_many(self.book_entries(loaded), self.timeout)
+            books.update({book["id"]: book for book in loaded})
+        return [books[id] for id in keys if id in books]
+
+    async def aget_or_set(self, key, fetch):
+        """
+        The cached value of key, fetch is a coroutine function computing it on a miss
+        """
+        value = await cache.aget(key)
+        if value is None:
+            value = await fetch()
+            await cache.aset(key, value, self.timeout)
+        return value
+
+    async def abook_list(self, request, key, fetch, fields=BOOK_FIELDS):
+        """
+        Response for a paginated book list, fetch is a coroutine function returning the paginated response data
+        and is only awaited on a miss. Books are cached whole, the response only has fields of them. A conditional
+        request is answered from the cached entries, with a 304 if none of the books changed.
+        """
+        page = await cache.aget(key)
+        if page is None:
+            page = await fetch()
+            await cache.aset_many({**self.book_entries(page["results"]), key: self.page_entry(page)}, self.timeout)
+            books = page["results"]
+        else:
+            books = await self.aget_books(page["results"])
+        etag = self.etag(key, *books)
+        if not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response({**page, "results": book_rows(books, fields)}, headers={"ETag": etag})
+
+    def book_entries(self, books):
+        return {self.key("book", book["id"]): book for book in books}
+
+    def page_entry(self, data):
+        # pages only keep the ids, the books are read from their own entries
+        return {**data, "results": [book["id"] for book in data["results"]]}
+
+
+def normalize_query(query):
+    """
+    Search is case insensitive, so queries that only differ in case or spacing share cache entries
+    """
+    return " ".join(query.lower().split())
@@ -0,0 +1,63 @@
+"""
+Reservation cancellation
+Cancelling deletes the reservations and gives their copies back in a single statement: the DELETE returns what it
+removed, and the same statement adds the copies back to the books' stock, takes back their popularity and lowers
+the customers' counters, one update per table whatever the number of reservations. A reservation can only be
+released once, a concurrent cancellation of the same rows waits on the DELETE and then finds nothing to return.
+Outside a transaction the statement is atomic on its own. Its updates lock rows in no particular order, a deadlock
+with a concurrent reservation is retried by the views, see decorators.retry_on_conflict.
+"""
+from dataclasses import dataclass
+
+from django.db import connections, router
+
+from .cache import invalidate_stock
+from .models import Book, Customer, Reservation, StockShard
+
+# popularity may have decayed since the copies were reserved and counters may have drifted, neither goes below zero
+CANCEL = f"""
+WITH cancelled AS (
+    -- the ids are selected once, as an InitPlan, an IN could rescan a SKIP LOCKED batch once per deleted row and find
+    -- the next rows every time, as the ones deleted by this statement are skipped
+    DELETE FROM {Reservation._meta.db_table} WHERE id = ANY(ARRAY({{reservations}}))
+    RETURNING id, book_id, customer_id, quantity
+), books AS (
+    UPDATE {Book._meta.db_table} AS book
+    SET quantity = book.quantity + released.quantity,
+        popularity = GREATEST(book.popularity - released.quantity, 0)
+    FROM (SELECT book_id, sum(quantity) AS quantity FROM cancelled GROUP BY book_id) AS released
+    WHERE book.id = released.book_id
+), shards AS (
+    -- the copies of a sharded book go back to its first shard, the book's quantity is only its cached total
+    UPDATE {StockShard._meta.db_table} AS shard
+    SET quantity = shard.quantity + released.quantity
+    FROM (SELECT book_id, sum(quantity) AS quantity FROM cancelled GROUP BY book_id) AS released
+    WHERE shard.book_id = released.book_id AND shard.shard = 0
+), customers AS (
+    UPDATE {Customer._meta.db_table} AS customer
+    SET current_reservations = GREATEST(customer.current_reservations - released.quantity, 0)
+    FROM (SELECT customer_id, sum(quantity) AS quantity FROM cancelled GROUP BY customer_id) AS released
+    WHERE customer.id = released.customer_id
+)
+SELECT id, quantity, book_id FROM cancelled
+"""
+
+
+@dataclass
+class Cancellation:
+    ids: list
+    # copies given back to stock
+    quantity: int
+
+
+def cancel(reservations):
+    """
+    Cancel the reservations of a Reservation queryset and release their stock, returns a Cancellation
+    """
+    query, params = reservations.order_by().values("pk").query.sql_with_params()
+    with connections[router.db_for_write(Reservation)].cursor() as cursor:
+        cursor.execute(CANCEL.format(reservations=query), params)
+        cancelled = cursor.fetchall()
+    if cancelled:
+        invalidate_stock({book_id for _, _, book_id in cancelled})
+    return Cancellation(ids=[id for id, _, _ in cancelled], quantity=sum(quantity for _, quantity, _ in cancelled))
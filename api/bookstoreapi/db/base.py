@@ -0,0 +1,67 @@
+"""
+Postgres backend with a process-wide connection pool, ENGINE "bookstoreapi.db"
+Django keeps one connection per thread. Under ASGI every request runs in a thread of its own, so a persistent
+connection (CONN_MAX_AGE) would never be reused. With this backend, closing a connection at the end of a request
+returns it to a pool shared by the threads of the process, and the next request takes it back without connecting.
+Configured by the POOL entry of the database settings, see settings.py.
+"""
+import threading
+from functools import partial
+
+from django.db.backends.postgresql import base
+
+from .pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def close_pools(alias):
+    """
+    Close the idle connections pooled for alias, e.g. before its database is dropped
+    """
+    with _pools_lock:
+        pools = [pool for (pool_alias, _), pool in _pools.items() if pool_alias == alias]
+    for pool in pools:
+        pool.close_all()
+
+
+class DatabaseCreation(base.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    def get_pool(self, conn_params):
+        """
+        The pool for these connection parameters, the test runner switches an alias to another database
+        """
+        key = (self.alias, repr(sorted(conn_params.items())))
+        with _pools_lock:
+            if key not in _pools:
+                options = self.settings_dict.get("POOL", {})
+                _pools[key] = ConnectionPool(
+                    size=options.get("SIZE", 10),
+                    timeout=options.get("TIMEOUT", 10),
+                    check_after=options.get("CHECK_AFTER", 30),
+                    max_lifetime=options.get("MAX_LIFETIME", 3600),
+                    reset_query=options.get("RESET_QUERY", "DISCARD ALL"),
+                )
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        # set for new connections by the parent, pooled ones skip it
+        self.isolation_level = base.IsolationLevel(
+            self.settings_dict["OPTIONS"].get("isolation_level", base.IsolationLevel.READ_COMMITTED)
+        )
+        self.pool = self.get_pool(conn_params)
+        return self.pool.acquire(partial(super().get_new_connection, conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from psycopg2 import Error as DatabaseError
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of open connections shared by the threads of a process
+    acquire() hands out the most recently released connection or opens a new one while under size, otherwise waits
+    up to timeout for one to be released. Connections idle for longer than check_after seconds are pinged before
+    they are reused, and connections older than max_lifetime seconds are closed instead of going back to the pool.
+    Released connections are reset with reset_query so no session state carries over to their next user.
+    """
+
+    def __init__(self, size, timeout=10, check_after=30, max_lifetime=3600, reset_query="DISCARD ALL"):
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        self.reset_query = reset_query
+        self.condition = threading.Condition()
+        # (connection, released at), most recently released last
+        self.idle = []
+        # guarded by condition like idle and open
+        self.opened_at = {}
+        self.open = 0
+
+    def acquire(self, connect):
+        """
+        An open connection in autocommit or idle state, connect() opens a new one when needed
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No connection released within {self.timeout}s, pool size {self.size}")
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, released = self.idle.pop()
+                else:
+                    self.open += 1
+                    connection = None
+            if connection is None:
+                return self.connect(connect)
+            if self.usable(connection, released):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        """
+        Return a connection, a transaction left open on it is rolled back and its session is reset (settings,
+        temporary tables, prepared statements, advisory locks, listens) so nothing carries over to its next user
+        """
+        if connection.closed or not self.reset(connection):
+            self.discard(connection)
+            return
+        with self.condition:
+            if time.monotonic() - self.opened_at.get(connection, 0) <= self.max_lifetime:
+                self.idle.append((connection, time.monotonic()))
+                self.condition.notify()
+                return
+        self.discard(connection)
+
+    def close_all(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+    def connect(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            self.forget()
+            raise
+        with self.condition:
+            self.opened_at[connection] = time.monotonic()
+        return connection
+
+    def usable(self, connection, released):
+        if connection.closed:
+            return False
+        if time.monotonic() - released < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+        except DatabaseError:
+            return False
+        return True
+
+    def reset(self, connection):
+        try:
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            # DISCARD ALL can't run inside a transaction block
+            autocommit = connection.autocommit
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(self.reset_query)
+            connection.autocommit = autocommit
+        except DatabaseError:
+            return False
+        return True
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+        self.forget(connection)
+
+    def forget(self, connection=None):
+        with self.condition:
+            self.opened_at.pop(connection, None)
+            self.open -= 1
+            self.condition.notify()
@@ -1,4 +1,7 @@
+import time
 from functools import wraps
+
+from django.db import OperationalError, connection
 from rest_framework import status
 from rest_framework.response import Response
 from .models import Reservation
@@ -7,7 +10,7 @@ from .models import Reservation
 def customer_authorization(view_func):
     @wraps(view_func)
     def _view(view, request, id, *args, **kwargs):
-        if not request.user.is_staff and str(request.user.customer.id) != id:
+        if not request.user.is_staff and request.user.customer_id != id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         return view_func(view, request, id, *args, **kwargs)
 
@@ -22,3 +25,31 @@ def staff_member_required(view_func):
         return view_func(view, request, *args, **kwargs)
 
     return _view
+
+
+# postgres serialization_failure and deadlock_detected, both are safe to retry from the start of the transaction
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+def retry_on_conflict(view_func=None, attempts=3, backoff=0.05):
+    """
+    Retry a view whose transaction was aborted by a serialization failure or deadlock, with linear backoff
+    The view must open its own transaction, retrying is skipped when already inside one (e.g. in TestCase).
+    Works on any function that opens its own transaction, e.g. a batch of the expire_holds command.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _view(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return view_func(*args, **kwargs)
+                except OperationalError as e:
+                    pgcode = getattr(e.__cause__, "pgcode", None)
+                    if pgcode not in RETRYABLE_PGCODES or attempt == attempts or connection.in_atomic_block:
+                        raise
+                    time.sleep(backoff * attempt)
+
+        return _view
+
+    return decorator(view_func) if view_func else decorator
@@ -0,0 +1,172 @@
+"""
+Streaming exports of the catalog and the reservations, served by the export view and the export management command
+Rows are read in chunks and encoded as they arrive, so memory stays flat whatever the table size. Chunks come from a
+server-side cursor, or when those are disabled (transaction pooling in PgBouncer, see DJANGO_DB_PGBOUNCER) from
+keyset pages on the primary key, which don't need a cursor to outlive a query.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F
+
+from .models import Book, Reservation
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CHUNK_SIZE = 2000
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def books(genre=None, since=None, until=None):
+    if since or until:
+        raise InvalidFilter("books can't be filtered by date")
+    books = Book.objects.values("id", "title", "author", "genre", "quantity", "popularity", "image_url")
+    return books.filter(genre=genre) if genre else books
+
+
+def reservations(genre=None, since=None, until=None):
+    reservations = Reservation.objects.values(
+        "id", "date", "expires_at", "quantity", "customer_id", "book_id",
+        username=F("customer__user__username"), title=F("book__title"), genre=F("book__genre"),
+    )
+    if genre:
+        reservations = reservations.filter(book__genre=genre)
+    if since:
+        reservations = reservations.filter(date__gte=since)
+    if until:
+        reservations = reservations.filter(date__lte=until)
+    return reservations
+
+
+EXPORTS = {"books": books, "reservations": reservations}
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f"{name} must be a date like 2024-01-31")
+
+
+def queryset(kind, genre=None, since=None, until=None):
+    """
+    The rows of an export, dates are ISO strings, raises InvalidFilter
+    """
+    return EXPORTS[kind](genre=genre or None, since=parse_date(since, "since"), until=parse_date(until, "until"))
+
+
+def chunks(rows, chunk_size=CHUNK_SIZE):
+    """
+    Lists of at most chunk_size rows, in primary key order
+    """
+    rows = rows.order_by("pk")
+    if not connections[rows.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        iterator = rows.iterator(chunk_size=chunk_size)
+        while chunk := list(islice(iterator, chunk_size)):
+            yield chunk
+        return
+    chunk = list(rows[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        chunk = list(rows.filter(pk__gt=chunk[-1]["id"])[:chunk_size])
+
+
+async def achunks(rows, chunk_size=CHUNK_SIZE):
+    """
+    chunks() for async views
+    """
+    rows = rows.order_by("pk")
+    if not connections[rows.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        chunk = []
+        async for row in rows.aiterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+    chunk = [row async for row in rows[:chunk_size]]
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        chunk = [row async for row in rows.filter(pk__gt=chunk[-1]["id"])[:chunk_size]]
+
+
+def columns(rows):
+    """
+    Column names of a values() queryset, in the order of its rows
+    """
+    return [*rows.query.extra_select, *rows.query.values_select, *rows.query.annotation_select]
+
+
+class Encoder:
+    """
+    Encodes chunks of rows to NDJSON or CSV bytes, gzipped on the fly when compress is set
+    Call header() first and finish() last, every call returns the bytes to send next (possibly none).
+    """
+
+    def __init__(self, format, columns, compress=False):
+        self.format = format
+        self.columns = columns
+        self.compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def header(self):
+        if self.format == "csv":
+            self.writer.writerow(self.columns)
+        return self.output()
+
+    def encode(self, rows):
+        if self.format == "ndjson":
+            self.buffer.writelines(json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows)
+        else:
+            self.writer.writerows([row[column] for column in self.columns] for row in rows)
+        return self.output()
+
+    def finish(self):
+        return self.compressor.flush() if self.compressor else b""
+
+    def output(self):
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return self.compressor.compress(data) if self.compressor else data
+
+
+def stream(rows, format, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    The encoded export as an iterator of bytes
+    """
+    encoder = Encoder(format, columns(rows), compress)
+    yield encoder.header()
+    for chunk in chunks(rows, chunk_size):
+        if data := encoder.encode(chunk):
+            yield data
+    yield encoder.finish()
+
+
+async def astream(rows, format, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    stream() for async views
+    """
+    encoder = Encoder(format, columns(rows), compress)
+    yield encoder.header()
+    async for chunk in achunks(rows, chunk_size):
+        if data := encoder.encode(chunk):
+            yield data
+    yield encoder.finish()
@@ -0,0 +1,71 @@
+"""
+Search facets and filters
+Facet counts are computed in one pass over the books a query matches: a single GROUP BY GROUPING SETS counts them by
+genre, by author and by stock at once, keeping the FACET_LIMIT largest values of each. They describe the whole query
+and ignore the filters, so they are cached once per normalized query and browsing the facets only pages the results.
+"""
+from django.db import connections
+
+FACET_LIMIT = 20
+
+FACET_COUNTS = """
+SELECT facet, value, count FROM (
+    SELECT CASE WHEN GROUPING(genre) = 0 THEN 'genre' WHEN GROUPING(author) = 0 THEN 'author' ELSE 'in_stock' END
+               AS facet,
+           COALESCE(genre, author, (quantity > 0)::text) AS value,
+           count(*) AS count,
+           row_number() OVER (
+               PARTITION BY GROUPING(genre), GROUPING(author)
+               ORDER BY count(*) DESC, COALESCE(genre, author, (quantity > 0)::text)
+           ) AS position
+    FROM ({matched}) AS matched
+    GROUP BY GROUPING SETS ((genre), (author), (quantity > 0))
+) AS facets
+WHERE position <= %s
+ORDER BY facet, position
+"""
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def filters(params):
+    """
+    The facet filters of the query params, as a dict of sorted tuples so it can be part of a cache key
+    Repeating genre or author matches any of the values, raises InvalidFilter
+    """
+    selected = {}
+    for name in ["genre", "author"]:
+        values = sorted({value for value in params.getlist(name) if value})
+        if values:
+            selected[name] = tuple(values)
+    in_stock = params.get("in_stock")
+    if in_stock:
+        if in_stock not in ("true", "false"):
+            raise InvalidFilter("in_stock must be true or false")
+        selected["in_stock"] = in_stock == "true"
+    return selected
+
+
+def apply(books, selected):
+    if "genre" in selected:
+        books = books.filter(genre__in=selected["genre"])
+    if "author" in selected:
+        books = books.filter(author__in=selected["author"])
+    if "in_stock" in selected:
+        books = books.filter(quantity__gt=0) if selected["in_stock"] else books.filter(quantity=0)
+    return books
+
+
+def facet_counts(books, limit=FACET_LIMIT):
+    """
+    Counts of the books by genre, author and in_stock, as lists of {"value", "count"} with the largest counts first
+    """
+    matched, params = books.order_by().values("genre", "author", "quantity").query.sql_with_params()
+    counts = {"genre": [], "author": [], "in_stock": []}
+    with connections[books.db].cursor() as cursor:
+        cursor.execute(FACET_COUNTS.format(matched=matched), [*params, limit])
+        for facet, value, count in cursor.fetchall():
+            counts[facet].append({"value": value == "true" if facet == "in_stock" else value, "count": count})
+    return counts
@@ -0,0 +1,39 @@
+"""
+Reservation holds
+With RESERVATION_HOLD_SECONDS set, a reservation holds its copies until its expires_at and the expire_holds command
+then gives them back, unless the customer confirms the reservation first. Confirmed reservations, and the ones made
+while holds are off, keep their copies until they are cancelled.
+The sweeper releases expired holds in batches. A batch is one statement: it picks its holds off the
+reservation_hold_expiry_idx partial index with FOR UPDATE SKIP LOCKED and cancels them with set-based restocking
+(see cancellation.py). Holds locked by another sweeper, or by a customer cancelling them, are skipped rather than
+waited on. So any number of sweepers can run side by side, and live reservations only wait on the brief book updates.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cancellation import cancel
+from .models import Reservation
+
+BATCH_SIZE = 1000
+
+
+def expires_at():
+    """
+    Expiry of a hold taken now, None when holds are off
+    """
+    if not settings.RESERVATION_HOLD_SECONDS:
+        return None
+    return timezone.now() + timedelta(seconds=settings.RESERVATION_HOLD_SECONDS)
+
+
+def release_expired(batch_size=BATCH_SIZE):
+    """
+    Release a batch of at most batch_size expired holds, the oldest first, returns the Cancellation
+    """
+    # select_for_update needs a transaction to compile, the statement it ends up in is atomic anyway
+    with transaction.atomic():
+        batch = Reservation.objects.expired().select_for_update(skip_locked=True).values("pk")[:batch_size]
+        return cancel(Reservation.objects.filter(pk__in=batch))
@@ -0,0 +1,198 @@
+"""
+Bulk catalog import, driven by the import_books management command
+Rows are streamed from CSV or JSON lines and loaded in batches, so memory stays flat whatever the input size. Each
+batch is one transaction: COPY into a temporary staging table, then one statement that updates the books already in
+the catalog and inserts the others, matched on (title, author). The search_vector trigger fills the new rows within
+that statement, and the new quantity of a sharded book is spread across its shards (see stock.py). The number of
+input rows consumed is committed with every batch, so an interrupted import resumes after its last committed batch.
+Nothing outlives a transaction, which keeps it usable behind PgBouncer.
+"""
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import stock
+from .cache import invalidate_catalog
+from .models import CatalogImport
+
+COLUMNS = ["title", "author", "genre", "quantity", "image_url"]
+MAX_LENGTH = 100
+
+STAGING_TABLE = """
+CREATE TEMPORARY TABLE bookstoreapi_book_import (
+    line bigint, title text, author text, genre text, quantity integer, image_url text
+) ON COMMIT DROP
+"""
+
+# the last occurrence of a (title, author) in the batch wins, unchanged books are left alone
+UPSERT = """
+WITH incoming AS (
+    SELECT DISTINCT ON (title, author) title, author, genre, quantity, image_url
+    FROM bookstoreapi_book_import
+    ORDER BY title, author, line DESC
+), updated AS (
+    UPDATE bookstoreapi_book AS book
+    SET genre = incoming.genre, quantity = incoming.quantity, image_url = incoming.image_url
+    FROM incoming
+    WHERE book.title = incoming.title AND book.author = incoming.author
+        AND (book.genre, book.quantity, book.image_url)
+            IS DISTINCT FROM (incoming.genre, incoming.quantity, incoming.image_url)
+    RETURNING book.id, book.stock_shards
+), inserted AS (
+    INSERT INTO bookstoreapi_book
+        (id, title, author, genre, quantity, image_url, popularity, stock_shards, shard_reserved)
+    SELECT gen_random_uuid(), title, author, genre, quantity, image_url, 0, 0, 0
+    FROM incoming
+    WHERE NOT EXISTS (
+        SELECT 1 FROM bookstoreapi_book AS book WHERE book.title = incoming.title AND book.author = incoming.author
+    )
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM updated),
+    (SELECT array_agg(id) FROM updated WHERE stock_shards > 0)
+"""
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def read_rows(file, format):
+    """
+    Dicts from a CSV file with a header line or from JSON lines, blank lines are skipped
+    Lines that can't be parsed come through as InvalidRow instances, so they are counted and reported like the rest
+    """
+    if format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield InvalidRow(f"not valid JSON ({e})")
+                continue
+            yield row if isinstance(row, dict) else InvalidRow("not a JSON object")
+
+
+def clean(row):
+    """
+    The staging columns of a row, raises InvalidRow
+    """
+    values = {}
+    for field in ["title", "author", "genre"]:
+        value = str(row.get(field) or "").strip()
+        if field != "genre" and not value:
+            raise InvalidRow(f"{field} is required")
+        if len(value) > MAX_LENGTH:
+            raise InvalidRow(f"{field} is longer than {MAX_LENGTH} characters")
+        values[field] = value
+    try:
+        values["quantity"] = int(row.get("quantity") or 0)
+    except (TypeError, ValueError):
+        raise InvalidRow("quantity is not a number")
+    if values["quantity"] < 0:
+        raise InvalidRow("quantity is negative")
+    image_url = str(row.get("image_url") or "").strip() or None
+    if image_url and len(image_url) > MAX_LENGTH:
+        raise InvalidRow(f"image_url is longer than {MAX_LENGTH} characters")
+    values["image_url"] = image_url
+    return values
+
+
+@dataclass
+class Batch:
+    # (line, *COLUMNS) of the valid rows and (line, error) of the others
+    rows: list
+    skipped: list
+
+
+class CatalogImporter:
+    """
+    Imports rows into the catalog, progress is kept under name in CatalogImport
+    """
+
+    def __init__(self, name, batch_size=50000, resume=False, report=None, max_errors_reported=10):
+        self.batch_size = batch_size
+        self.report = report or (lambda message: None)
+        self.max_errors_reported = max_errors_reported
+        if resume:
+            self.progress, _ = CatalogImport.objects.get_or_create(name=name)
+        else:
+            CatalogImport.objects.filter(name=name).delete()
+            self.progress = CatalogImport.objects.create(name=name)
+
+    def run(self, rows):
+        """
+        Import an iterable of row dicts, returns the CatalogImport with the totals
+        """
+        if self.progress.finished_at is not None:
+            self.report(f"Import {self.progress.name} already finished, nothing to resume")
+            return self.progress
+        started = time.monotonic()
+        resumed_at = self.progress.rows
+        if resumed_at:
+            self.report(f"Resuming after row {resumed_at}")
+        for batch in self.batches(rows, skip=resumed_at):
+            self.load(batch)
+            elapsed = time.monotonic() - started
+            self.report(
+                f"{self.progress.rows} rows: {self.progress.inserted} inserted, {self.progress.updated} updated, "
+                f"{self.progress.skipped} skipped, {(self.progress.rows - resumed_at) / elapsed:.0f} rows/s"
+            )
+        self.progress.finished_at = timezone.now()
+        self.progress.save(update_fields=["finished_at"])
+        return self.progress
+
+    def batches(self, rows, skip=0):
+        """
+        Batches of cleaned rows, the first skip rows were committed by an earlier run
+        """
+        batch = Batch(rows=[], skipped=[])
+        for line, row in enumerate(rows, start=1):
+            if line <= skip:
+                continue
+            try:
+                if isinstance(row, InvalidRow):
+                    raise row
+                batch.rows.append((line, *clean(row).values()))
+            except InvalidRow as e:
+                batch.skipped.append((line, str(e)))
+            if len(batch.rows) + len(batch.skipped) >= self.batch_size:
+                yield batch
+                batch = Batch(rows=[], skipped=[])
+        if batch.rows or batch.skipped:
+            yield batch
+
+    def load(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch.rows)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # one import at a time, concurrent ones would race on the (title, author) match
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('bookstoreapi_book_import'))")
+            cursor.execute(STAGING_TABLE)
+            cursor.copy_expert(
+                f"COPY bookstoreapi_book_import (line, {', '.join(COLUMNS)}) FROM STDIN "
+                "(FORMAT csv, FORCE_NOT_NULL (title, author, genre))",
+                buffer,
+            )
+            cursor.execute(UPSERT)
+            inserted, updated, sharded = cursor.fetchone()
+            for book_id in sharded or []:
+                stock.reset(book_id)
+            # ON COMMIT DROP doesn't fire when the batch is nested in an outer transaction
+            cursor.execute("DROP TABLE bookstoreapi_book_import")
+            self.progress.rows += len(batch.rows) + len(batch.skipped)
+            self.progress.inserted += inserted
+            self.progress.updated += updated
+            self.progress.skipped += len(batch.skipped)
+            self.progress.save(update_fields=["rows", "inserted", "updated", "skipped"])
+            invalidate_catalog()
+        for line, error in batch.skipped[: self.max_errors_reported]:
+            self.report(f"Skipped row {line}: {error}")
@@ -0,0 +1,175 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ...benchmark import Benchmark, HttpClient, InProcessClient, seed, seeded_customers, unseed
+from ...models import Book, Customer
+from ...router import REPLICA
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a catalog and measure throughput and p50/p95/p99 latency of the main endpoints, printed as JSON. "
+        "By default a throwaway database is created next to the configured one and requests are made in-process. "
+        "With --url requests go over HTTP to a running server, add --seed to seed the database the server uses first, "
+        "which must be a throwaway one. "
+        "With --serve the command starts the server itself on the throwaway database, give it twice to compare the "
+        "development server with the production ASGI server."
+    )
+
+    # how each server is started, {port} is filled in, runserver keeps the DEBUG it always ran with
+    SERVERS = {
+        "runserver": (
+            [sys.executable, "manage.py", "runserver", "--noreload", "127.0.0.1:{port}"],
+            {"DJANGO_DEBUG": "True"},
+        ),
+        "asgi": (
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", "127.0.0.1:{port}"],
+            {"DJANGO_DEBUG": "False"},
+        ),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=10000, help="Number of books to seed")
+        parser.add_argument("--customers", type=int, default=100, help="Number of customers to seed")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per scenario (per client when concurrent)")
+        parser.add_argument("--concurrency", type=int, default=8, help="Clients in the concurrent scenarios")
+        parser.add_argument("--scenario", action="append", help="Only run this scenario, can be repeated")
+        parser.add_argument("--url", help="Base URL of a running server, e.g. http://localhost:8000")
+        parser.add_argument(
+            "--seed",
+            action="store_true",
+            help="With --url, seed the configured database, which must have no books or customers, and empty it after",
+        )
+        parser.add_argument("--keep", action="store_true", help="With --seed, keep the seeded data for later runs")
+        parser.add_argument(
+            "--serve", action="append", choices=sorted(self.SERVERS), help="Start this server and benchmark it over HTTP"
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        options["customers"] = max(options["customers"], options["concurrency"] + 1)
+        if options["url"] and options["serve"]:
+            raise CommandError("--url and --serve can't be combined")
+        report = {
+            "commit": self.commit(),
+            "books": options["books"],
+            "customers": options["customers"],
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+        }
+        if options["url"]:
+            report["target"] = options["url"]
+            with self.configured_database(options):
+                report["scenarios"] = self.run(partial(HttpClient, base_url=options["url"]), options)
+        elif options["serve"]:
+            with self.throwaway_database(options):
+                report["targets"] = {server: self.run_served(server, options) for server in options["serve"]}
+        else:
+            with self.throwaway_database(options):
+                report["target"] = "in-process"
+                report["scenarios"] = self.run(InProcessClient, options)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def run(self, make_client, options):
+        benchmark = Benchmark(make_client, options["requests"], options["concurrency"])
+        return benchmark.run(options["scenario"])
+
+    @contextmanager
+    def configured_database(self, options):
+        """
+        Seed the configured database with --seed and empty it afterwards, or reuse the data kept by an earlier run
+        """
+        if not options["seed"]:
+            if seeded_customers().count() <= options["concurrency"]:
+                raise CommandError("No benchmark data, pass --seed (and --keep to reuse it) on a throwaway database")
+            yield
+            return
+        if Book.objects.exists() or Customer.objects.exists():
+            raise CommandError("--seed needs a database without books or customers, point it at a throwaway database")
+        seed(options["books"], options["customers"])
+        try:
+            yield
+        finally:
+            if not options["keep"]:
+                unseed()
+
+    @contextmanager
+    def throwaway_database(self, options):
+        # same settings as the test runner, DEBUG off so queries aren't recorded in memory
+        setup_test_environment(debug=False)
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = f"{connection.settings_dict['NAME']}_benchmark"
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        for alias in connections:
+            # the read replica, like in tests
+            if connections[alias].settings_dict.get("TEST", {}).get("MIRROR") == connection.alias:
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            seed(options["books"], options["customers"])
+            yield
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_served(self, server, options):
+        """
+        Start server on a free port against the throwaway database, benchmark it over HTTP and stop it
+        """
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        command, environment = self.SERVERS[server]
+        env = {
+            **os.environ,
+            "DJANGO_DATABASE_NAME": connection.settings_dict["NAME"],
+            "DJANGO_REPLICA_DATABASE_NAME": connection.settings_dict["NAME"] if REPLICA in connections else "",
+            "DJANGO_ALLOWED_HOSTS": "127.0.0.1",
+            **environment,
+        }
+        process = subprocess.Popen(
+            [part.format(port=port) for part in command],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_for(port, process)
+            return self.run(partial(HttpClient, base_url=f"http://127.0.0.1:{port}"), options)
+        finally:
+            process.terminate()
+            process.wait()
+
+    def wait_for(self, port, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"Server exited with status {process.returncode}, start it by hand to see why")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Server didn't start listening on port {port}")
+
+    def commit(self):
+        try:
+            return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            return None
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...popularity import decay
+
+
+class Command(BaseCommand):
+    help = "Decay book popularity so the popular ranking favours recent reservations, run it periodically (e.g. daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--factor", type=float, default=0.5, help="Multiplier applied to every popularity, between 0 and 1"
+        )
+
+    def handle(self, *args, **options):
+        factor = options["factor"]
+        if not 0 <= factor <= 1:
+            raise CommandError("factor must be between 0 and 1")
+        updated = decay(factor)
+        self.stdout.write(f"Decayed popularity of {updated} books by {factor}")
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...decorators import retry_on_conflict
+from ...holds import BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Release expired reservation holds and give their copies back to stock, run it periodically or with --watch. "
+        "Several can run at once, each batch skips the holds another one has locked."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Holds released per transaction")
+        parser.add_argument(
+            "--watch",
+            type=float,
+            metavar="SECONDS",
+            help="Keep running, sweeping again this many seconds after each sweep",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("batch-size must be at least 1")
+        while True:
+            self.sweep(batch_size)
+            if not options["watch"]:
+                break
+            time.sleep(options["watch"])
+
+    def sweep(self, batch_size):
+        """
+        Release batches until one comes back short, then every expired hold not locked elsewhere is released
+        A batch that deadlocks with a live reservation on the same books is rolled back whole and retried with
+        backoff, the sweep fails once its retries run out.
+        """
+        release = retry_on_conflict(release_expired)
+        holds = copies = 0
+        while True:
+            cancellation = release(batch_size)
+            holds += len(cancellation.ids)
+            copies += cancellation.quantity
+            if len(cancellation.ids) < batch_size:
+                break
+        self.stdout.write(f"Released {holds} expired holds, {copies} copies back in stock")
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import export as exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Export every book or reservation as NDJSON or CSV, streamed in chunks so memory stays flat. "
+        "Output ending in .gz is gzipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(exports.EXPORTS))
+        parser.add_argument("--format", choices=list(exports.FORMATS), default="ndjson")
+        parser.add_argument("--output", default="-", help="File to write, - for stdout")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output, the default for files ending in .gz")
+        parser.add_argument("--genre", help="Only books, or reservations of books, of this genre")
+        parser.add_argument("--since", help="Only reservations made on or after this date (YYYY-MM-DD)")
+        parser.add_argument("--until", help="Only reservations made on or before this date (YYYY-MM-DD)")
+        parser.add_argument("--chunk-size", type=int, default=exports.CHUNK_SIZE, help="Rows read per round trip")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        try:
+            rows = exports.queryset(
+                options["kind"], genre=options["genre"], since=options["since"], until=options["until"]
+            )
+        except exports.InvalidFilter as e:
+            raise CommandError(str(e))
+        path = options["output"]
+        compress = options["gzip"] or path.endswith(".gz")
+        data = exports.stream(rows, options["format"], compress, options["chunk_size"])
+        if path == "-":
+            sys.stdout.buffer.writelines(data)
+            sys.stdout.buffer.flush()
+            return
+        with open(path, "wb") as file:
+            file.writelines(data)
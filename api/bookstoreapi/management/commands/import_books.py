@@ -0,0 +1,42 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importer import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import books from a CSV file (with a header line) or JSON lines, matching existing books on (title, author). "
+        "Columns: title, author, genre, quantity, image_url, only title and author are required. Loads in batches "
+        "with COPY, an interrupted import continues where it stopped with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, - for stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format, guessed from the file extension")
+        parser.add_argument("--batch-size", type=int, default=50000, help="Rows loaded per transaction")
+        parser.add_argument("--resume", action="store_true", help="Skip the rows committed by an earlier run")
+        parser.add_argument("--name", help="Name the progress is kept under, defaults to the absolute path")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        if path == "-" and not options["name"]:
+            raise CommandError("--name is required when importing from stdin")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        name = options["name"] or os.path.abspath(path)
+        importer = CatalogImporter(
+            name, batch_size=options["batch_size"], resume=options["resume"], report=self.stdout.write
+        )
+        if path == "-":
+            result = importer.run(read_rows(sys.stdin, format))
+        else:
+            with open(path, newline="", encoding="utf-8") as file:
+                result = importer.run(read_rows(file, format))
+        self.stdout.write(
+            f"Imported {result.rows} rows: {result.inserted} inserted, {result.updated} updated, "
+            f"{result.skipped} skipped"
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...reconciliation import CHUNK_SIZE, COUNTERS, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the denormalized counters (customers' current reservations, book stock) against the reservations and "
+        "report the drifted ones, or fix them with --fix. Runs in small chunks, safe to run against live traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("counters", nargs="*", help=f"Counters to check, all by default: {', '.join(COUNTERS)}")
+        parser.add_argument("--fix", action="store_true", help="Set drifted counters to their expected value")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows checked per statement")
+        parser.add_argument("--max-reported", type=int, default=10, help="Drifted rows listed per counter")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        unknown = [counter for counter in options["counters"] if counter not in COUNTERS]
+        if unknown:
+            raise CommandError(f"Unknown counters: {', '.join(unknown)}")
+        for counter in options["counters"] or COUNTERS:
+            reported = []
+
+            def report(drift):
+                if len(reported) < options["max_reported"]:
+                    reported.append(drift)
+                    self.stdout.write(f"{counter} of {drift.id} is {drift.stored}, expected {drift.expected}")
+
+            run = reconcile(counter, fix=options["fix"], chunk_size=options["chunk_size"], report=report)
+            self.stdout.write(
+                f"{counter}: {run.checked} checked, {run.drifted} drifted by {run.drift} in total, {run.fixed} fixed"
+            )
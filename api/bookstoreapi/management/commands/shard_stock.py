@@ -0,0 +1,34 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import stock
+from ...models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Split the stock of a hot book across shard rows so its reservations stop queuing on the book row, "
+        "or put it back in the book row with --off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("book", help="Id of the book")
+        parser.add_argument("--shards", type=int, default=stock.SHARDS, help="Number of shards")
+        parser.add_argument("--off", action="store_true", help="Unshard the book")
+
+    def handle(self, *args, **options):
+        try:
+            Book.objects.values_list("pk").get(pk=options["book"])
+        except (Book.DoesNotExist, ValidationError):
+            raise CommandError(f"No book with id {options['book']}")
+        if options["off"]:
+            stock.unshard(options["book"])
+            self.stdout.write(f"Unsharded book {options['book']}, {stock.available(options['book'])} copies in stock")
+            return
+        if not 2 <= options["shards"] <= 1000:
+            raise CommandError("shards must be between 2 and 1000")
+        stock.shard(options["book"], options["shards"])
+        self.stdout.write(
+            f"Split the {stock.available(options['book'])} copies of book {options['book']} into {options['shards']} "
+            "shards"
+        )
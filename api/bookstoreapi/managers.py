@@ -1,5 +1,17 @@
-from django.contrib.postgres.search import SearchQuery
+from functools import reduce
+from operator import or_
+
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
 from django.db import models
+from django.db.models import BooleanField, Count, Exists, ExpressionWrapper, F, FloatField, Min, Q, Sum
+from django.db.models.functions import Cast, Coalesce, Collate, Greatest, Now, Upper
+
+# reservations still holding their stock, see ReservationQuerySet.active
+ACTIVE = Q(expires_at__isnull=True) | Q(expires_at__gt=Now())
+
+# text search configuration used by the search_vector trigger (migration 0003), queries must use the same one
+SEARCH_CONFIG = "english"
 
 
 class BookManager(models.Manager):
@@ -11,13 +23,99 @@ class BookManager(models.Manager):
         """
         Book text search based on django support for postgres fts
         https://docs.djangoproject.com/en/4.2/ref/contrib/postgres/search/
+
+        The full text, title, author and genre matches are OR'd into a single WHERE clause that postgres answers with a
+        BitmapOr over the GIN indexes declared on Book, no DISTINCT needed. The contains branches compare against
+        UPPER(column) so they use the gin_trgm_ops expression indexes. Misspelled queries are left to similar():
+        with the trigram similarity branches in the same OR the bitmaps are costed above a sequential scan.
+        Results are ordered by full text rank plus the best trigram similarity of title or author.
+        """
+        return self.ranked(self.get_queryset().filter(reduce(or_, self.matches(query))), query)
+
+    def similar(self, query):
+        """
+        Books whose title or author is similar to query (e.g. Mary Baerd), the fallback when search finds nothing
+        Answered by a BitmapOr over the title and author trigram indexes, ordered like search
+        """
+        matches = TrigramSimilar(Upper("title"), query) | TrigramSimilar(Upper("author"), query)
+        return self.ranked(self.get_queryset().filter(matches), query)
+
+    def lookup(self, query):
         """
-        search_query = SearchQuery(query, search_type="websearch")
-        contains_queryset = self.get_queryset().filter(title__icontains=query)
-        contains_queryset |= self.get_queryset().filter(author__icontains=query)
-        contains_queryset |= self.get_queryset().filter(genre__icontains=query)
-        trigram_queryset = self.get_queryset().filter(title__trigram_similar=query)
-        trigram_queryset |= self.get_queryset().filter(author__trigram_similar=query)
-        vector_queryset = self.get_queryset().filter(search_vector=search_query)
+        search(query), or similar(query) when no book matches query exactly
+        """
+        return self.search(query) if self.exact_match(query).first() else self.similar(query)
+
+    async def alookup(self, query):
+        """
+        Async lookup
+        """
+        return self.search(query) if await self.exact_match(query).afirst() else self.similar(query)
+
+    def exact_match(self, query):
+        """
+        Whether some book matches search(query), as a queryset of a single value
+        One EXISTS per branch so each is answered by its own index. A single EXISTS over the OR'd branches is planned
+        as a sequential scan expected to stop early, which reads the whole table when nothing matches.
+        """
+        found = reduce(or_, [Exists(self.get_queryset().filter(match)) for match in self.matches(query)])
+        found = ExpressionWrapper(found, output_field=BooleanField())
+        return self.get_queryset().annotate(found=found).order_by("pk").values_list("found", flat=True)[:1]
+
+    @staticmethod
+    def matches(query):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        return [
+            Q(search_vector=search_query),
+            Q(title__icontains=query),
+            Q(author__icontains=query),
+            Q(genre__icontains=query),
+        ]
 
-        return (contains_queryset | trigram_queryset | vector_queryset).distinct()
+    @staticmethod
+    def ranked(books, query):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        rank = Coalesce(SearchRank(F("search_vector"), search_query), 0.0) + Greatest(
+            TrigramSimilarity("title", query), TrigramSimilarity("author", query)
+        )
+        # double precision so the rank survives a round trip through python unchanged
+        return books.annotate(rank=Cast(rank, FloatField())).order_by("-rank", "id")
+
+    def suggest(self, field, prefix):
+        """
+        Books whose title or author starts with prefix, case insensitive, in alphabetical order of that field
+        Matches and order both come from the book_*_prefix_idx index, so a LIMIT stops the scan after as many rows.
+        """
+        key = Collate(Upper(field), "C")
+        return self.get_queryset().alias(key=key).filter(key__startswith=prefix.upper()).order_by(key, "id")
+
+
+class ReservationQuerySet(models.QuerySet):
+    def active(self):
+        """
+        Reservations still holding their stock, the ones kept until cancelled and the unexpired holds
+        """
+        return self.filter(ACTIVE)
+
+    def expired(self):
+        """
+        Holds past their expiry that still have their stock, in the order of the reservation_hold_expiry_idx index
+        """
+        return self.filter(expires_at__lte=Now()).order_by("expires_at")
+
+    def history(self, customer_id):
+        """
+        A customer's reservations newest first, in the order of the reservation_customer_date_idx index
+        """
+        return self.filter(customer=customer_id).order_by("-date", "-id")
+
+    def summary(self, customer_id):
+        """
+        Totals of a customer's reservations, one aggregate over their range of reservation_customer_date_idx
+        """
+        return self.filter(customer=customer_id).aggregate(
+            reservations=Count("id"),
+            active=Count("id", filter=ACTIVE),
+            copies=Coalesce(Sum("quantity", filter=ACTIVE), 0),
+            next_expiry=Min("expires_at", filter=Q(expires_at__gt=Now())),
+        )
@@ -0,0 +1,140 @@
+"""
+Per-request instrumentation
+QueryMetricsMiddleware opens a RequestMetrics for every request, which counts the SQL queries and time spent in the
+database and collects named spans (serialize for rendering, or anything a view times with timed()). Totals are
+aggregated per URL name for the Prometheus text endpoint, and each response reports its own in Server-Timing.
+The current RequestMetrics lives in a context variable, which follows the request into the threads the async ORM
+runs its queries in, so queries are counted by one execute wrapper installed on every connection.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = defaultdict(float)
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, see https://docs.djangoproject.com/en/4.2/topics/db/instrumentation/
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def add_span(self, name, seconds):
+        self.spans[name] += seconds
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Server-Timing header value, durations in milliseconds
+        """
+        timings = [f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"']
+        timings += [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.spans.items()]
+        timings.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(timings)
+
+
+def current():
+    """
+    Metrics of the request being handled, None outside of a request
+    """
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection, counts the query against the current request if there is one
+    """
+    metrics = current()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.record_query(execute, sql, params, many, context)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def activate(metrics):
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Time a block of a view as a named span of the current request
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current()
+        if metrics is not None:
+            metrics.add_span(name, time.perf_counter() - started)
+
+
+class Registry:
+    """
+    Process-wide totals per URL name
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, view, metrics):
+        with self.lock:
+            totals = self.views[view]
+            totals["requests"] += 1
+            totals["queries"] += metrics.queries
+            totals["queries_max"] = max(totals["queries_max"], metrics.queries)
+            totals["db_seconds"] += metrics.db_time
+            totals["request_seconds"] += metrics.total
+            for name, seconds in metrics.spans.items():
+                totals[f"{name}_seconds"] += seconds
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        """
+        Prometheus text exposition format
+        """
+        with self.lock:
+            views = {view: dict(totals) for view, totals in self.views.items()}
+        series = defaultdict(list)
+        for view, totals in sorted(views.items()):
+            for key, value in sorted(totals.items()):
+                series[key].append((view, value))
+        lines = []
+        for key, samples in sorted(series.items()):
+            gauge = key.endswith("_max")
+            name = f"bookstore_{key}" if gauge else f"bookstore_{key}_total"
+            lines.append(f"# TYPE {name} {'gauge' if gauge else 'counter'}")
+            lines += [f'{name}{{view="{view}"}} {value:g}' for view, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,175 @@
+import gzip
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from . import metrics, router
+from .cache import aremember_writer, remember_writer
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+class QueryMetricsMiddleware:
+    """
+    Records query count, database time, serialization time and total time of every request
+    Totals are kept per URL name for the metrics endpoint and the request's own are sent as a Server-Timing header.
+    Should be first in MIDDLEWARE so the total covers the whole stack. Works under WSGI and ASGI, queries are counted
+    by the execute wrapper installed on every connection, see metrics.record_query.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.activate(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, request_metrics, response)
+
+    async def __acall__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.activate(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, request_metrics, response)
+
+    def finish(self, request, request_metrics, response):
+        request_metrics.finish()
+        match = getattr(request, "resolver_match", None)
+        metrics.registry.observe(match.url_name if match and match.url_name else "unresolved", request_metrics)
+        response["Server-Timing"] = request_metrics.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, time the rendering as serialization
+        started = time.perf_counter()
+        request_metrics = metrics.current()
+
+        def rendered(response):
+            request_metrics.add_span("serialize", time.perf_counter() - started)
+
+        if request_metrics is not None:
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scopes read replica routing to the request, see router.py
+    The user of a request that wrote is remembered, so their next requests read their writes from the primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with router.request_routing(request.method):
+            response = self.get_response(request)
+            if self.writer(request):
+                remember_writer(request.user.id)
+        return response
+
+    async def __acall__(self, request):
+        with router.request_routing(request.method):
+            response = await self.get_response(request)
+            if self.writer(request):
+                await aremember_writer(request.user.id)
+        return response
+
+    def writer(self, request):
+        # request.user is set by the DRF authentication of the view
+        return router.wrote() and getattr(request, "user", None) is not None and request.user.is_authenticated
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip, whichever the client accepts with the higher preference (brotli on
+    a tie, when installed). Bodies under min_length aren't worth the CPU and are sent as they are, and so are
+    streaming responses, which compress themselves (see export.py). Like django's GZipMiddleware, a strong ETag is
+    weakened since the compressed bytes are a different representation, conditional requests compare weakly.
+    """
+
+    sync_capable = True
+    async_capable = True
+    min_length = 1024
+    gzip_level = 6
+    brotli_quality = 5
+    accept_encoding = _lazy_re_compile(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*(?:,|$)")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    @classmethod
+    def encoding(cls, request, choices=None):
+        """
+        The coding of choices (br and gzip by default) the client prefers in its Accept-Encoding
+        None when it accepts none of them, or ranks identity above them.
+        """
+        preferences = {}
+        for coding, quality in cls.accept_encoding.findall(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+            try:
+                preferences[coding.lower()] = float(quality) if quality else 1.0
+            except ValueError:
+                continue
+        if choices is None:
+            choices = ["br", "gzip"] if brotli else ["gzip"]
+        best = max(choices, key=lambda coding: preferences.get(coding, 0))
+        quality = preferences.get(best, 0)
+        return best if quality > 0 and quality >= preferences.get("identity", 0) else None
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ["Accept-Encoding"])
+        if len(response.content) < self.min_length:
+            return response
+        encoding = self.encoding(request)
+        if encoding is None:
+            return response
+        if encoding == "br":
+            content = brotli.compress(response.content, quality=self.brotli_quality)
+        else:
+            content = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = f"W/{etag}"
+        return response
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Keeps Book.search_vector in sync inside postgres, so every write path (API, admin, bulk loads, psql) is covered
+# without a second UPDATE round trip. The config must match SEARCH_CONFIG in managers.py.
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION bookstoreapi_book_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector(
+        'pg_catalog.english',
+        coalesce(NEW.title, '') || ' ' || coalesce(NEW.author, '') || ' ' || coalesce(NEW.genre, '')
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookstoreapi_book_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, author, genre, search_vector ON bookstoreapi_book
+    FOR EACH ROW EXECUTE FUNCTION bookstoreapi_book_search_vector_update();
+
+-- backfill rows written before the trigger existed
+UPDATE bookstoreapi_book SET search_vector = NULL;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS bookstoreapi_book_search_vector_trigger ON bookstoreapi_book;
+DROP FUNCTION IF EXISTS bookstoreapi_book_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0002_book_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
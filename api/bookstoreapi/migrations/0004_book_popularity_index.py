@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0003_book_search_vector_trigger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-popularity', 'id'], name='book_popularity_idx'),
+        ),
+    ]
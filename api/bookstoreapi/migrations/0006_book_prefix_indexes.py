@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-18 09:16
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0005_book_import'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('title'), 'C'), name='book_title_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('author'), 'C'), name='book_author_prefix_idx'),
+        ),
+    ]
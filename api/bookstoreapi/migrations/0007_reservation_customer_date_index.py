@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-18 09:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0006_book_prefix_indexes'),
+    ]
+
+    # the new index is built before the ones it replaces are dropped, so lookups by customer stay indexed
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['customer', '-date', '-id'], name='reservation_customer_date_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='reservation',
+            name='bookstoreap_custome_b97d1e_hash',
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='bookstoreapi.customer'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0007_reservation_customer_date_index'),
+    ]
+
+    # reservations made before holds existed never expire, so the column is nullable and adding it rewrites nothing
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(
+                condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='reservation_hold_expiry_idx'
+            ),
+        ),
+    ]
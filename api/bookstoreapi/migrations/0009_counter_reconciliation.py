@@ -0,0 +1,30 @@
+# Generated by Django 4.2.3 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0008_reservation_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterReconciliation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter', models.CharField(max_length=100)),
+                ('fix', models.BooleanField(default=False)),
+                ('checked', models.BigIntegerField(default=0)),
+                ('drifted', models.BigIntegerField(default=0)),
+                ('drift', models.BigIntegerField(default=0)),
+                ('fixed', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['counter', '-finished_at'], name='reconciliation_latest_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0009_counter_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='shard_reserved',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('reserved', models.BigIntegerField(default=0)),
+                ('book', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='bookstoreapi.book')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stockshard',
+            constraint=models.UniqueConstraint(fields=('book', 'shard'), name='stock_shard_book_shard_unique'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstoreapi', '0010_stock_shards'),
+    ]
+
+    # the model has had default=0 since the baseline, 0001_initial was generated without it. Django doesn't keep
+    # defaults in the database, so this only catches the migration state up with the model.
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='quantity',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,33 +1,84 @@
 import uuid
 
 from django.conf import settings
-from django.contrib.postgres.indexes import HashIndex
+from django.contrib.postgres.indexes import GinIndex, HashIndex, OpClass
 from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Collate, Upper
 
-from .managers import BookManager
+from .managers import BookManager, ReservationQuerySet
+
+
+def row_version(model):
+    """
+    Postgres' version of a row of model, the id of the transaction that last wrote it, as a number to compare
+    """
+    return RawSQL(f'"{model._meta.db_table}".xmin::text::bigint', [], output_field=models.BigIntegerField())
 
 
 class Book(models.Model):
     """
     Book model with title, author, genre, quantity
+    GIN indexes back every branch of BookManager.search and similar, the trigram ones are on UPPER(column) for icontains
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=100)
     author = models.CharField(max_length=100)
     genre = models.CharField(max_length=100)
+    # reserved copies, decayed over time, see popularity.py
     popularity = models.IntegerField(default=0)
     quantity = models.IntegerField(default=0)
     image_url = models.CharField(max_length=100, null=True)
+    # rows the stock is split across for hot titles, 0 when quantity is the stock, see stock.py
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+    # copies reserved from the shards that popularity already counts
+    shard_reserved = models.BigIntegerField(default=0)
+    # maintained by the bookstoreapi_book_search_vector_trigger database trigger
     search_vector = SearchVectorField(null=True, editable=False)
 
     objects = BookManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_gin"),
+            GinIndex(OpClass(Upper("title"), name="gin_trgm_ops"), name="book_title_trgm_gin"),
+            GinIndex(OpClass(Upper("author"), name="gin_trgm_ops"), name="book_author_trgm_gin"),
+            GinIndex(OpClass(Upper("genre"), name="gin_trgm_ops"), name="book_genre_trgm_gin"),
+            # serves the popular ranking without a sort, see popularity.py
+            models.Index(fields=["-popularity", "id"], name="book_popularity_idx"),
+            # matches imported rows to existing books, see importer.py
+            models.Index(fields=["title", "author"], name="book_title_author_idx"),
+            # prefix matches in index order for suggestions, "C" sorts like the LIKE prefix range, see BookManager.suggest
+            models.Index(Collate(Upper("title"), "C"), name="book_title_prefix_idx"),
+            models.Index(Collate(Upper("author"), "C"), name="book_author_prefix_idx"),
+        ]
+
     def __str__(self):
         return f"{id}:self.title"
 
 
+class StockShard(models.Model):
+    """
+    A share of the stock of a sharded book, reservations take their copies from one shard instead of the book row
+    """
+
+    # indexed by stock_shard_book_shard_unique
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_index=False)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+    # copies ever reserved from this shard, folded into the book's popularity, see stock.refresh
+    reserved = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["book", "shard"], name="stock_shard_book_shard_unique")]
+
+    def __str__(self):
+        return f"{self.book_id}:{self.shard}"
+
+
 class Customer(models.Model):
     """
     Customer model with user, mailing_address, max_reservations
@@ -46,17 +97,71 @@ class Customer(models.Model):
 class Reservation(models.Model):
     """
     Reservation model with customer, book, quantity, and date
-    Hash indexes on customer and book make it fast to query reservations for a customer or book
+    A customer's reservations are read newest first straight off the (customer, date DESC, id DESC) index, which
+    also serves range scans on date and every lookup by customer. A hash index makes lookups by book fast.
+    Reservations made while holds are on expire, a partial index on expires_at finds the expired ones, see holds.py.
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=False)
+    # indexed by reservation_customer_date_idx
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=False, db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, null=False)
     quantity = models.IntegerField(null=False)
     date = models.DateField(auto_now_add=True, null=False)
+    # null for reservations that are kept until cancelled
+    expires_at = models.DateTimeField(null=True)
+
+    objects = ReservationQuerySet.as_manager()
 
     class Meta:
-        indexes = [HashIndex(fields=["customer"]), HashIndex(fields=["book"])]
+        indexes = [
+            models.Index(fields=["customer", "-date", "-id"], name="reservation_customer_date_idx"),
+            HashIndex(fields=["book"]),
+            models.Index(
+                fields=["expires_at"], condition=Q(expires_at__isnull=False), name="reservation_hold_expiry_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.customer} - {self.book} - {self.quantity} - {self.date}"
+
+
+class CatalogImport(models.Model):
+    """
+    Progress of an import_books run, the counts are committed with every batch so an interrupted import can resume
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    # input rows consumed, including skipped ones
+    rows = models.BigIntegerField(default=0)
+    inserted = models.BigIntegerField(default=0)
+    updated = models.BigIntegerField(default=0)
+    skipped = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.name
+
+
+class CounterReconciliation(models.Model):
+    """
+    A reconcile_counters run over one denormalized counter, the counts are committed with every chunk
+    """
+
+    # e.g. customer.current_reservations, see reconciliation.COUNTERS
+    counter = models.CharField(max_length=100)
+    fix = models.BooleanField(default=False)
+    checked = models.BigIntegerField(default=0)
+    drifted = models.BigIntegerField(default=0)
+    # sum of the absolute differences
+    drift = models.BigIntegerField(default=0)
+    fixed = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["counter", "-finished_at"], name="reconciliation_latest_idx")]
+
+    def __str__(self):
+        return f"{self.counter} {self.started_at}"
@@ -0,0 +1,145 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a fixed ordering
+    The cursor holds the sort key of the last row of the previous page, so the next page is a range scan starting
+    right after it instead of an OFFSET scan, and no COUNT(*) is run. The ordering must end in a unique column.
+    Opt in by sending the cursor query parameter, empty for the first page. With a limit, the cursor also counts
+    the rows served so far and the pages stop after limit rows.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = 50
+
+    def __init__(self, ordering, page_size=None, limit=None):
+        self.ordering = ordering
+        if page_size is not None:
+            self.page_size = page_size
+        self.limit = limit
+        self.served = 0
+        self.next_cursor = None
+
+    @classmethod
+    def requested(cls, request):
+        """
+        True if the client asked for cursor pagination instead of page numbers
+        """
+        return cls.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.trim(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.trim([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(self.to_python(queryset, position)))
+        # fetch one extra row to know whether there is a next page
+        return queryset.order_by(*self.ordering)[: self.current_page_size() + 1]
+
+    def current_page_size(self):
+        if self.limit is None:
+            return self.page_size
+        return min(self.page_size, self.limit - self.served)
+
+    def trim(self, rows):
+        page_size = self.current_page_size()
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            if self.limit is None or self.served + page_size < self.limit:
+                self.next_cursor = self.encode_cursor(rows[-1], self.served + page_size)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.next_cursor, "results": data})
+
+    def after(self, position):
+        """
+        Rows strictly after position in the ordering, written so postgres can range scan an index on the ordering
+        (a, b) > (x, y) becomes a >= x AND (a > x OR (a = x AND b > y))
+        """
+        condition = None
+        for field, value in reversed(list(zip(self.ordering, position))):
+            name, descending = field.lstrip("-"), field.startswith("-")
+            strictly_after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            condition = strictly_after if condition is None else strictly_after | (Q(**{name: value}) & condition)
+        name, descending = self.ordering[0].lstrip("-"), self.ordering[0].startswith("-")
+        return Q(**{f"{name}__{'lte' if descending else 'gte'}": position[0]}) & condition
+
+    def to_python(self, queryset, position):
+        """
+        The cursor's values converted for the fields of the ordering, a cursor that doesn't fit them is invalid
+        """
+        values = []
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip("-")
+            if name in queryset.query.annotations:
+                output_field = queryset.query.annotations[name].output_field
+            else:
+                output_field = queryset.model._meta.get_field(name)
+            if value is None or isinstance(value, (list, dict, bool)):
+                raise NotFound("Invalid cursor")
+            try:
+                values.append(output_field.to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound("Invalid cursor")
+        return values
+
+    def encode_cursor(self, row, served):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            position.append(value if isinstance(value, (int, float)) else str(value))
+        if self.limit is not None:
+            position.append(served)
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if not isinstance(position, list) or len(position) != len(self.ordering) + (self.limit is not None):
+            raise NotFound("Invalid cursor")
+        if self.limit is not None:
+            *position, served = position
+            if type(served) is not int or not 0 < served < self.limit:
+                raise NotFound("Invalid cursor")
+            self.served = served
+        return position
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """
+    PageNumberPagination for async views, the count and the page are fetched with the async ORM
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        # Paginator.count is a cached property, filling it in keeps the paginator from querying synchronously
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [row async for row in self.page.object_list]
+        self.request = request
+        return list(self.page)
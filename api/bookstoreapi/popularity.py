@@ -0,0 +1,41 @@
+"""
+Popularity ranking
+Book.popularity counts reserved copies, it is fed by the reservation views, taken back by cancellations (see
+cancellation.py) and decayed over time by the decay_popularity command. The (popularity DESC, id) b-tree index on
+Book is the ranked list: postgres keeps it ordered on every counter update, so the top N is read straight off the
+index without sorting the catalog.
+"""
+from django.db.models import F, IntegerField
+from django.db.models.functions import Cast, Floor
+
+from .cache import invalidate_catalog
+from .models import Book
+
+# the popular listing is capped, books further down are not meaningfully popular
+POPULAR_LIMIT = 999
+
+
+def popular_books():
+    """
+    Books ordered by popularity, matching the book_popularity_idx index
+    """
+    return Book.objects.order_by("-popularity", "id")
+
+
+def reserved(quantity):
+    """
+    Popularity after reserving copies, to be folded into the same UPDATE that takes the stock
+    """
+    return F("popularity") + quantity
+
+
+def decay(factor):
+    """
+    Multiply every popularity by factor, run periodically this makes the score an exponentially time-decayed count
+    Returns the number of books updated
+    """
+    updated = Book.objects.filter(popularity__gt=0).update(
+        popularity=Cast(Floor(F("popularity") * float(factor)), IntegerField())
+    )
+    invalidate_catalog()
+    return updated
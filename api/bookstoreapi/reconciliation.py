@@ -0,0 +1,167 @@
+"""
+Reconciliation of the denormalized counters, driven by the reconcile_counters management command
+Customer.current_reservations is the total quantity of the customer's reservations. It is recomputed one chunk of
+customers at a time, keyset paginated on the primary key, so a run never holds anything for long on a large table.
+Each chunk is a single statement: the customers and one grouped aggregate of their reservations, read off
+reservation_customer_date_idx. A counter is always committed together with the reservations it counts, and a single
+statement sees a single snapshot, so a chunk is checked without locks and every difference it finds is real drift.
+A drifted counter is fixed by locking it first and recomputing it in a later statement, which sees everything
+committed by the transactions that held the lock, while newer ones wait for the fix.
+Book.quantity counts the copies left, the stock they were taken from isn't recorded, so it can only be checked for
+impossible negative values, which a fix sets to zero. For a sharded book it is the cached sum of its shards, which a
+fix refreshes, see stock.py.
+Every run is recorded as a CounterReconciliation, the metrics endpoint exposes the drift found by the latest ones.
+"""
+import uuid
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import stock
+from .cache import invalidate_catalog
+from .models import Book, CounterReconciliation, Customer, Reservation, StockShard
+
+CHUNK_SIZE = 1000
+
+CUSTOMER_CHUNK = f"""
+WITH chunk AS (
+    SELECT id, current_reservations FROM {Customer._meta.db_table} WHERE id > %(after)s ORDER BY id LIMIT %(chunk_size)s
+), held AS (
+    -- the key range of the chunk rather than its ids, so it is a range scan of reservation_customer_date_idx
+    SELECT customer_id, sum(quantity) AS quantity FROM {Reservation._meta.db_table}
+    WHERE customer_id > %(after)s AND customer_id <= (SELECT id FROM chunk ORDER BY id DESC LIMIT 1)
+    GROUP BY customer_id
+)
+SELECT chunk.id, chunk.current_reservations, COALESCE(held.quantity, 0)
+FROM chunk LEFT JOIN held ON held.customer_id = chunk.id
+ORDER BY chunk.id
+"""
+
+
+@dataclass
+class Drift:
+    id: uuid.UUID
+    stored: int
+    expected: int
+
+
+def customer_chunk(after, chunk_size):
+    """
+    The ids of the chunk of customers after the id after and the drifted counters among them
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(CUSTOMER_CHUNK, {"after": after, "chunk_size": chunk_size})
+        rows = cursor.fetchall()
+    return [id for id, _, _ in rows], [Drift(id, stored, held) for id, stored, held in rows if stored != held]
+
+
+def fix_customers(ids):
+    """
+    Recompute the counters of customers, returns how many were still drifted
+    """
+    held = Reservation.objects.filter(customer=OuterRef("pk")).values("customer").annotate(total=Sum("quantity"))
+    expected = Coalesce(Subquery(held.values("total")), 0)
+    with transaction.atomic():
+        # the update's snapshot is taken once the locks are held, so it sees the transactions that held them
+        list(Customer.objects.select_for_update(no_key=True).filter(pk__in=ids).order_by("pk").values_list("pk"))
+        return (
+            Customer.objects.filter(pk__in=ids)
+            .alias(expected=expected)
+            .exclude(current_reservations=F("expected"))
+            .update(current_reservations=expected)
+        )
+
+
+def book_chunk(after, chunk_size):
+    """
+    The ids of the chunk of books after the id after and the ones with negative stock among them, or for sharded
+    books a cached total that isn't the sum of their shards
+    """
+    shard_total = StockShard.objects.filter(book=OuterRef("pk")).values("book").annotate(total=Sum("quantity"))
+    rows = list(
+        Book.objects.filter(pk__gt=after)
+        .order_by("pk")
+        .annotate(shard_total=Case(When(stock_shards__gt=0, then=Subquery(shard_total.values("total")))))
+        .values_list("pk", "quantity", "shard_total")[:chunk_size]
+    )
+    drifts = [
+        Drift(id, quantity, 0 if total is None else total)
+        for id, quantity, total in rows
+        if (quantity < 0 if total is None else quantity != total)
+    ]
+    return [id for id, _, _ in rows], drifts
+
+
+def fix_books(ids):
+    """
+    Put negative stock back to zero and refresh the totals of sharded books, returns how many books were fixed
+    """
+    fixed = Book.objects.filter(pk__in=ids, quantity__lt=0, stock_shards=0).update(quantity=0)
+    if fixed:
+        invalidate_catalog()
+    for book_id in Book.objects.filter(pk__in=ids, stock_shards__gt=0).values_list("pk", flat=True):
+        fixed += stock.refresh(book_id, wait=True)
+    return fixed
+
+
+# counter name: (check a chunk, fix drifted ids)
+COUNTERS = {
+    "customer.current_reservations": (customer_chunk, fix_customers),
+    "book.quantity": (book_chunk, fix_books),
+}
+
+
+def reconcile(counter, fix=False, chunk_size=CHUNK_SIZE, report=None):
+    """
+    Check every value of counter, fixing the drifted ones when fix is set, returns the CounterReconciliation
+    report is called with every Drift found
+    """
+    check, fix_ids = COUNTERS[counter]
+    run = CounterReconciliation.objects.create(counter=counter, fix=fix)
+    # uuids compare as bytes, nothing sorts before the nil uuid
+    after = uuid.UUID(int=0)
+    while True:
+        ids, drifts = check(after, chunk_size)
+        if not ids:
+            break
+        after = ids[-1]
+        for drift in drifts:
+            if report:
+                report(drift)
+        run.checked += len(ids)
+        run.drifted += len(drifts)
+        run.drift += sum(abs(drift.stored - drift.expected) for drift in drifts)
+        if fix and drifts:
+            run.fixed += fix_ids([drift.id for drift in drifts])
+        run.save(update_fields=["checked", "drifted", "drift", "fixed"])
+    run.finished_at = timezone.now()
+    run.save(update_fields=["finished_at"])
+    return run
+
+
+def render_metrics():
+    """
+    Drift found by the latest finished run of every counter, in the Prometheus text exposition format
+    """
+    runs = list(
+        CounterReconciliation.objects.filter(finished_at__isnull=False)
+        .order_by("counter", "-finished_at")
+        .distinct("counter")
+    )
+    if not runs:
+        return ""
+    series = {
+        "bookstore_counter_checked": lambda run: run.checked,
+        "bookstore_counter_drifted": lambda run: run.drifted,
+        "bookstore_counter_drift": lambda run: run.drift,
+        "bookstore_counter_fixed": lambda run: run.fixed,
+        "bookstore_counter_reconciled_timestamp_seconds": lambda run: round(run.finished_at.timestamp(), 3),
+    }
+    lines = []
+    for name, value in series.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f'{name}{{counter="{run.counter}"}} {value(run)}' for run in runs]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,20 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, several times faster than the json module on list pages
+    Output is compact UTF-8 like DRF's default settings, types orjson doesn't know (lazy strings, decimals, ...) go
+    through DRF's encoder. Indented output, as requested by the browsable API, is left to JSONRenderer.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=self.encoder.default)
@@ -0,0 +1,113 @@
+"""
+Read replica routing
+Catalog reads (Book, including BookManager.search) go to the optional "replica" database, everything else and every
+write goes to the primary. A request reads the catalog from the primary instead when:
+- it writes or is a write method (POST, PUT, PATCH, DELETE), so it never updates a book it read from a lagging copy
+- it runs inside a transaction on the primary
+- its user wrote less than REPLICA_PIN_SECONDS ago, which gives writers read-your-writes on their next requests
+  (see cache.remember_writer), everyone else keeps reading from the replica
+- the replica can't be reached, it is then left alone for REPLICA_RETRY_SECONDS
+Reservations and customers are always read from the primary, so a reservation shows up in the list right away.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .models import Book
+
+REPLICA = "replica"
+
+logger = logging.getLogger(__name__)
+
+_pinned = ContextVar("pinned_to_primary", default=None)
+_replica_down_until = 0.0
+_replica_lock = threading.Lock()
+
+
+class PrimaryPin:
+    """
+    Whether the current request reads from the primary and whether it wrote, mutable so pins made in the threads of
+    async views stick
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def request_routing(method):
+    """
+    Routing state of one request, write methods are pinned to the primary from the start
+    """
+    token = _pinned.set(PrimaryPin(pinned=method not in ("GET", "HEAD", "OPTIONS")))
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def pin_primary(wrote=False):
+    """
+    Read from the primary for the rest of the current request
+    """
+    pin = _pinned.get()
+    if pin is None:
+        pin = PrimaryPin()
+        _pinned.set(pin)
+    pin.pinned = True
+    pin.wrote = pin.wrote or wrote
+
+
+def pinned():
+    pin = _pinned.get()
+    return pin is not None and pin.pinned
+
+
+def wrote():
+    pin = _pinned.get()
+    return pin is not None and pin.wrote
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+def replica_available():
+    """
+    True if a replica is configured and can be connected to, failures are remembered for REPLICA_RETRY_SECONDS
+    """
+    global _replica_down_until
+    if not replica_configured() or time.monotonic() < _replica_down_until:
+        return False
+    try:
+        connections[REPLICA].ensure_connection()
+    except DatabaseError:
+        logger.warning("Replica unavailable, reading from the primary", exc_info=True)
+        with _replica_lock:
+            _replica_down_until = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        return False
+    return True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model is not Book or pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA if replica_available() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_primary(wrote=True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
@@ -1,5 +1,7 @@
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, update_last_login
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenObtainSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 from .models import Book, Customer, Reservation
 
@@ -17,12 +19,102 @@ class UserSerializer(serializers.ModelSerializer):
         ]
 
 
+class BookstoreTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Embeds customer_id and is_staff in the tokens so requests can be authorized from the claims alone
+    Refreshed access tokens copy the claims from the refresh token
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return cls.token_for(user, Customer.objects.filter(user=user).values_list("id", flat=True).first())
+
+    @classmethod
+    def token_for(cls, user, customer_id):
+        """
+        Refresh token of a user whose customer id is already known
+        """
+        token = super().get_token(user)
+        token["customer_id"] = str(customer_id) if customer_id else None
+        token["is_staff"] = user.is_staff
+        return token
+
+
+class LoginSerializer(BookstoreTokenObtainPairSerializer):
+    """
+    Credentials checked once for the tokens and the customer of the user, see CustomerLoginAPIView
+    """
+
+    def validate(self, attrs):
+        # authenticates and sets self.user, the tokens are made here with the customer loaded once
+        TokenObtainSerializer.validate(self, attrs)
+        customer = Customer.objects.filter(user=self.user).first()
+        if customer is not None:
+            customer.user = self.user
+        refresh = self.token_for(self.user, customer.id if customer else None)
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
+        return {"refresh": str(refresh), "access": str(refresh.access_token), "customer": customer}
+
+
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ["id", "title", "author", "genre", "quantity"]
 
 
+BOOK_FIELDS = BookSerializer.Meta.fields
+RESERVATION_FIELDS = ["id", "book", "quantity", "date", "expires_at", "customer"]
+# columns of a values() queryset that reservation_rows turns into ReservationBookSerializer output
+RESERVATION_COLUMNS = [
+    "id", "quantity", "date", "expires_at", "customer_id", *[f"book__{field}" for field in BOOK_FIELDS]
+]
+# formats datetimes like ModelSerializer does
+DATETIME = serializers.DateTimeField()
+
+
+def sparse_fields(request, allowed):
+    """
+    The fields listed in the fields query param (comma separated), all of allowed when it is absent
+    Raises ValidationError for fields that aren't allowed, so the response is a 400
+    """
+    requested = request.query_params.get("fields")
+    if not requested:
+        return allowed
+    fields = [field for field in requested.split(",") if field]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise serializers.ValidationError({"fields": [f"Choose from {', '.join(allowed)}"]})
+    return [field for field in allowed if field in fields]
+
+
+def book_rows(rows, fields=BOOK_FIELDS):
+    """
+    BookSerializer output for values() rows, or already serialized books, limited to fields
+    List endpoints build their pages with it, skipping model instances and serializer fields altogether.
+    """
+    return [{field: str(row[field]) if field == "id" else row[field] for field in fields} for row in rows]
+
+
+def reservation_rows(rows, fields=RESERVATION_FIELDS):
+    """
+    ReservationBookSerializer output for values(*RESERVATION_COLUMNS) rows, limited to fields
+    """
+    reservations = []
+    for row in rows:
+        reservation = {
+            "id": str(row["id"]),
+            "book": {field: str(row["book__id"]) if field == "id" else row[f"book__{field}"] for field in BOOK_FIELDS},
+            "quantity": row["quantity"],
+            "date": row["date"].isoformat(),
+            "expires_at": DATETIME.to_representation(row["expires_at"]) if row["expires_at"] else None,
+            # a primary key, as PrimaryKeyRelatedField gives it
+            "customer": row["customer_id"],
+        }
+        reservations.append({field: reservation[field] for field in fields})
+    return reservations
+
+
 class CustomerSerializer(serializers.ModelSerializer):
     user = UserSerializer(required=False)
 
@@ -52,12 +144,63 @@ class CustomerSerializer(serializers.ModelSerializer):
         return customer
 
 
+class ReservationSummarySerializer(serializers.Serializer):
+    reservations = serializers.IntegerField()
+    active = serializers.IntegerField()
+    copies = serializers.IntegerField()
+    next_expiry = serializers.DateTimeField(allow_null=True)
+
+
 class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = "__all__"
 
 
+class ReservationCreateSerializer(serializers.Serializer):
+    """
+    Validates a reservation request without loading the book or customer, the stock and limit checks are done by
+    conditional updates in ReservationAPIView.post
+    """
+
+    book = serializers.UUIDField()
+    customer = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationItemSerializer(serializers.Serializer):
+    book = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationBulkCreateSerializer(serializers.Serializer):
+    """
+    A multi-book checkout for one customer, validated without touching the database
+    """
+
+    customer = serializers.UUIDField()
+    items = ReservationItemSerializer(many=True, allow_empty=False)
+
+
+class ReservationCancelSerializer(serializers.Serializer):
+    """
+    Reservations of one customer to cancel, all of them when ids is left out
+    """
+
+    customer = serializers.UUIDField()
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, required=False)
+
+
+class ReservationFilterSerializer(serializers.Serializer):
+    """
+    Query params of the reservation list, dates are inclusive
+    """
+
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    active = serializers.BooleanField(required=False)
+
+
 class ReservationBookSerializer(serializers.ModelSerializer):
     book = BookSerializer()
 
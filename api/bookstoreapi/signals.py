@@ -0,0 +1,25 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .cache import invalidate_catalog
+from .models import Book
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, **kwargs):
+    """
+    Any saved or deleted book invalidates the catalog cache, covering the API, the admin and the shell
+    Queryset updates don't send signals, callers that update stock that way invalidate explicitly
+    """
+    invalidate_catalog()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    """
+    Count the queries of every connection, including the per-thread ones used by async views
+    """
+    metrics.install(connection)
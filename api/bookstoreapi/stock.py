@@ -0,0 +1,160 @@
+"""
+Sharded stock for hot titles
+A reservation takes its copies with a conditional update of the book row, which it then holds locked until it
+commits, so concurrent reservations of a bestseller go through one at a time. The stock of a hot book can be sharded
+instead: split across stock_shards StockShard rows, with each reservation taking its copies from one of them. It
+starts at a random shard and takes the first one that has enough copies and isn't locked. When every such shard is
+locked it waits on the random one, and when that one has run dry every shard is locked and the stock is gathered and
+spread evenly again. Up to as many reservations as there are shards go through at once.
+For a sharded book, Book.quantity is a cached total for the catalog reads. Each reservation refreshes it once
+committed, but a refresh is skipped while another one holds the book row, so reservations never wait on that row and
+the total can lag until the next refresh (the book.quantity reconciliation refreshes it too).
+The same refresh folds the copies reserved from the shards into the popularity.
+Shard or unshard a book with the shard_stock command.
+"""
+import random
+
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, Case, F, IntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Mod
+
+from .cache import invalidate_catalog, invalidate_stock
+from .models import Book, StockShard
+
+SHARDS = 8
+
+REFRESH = f"""
+UPDATE {Book._meta.db_table} AS book
+SET quantity = shards.quantity,
+    popularity = book.popularity + shards.reserved - book.shard_reserved,
+    shard_reserved = shards.reserved
+FROM (
+    SELECT sum(quantity) AS quantity, sum(reserved) AS reserved FROM {StockShard._meta.db_table}
+    WHERE book_id = %(book)s
+) AS shards
+WHERE book.id = (
+    SELECT id FROM {Book._meta.db_table} WHERE id = %(book)s AND stock_shards > 0 FOR NO KEY UPDATE {{skip_locked}}
+)
+"""
+
+
+def split(total, shards):
+    """
+    total copies spread over shards as evenly as they go
+    """
+    return [total // shards + (1 if shard < total % shards else 0) for shard in range(shards)]
+
+
+def spread(quantities):
+    """
+    Update expression setting the quantity of shard n to quantities[n]
+    """
+    whens = [When(shard=n, then=Value(quantity)) for n, quantity in enumerate(quantities)]
+    return Case(*whens, output_field=IntegerField())
+
+
+def available(book_id):
+    """
+    Copies of a book in stock, summed over the shards of a sharded book
+    """
+    book = Book.objects.values("quantity", "stock_shards").get(pk=book_id)
+    if not book["stock_shards"]:
+        return book["quantity"]
+    return StockShard.objects.filter(book=book_id).aggregate(total=Sum("quantity"))["total"]
+
+
+def take(book_id, shards, quantity, popularity=True):
+    """
+    Take quantity copies of a book sharded in shards rows, returns whether there were enough
+    Call it within the reservation's transaction. The copies count towards the book's popularity at the next
+    refresh, set popularity to False when the caller updates the popularity itself.
+    """
+    taken = {"quantity": F("quantity") - quantity}
+    if popularity:
+        taken["reserved"] = F("reserved") + quantity
+    stocked = StockShard.objects.filter(book=book_id, quantity__gte=quantity)
+    start = random.randrange(shards)
+    unlocked = (
+        stocked.select_for_update(no_key=True, skip_locked=True)
+        .order_by(Mod(F("shard") + (shards - start), shards))
+        .values("pk")[:1]
+    )
+    # = rather than IN, so the shard is picked once (an InitPlan) instead of by a subquery rescanned for every shard
+    if stocked.filter(pk=Subquery(unlocked)).update(**taken):
+        return True
+    if stocked.filter(shard=start).update(**taken):
+        return True
+    return rebalance(book_id, quantity, popularity)
+
+
+def rebalance(book_id, quantity=0, popularity=True):
+    """
+    Lock every shard of a book, take quantity copies from their total and spread the rest evenly again
+    Returns False, leaving the shards as they were, when the total is short
+    """
+    shards = list(
+        StockShard.objects.select_for_update(no_key=True).filter(book=book_id).order_by("shard").values_list("quantity")
+    )
+    total = sum(shard_quantity for shard_quantity, in shards)
+    if not shards or total < quantity:
+        return False
+    updates = {"quantity": spread(split(total - quantity, len(shards)))}
+    if popularity and quantity:
+        updates["reserved"] = Case(
+            When(shard=0, then=F("reserved") + quantity), default=F("reserved"), output_field=BigIntegerField()
+        )
+    StockShard.objects.filter(book=book_id).update(**updates)
+    return True
+
+
+def refresh(book_id, wait=False):
+    """
+    Cache the stock of a sharded book in Book.quantity and fold the copies reserved from its shards into popularity
+    Skipped when another transaction holds the book row, unless wait is set. Returns whether the book was refreshed.
+    """
+    with connections[router.db_for_write(Book)].cursor() as cursor:
+        cursor.execute(REFRESH.format(skip_locked="" if wait else "SKIP LOCKED"), {"book": book_id})
+        refreshed = cursor.rowcount
+    if refreshed:
+        invalidate_stock([book_id])
+    return bool(refreshed)
+
+
+def reset(book_id):
+    """
+    Spread the Book.quantity of a sharded book across its shards again, after staff or an import set it directly
+    """
+    with transaction.atomic():
+        book = Book.objects.select_for_update(no_key=True).values("quantity", "stock_shards").get(pk=book_id)
+        if not book["stock_shards"]:
+            return
+        list(StockShard.objects.select_for_update(no_key=True).filter(book=book_id).order_by("shard").values_list("pk"))
+        StockShard.objects.filter(book=book_id).update(quantity=spread(split(book["quantity"], book["stock_shards"])))
+
+
+def unshard(book_id):
+    """
+    Put the stock of a sharded book back in the book row
+    """
+    with transaction.atomic():
+        if not Book.objects.select_for_update(no_key=True).values_list("stock_shards", flat=True).get(pk=book_id):
+            return
+        list(StockShard.objects.select_for_update(no_key=True).filter(book=book_id).order_by("shard").values_list("pk"))
+        refresh(book_id, wait=True)
+        StockShard.objects.filter(book=book_id).delete()
+        Book.objects.filter(pk=book_id).update(stock_shards=0, shard_reserved=0)
+        invalidate_catalog()
+
+
+def shard(book_id, shards=SHARDS):
+    """
+    Split the stock of a book across shards rows, a sharded book is first unsharded
+    """
+    with transaction.atomic():
+        unshard(book_id)
+        quantity = Book.objects.values_list("quantity", flat=True).get(pk=book_id)
+        StockShard.objects.bulk_create(
+            [StockShard(book_id=book_id, shard=n, quantity=share) for n, share in enumerate(split(quantity, shards))]
+        )
+        Book.objects.filter(pk=book_id).update(stock_shards=shards, shard_reserved=0)
+        invalidate_catalog()
@@ -1,8 +1,15 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from ..models import Book, Reservation
+from .utils import JWTTestCase, createCustomer
 
 
 class AuthAPITest(TestCase):
@@ -48,3 +55,84 @@ class AuthAPITest(TestCase):
 
         # Update the access token to the new one for future tests
         self.access_token = new_access_token
+
+
+class StatelessAuthTest(JWTTestCase):
+    def test_token_claims(self):
+        payload = AccessToken(self.token)
+        self.assertEqual(payload["customer_id"], str(self.user.customer.id))
+        self.assertFalse(payload["is_staff"])
+        self.assertTrue(AccessToken(self.staff_token)["is_staff"])
+
+    def test_authentication_costs_no_query(self):
+        book = Book.objects.create(title="Book 1", author="Author 1", genre="Genre 1")
+        # the only query is the book lookup
+        with self.assertNumQueries(1):
+            response = self.get(reverse("book_detail", kwargs={"id": book.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_without_claims(self):
+        # tokens issued before the claims were added still authorize through the database
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.staff_user).access_token}")
+        response = client.get(reverse("books"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer invalid")
+        response = client.get(reverse("books_popular"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LoginAPITest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = createCustomer(username="reader", password="testpassword")
+        book = Book.objects.create(title="Book 1", author="Author 1", genre="Genre 1", quantity=10)
+        cls.expiry = timezone.now() + timedelta(minutes=10)
+        Reservation.objects.create(book=book, customer=cls.customer, quantity=2)
+        Reservation.objects.create(book=book, customer=cls.customer, quantity=1, expires_at=cls.expiry)
+        Reservation.objects.create(
+            book=book, customer=cls.customer, quantity=3, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+    def login(self, username="reader", password="testpassword"):
+        return APIClient().post(reverse("customer_login"), {"username": username, "password": password}, format="json")
+
+    def test_login(self):
+        # the user, the customer and the reservation totals
+        with self.assertNumQueries(3):
+            response = self.login()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.data["access"])["customer_id"], str(self.customer.id))
+        self.assertEqual(RefreshToken(response.data["refresh"])["customer_id"], str(self.customer.id))
+        self.assertEqual(response.data["customer"]["id"], str(self.customer.id))
+        self.assertEqual(response.data["customer"]["user"]["username"], "reader")
+        self.assertNotIn("password", response.data["customer"]["user"])
+        next_expiry = self.expiry.isoformat().replace("+00:00", "Z")
+        self.assertEqual(
+            response.data["reservations"], {"reservations": 3, "active": 2, "copies": 3, "next_expiry": next_expiry}
+        )
+
+    def test_tokens_authorize(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login().data['access']}")
+        response = client.get(reverse("customer_detail", kwargs={"id": self.customer.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_wrong_password(self):
+        response = self.login(password="wrong")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertNotIn("access", response.data)
+
+    def test_user_without_customer(self):
+        User.objects.create_user(username="admin", password="testpassword", is_staff=True)
+
+        response = self.login(username="admin")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["customer"])
+        self.assertIsNone(response.data["reservations"])
+        self.assertTrue(AccessToken(response.data["access"])["is_staff"])
@@ -0,0 +1,64 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ..benchmark import Benchmark, InProcessClient, seed, seeded_customers, summarize, unseed
+from ..models import Book, Customer
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_summarize(self):
+        result = summarize([0.001 * i for i in range(1, 101)], elapsed=2.0, errors=1)
+        self.assertEqual(result["requests"], 100)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["throughput_rps"], 50.0)
+        self.assertEqual(result["p50_ms"], 50.5)
+        self.assertEqual(result["max_ms"], 100.0)
+
+    def test_scenarios_smoke(self):
+        # the concurrent scenarios need committed data, they are left to the benchmark command
+        seed(books=200, customers=3)
+        benchmark = Benchmark(InProcessClient, iterations=3, concurrency=2)
+        results = benchmark.run([name for name in benchmark.scenarios() if not name.startswith("concurrent_")])
+
+        self.assertEqual(results["search"]["errors"], 0)
+        self.assertEqual(results["book_detail"]["requests"], 3)
+        self.assertEqual(results["reservation_create_delete"]["create"]["errors"], 0)
+        self.assertEqual(results["reservation_create_delete"]["delete"]["requests"], 3)
+        self.assertGreater(results["serialization"]["values_rows_per_s"], 0)
+
+    def test_hot_title_speedup_without_throughput(self):
+        seed(books=10, customers=3)
+        benchmark = Benchmark(InProcessClient, iterations=3, concurrency=2)
+
+        with mock.patch.object(benchmark, "concurrent_reservations", return_value=summarize([], elapsed=1.0)):
+            result = benchmark.concurrent_hot_title()
+
+        self.assertIsNone(result["speedup"])
+
+    def test_seeded_users_have_no_password(self):
+        seed(books=10, customers=3)
+
+        users = User.objects.filter(customer__in=seeded_customers())
+        self.assertEqual(users.count(), 4)
+        self.assertFalse(any(user.has_usable_password() for user in users))
+        self.assertEqual(list(users.filter(is_staff=True).values_list("username", flat=True)), ["bench0"])
+
+        unseed()
+        self.assertFalse(Book.objects.exists() or Customer.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith="bench").exists())
+
+    def test_url_seeds_only_a_throwaway_database(self):
+        Book.objects.create(title="Kept", author="Author", genre="Genre")
+
+        with self.assertRaisesMessage(CommandError, "--seed needs a database without books or customers"):
+            call_command("benchmark", url="http://127.0.0.1:1", seed=True, books=10)
+        with self.assertRaisesMessage(CommandError, "No benchmark data"):
+            call_command("benchmark", url="http://127.0.0.1:1")
+        self.assertEqual(list(Book.objects.values_list("title", flat=True)), ["Kept"])
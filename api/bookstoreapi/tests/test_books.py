@@ -1,10 +1,19 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APIRequestFactory, force_authenticate
-from ..models import Book
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from ..benchmark import seed
+from ..models import Book, Reservation
 from ..serializers import BookSerializer
 from .utils import JWTTestCase
 
+import base64
+import json
 import uuid
 
 
@@ -134,3 +143,388 @@ class StaffBookTests(JWTTestCase):
 
         # Check if the request returns a 404 not found status code
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookSearchTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rome = Book.objects.create(title="The History of Rome", author="Mary Beard", genre="History")
+        cls.romans = Book.objects.create(title="Romans", author="Someone Else", genre="Fiction")
+        cls.unrelated = Book.objects.create(title="Cooking at Home", author="Chef", genre="Food")
+
+    def test_search_is_ranked(self):
+        response = self.get(reverse("books_search"), {"query": "history of rome"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [book["id"] for book in response.data["results"]]
+        self.assertEqual(ids[0], str(self.rome.id))
+        self.assertNotIn(str(self.unrelated.id), ids)
+
+    def test_search_matches_substring_and_similarity(self):
+        response = self.get(reverse("books_search"), {"query": "beard"})
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(self.rome.id)])
+
+        # misspelled author still matches, through the trigram similarity fallback
+        response = self.get(reverse("books_search"), {"query": "Mary Baerd"})
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(self.rome.id)])
+
+    def test_search_vector_follows_updates(self):
+        # the trigger keeps search_vector current for writes that bypass BookAPIView.post
+        Book.objects.filter(pk=self.unrelated.id).update(title="Baking Bread")
+        response = self.get(reverse("books_search"), {"query": "baked breads"})
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(self.unrelated.id)])
+
+        book = Book.objects.get(pk=self.unrelated.id)
+        self.assertIsNotNone(book.search_vector)
+
+    def test_search_runs_the_normalized_query(self):
+        # "Mary  Beard" and "mary beard" share a cache entry, so they must find the same books
+        for query in ["Mary  Beard", "mary beard"]:
+            response = self.get(reverse("books_search"), {"query": query})
+            self.assertEqual([book["id"] for book in response.data["results"]], [str(self.rome.id)])
+
+    def test_search_invalid_query(self):
+        for query in ["ro", "  ro  "]:
+            response = self.get(reverse("books_search"), {"query": query})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BookSearchPlanTests(JWTTestCase):
+    indexes = ["book_search_vector_gin", "book_title_trgm_gin", "book_author_trgm_gin", "book_genre_trgm_gin"]
+
+    @classmethod
+    def setUpTestData(cls):
+        # as many books as the catalog the sequential scans were measured on
+        seed(books=100000, customers=1)
+        with connection.cursor() as cursor:
+            # autovacuum would move the seeded rows out of the pending lists, which are costed as a full read
+            for index in cls.indexes:
+                cursor.execute("SELECT gin_clean_pending_list(%s::regclass)", [index])
+
+
+    def test_search_uses_the_gin_indexes(self):
+        for query in ["xylophone", "garden rome", "Author 42"]:
+            plan = Book.objects.search(query).explain()
+            self.assertNotIn("Seq Scan", plan)
+            for index in self.indexes:
+                self.assertIn(index, plan)
+
+    def test_exact_match_uses_the_gin_indexes(self):
+        # when there are matches a sequential scan stopping at the first one is fine, without it reads every book
+        plan = Book.objects.exact_match("xylophone").explain()
+        self.assertNotIn("Seq Scan", plan)
+        for index in self.indexes:
+            self.assertIn(index, plan)
+
+    def test_similar_uses_the_trigram_indexes(self):
+        plan = Book.objects.similar("Gardn Rme").explain()
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("book_title_trgm_gin", plan)
+        self.assertIn("book_author_trgm_gin", plan)
+
+    def test_lookup_falls_back_to_similar(self):
+        self.assertTrue(Book.objects.lookup("garden rome").filter(title__icontains="garden").exists())
+        self.assertTrue(Book.objects.lookup("Gardn Rme").exists())
+        self.assertFalse(Book.objects.exact_match("Gardn Rme").first())
+
+
+class BookSearchFacetTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rome = Book.objects.create(title="History of Rome", author="Mary Beard", genre="History", quantity=2)
+        cls.spqr = Book.objects.create(title="SPQR History", author="Mary Beard", genre="History", quantity=0)
+        cls.novel = Book.objects.create(title="A History Novel", author="Someone", genre="Fiction", quantity=1)
+        Book.objects.create(title="Cooking at Home", author="Chef", genre="Food", quantity=1)
+
+    def search(self, **params):
+        response = self.get(reverse("books_search"), {"query": "history", **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_facet_counts(self):
+        response = self.search(facets="true")
+
+        self.assertEqual(
+            response.data["facets"],
+            {
+                "genre": [{"value": "History", "count": 2}, {"value": "Fiction", "count": 1}],
+                "author": [{"value": "Mary Beard", "count": 2}, {"value": "Someone", "count": 1}],
+                "in_stock": [{"value": True, "count": 2}, {"value": False, "count": 1}],
+            },
+        )
+        self.assertNotIn("facets", self.search().data)
+
+    def test_filters(self):
+        response = self.search(genre="History", in_stock="true")
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(self.rome.id)])
+
+        response = self.search(genre=["History", "Fiction"], author="Mary Beard")
+        self.assertEqual({book["id"] for book in response.data["results"]}, {str(self.rome.id), str(self.spqr.id)})
+
+        response = self.get(reverse("books_search"), {"query": "history", "in_stock": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets_cached_per_query(self):
+        # facets ignore the filters, so narrowing the results reuses them
+        first = self.search(facets="true", genre="History")
+        # the exact match check, the page and its count, but no facet counts
+        with self.assertNumQueries(3):
+            second = self.search(query=" HISTORY", facets="true", genre="Fiction")
+        self.assertEqual(first.data["facets"], second.data["facets"])
+        self.assertEqual([book["id"] for book in second.data["results"]], [str(self.novel.id)])
+
+
+class BookSuggestTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rome = Book.objects.create(title="Rome", author="Mary Beard", genre="History")
+        cls.romans = Book.objects.create(title="Romans", author="Someone", genre="Fiction")
+        cls.walls = Book.objects.create(title="Walls", author="Romilly Jones", genre="History")
+        Book.objects.create(title="History of Rome", author="Chef", genre="History")
+
+    def test_title_then_author_completions(self):
+        response = self.get(reverse("books_suggest"), {"prefix": "rom"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": str(self.romans.id), "title": "Romans", "author": "Someone"},
+                {"id": str(self.rome.id), "title": "Rome", "author": "Mary Beard"},
+                {"id": str(self.walls.id), "title": "Walls", "author": "Romilly Jones"},
+            ],
+        )
+
+    def test_limit_and_cache(self):
+        response = self.get(reverse("books_suggest"), {"prefix": "ROM", "limit": 1})
+        self.assertEqual([book["title"] for book in response.data["results"]], ["Romans"])
+        with self.assertNumQueries(0):
+            self.get(reverse("books_suggest"), {"prefix": "rom", "limit": 1})
+
+    def test_invalid(self):
+        for params in [{}, {"prefix": " "}, {"prefix": "rom", "limit": "x"}, {"prefix": "rom", "limit": 0}]:
+            response = self.get(reverse("books_suggest"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="History of Rome", author="Mary Beard", genre="History", quantity=5)
+
+    def test_book_lists(self):
+        expected = [{"id": str(self.book.id), "title": "History of Rome"}]
+        for url, params, staff in [
+            (reverse("books"), {}, True),
+            (reverse("books"), {"cursor": ""}, True),
+            (reverse("books_search"), {"query": "rome"}, False),
+            (reverse("books_popular"), {}, False),
+        ]:
+            response = self.get(url, {**params, "fields": "title,id"}, staff=staff)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["results"], expected)
+
+            # the full representation is cached separately
+            response = self.get(url, params, staff=staff)
+            self.assertEqual(set(response.json()["results"][0]), {"id", "title", "author", "genre", "quantity"})
+
+    def test_reservations(self):
+        Reservation.objects.create(book=self.book, customer=self.user.customer, quantity=2)
+        response = self.get(reverse("reservations"), {"fields": "book,quantity"})
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "book": {
+                        "id": str(self.book.id),
+                        "title": "History of Rome",
+                        "author": "Mary Beard",
+                        "genre": "History",
+                        "quantity": 5,
+                    },
+                    "quantity": 2,
+                }
+            ],
+        )
+
+    def test_unknown_field(self):
+        response = self.get(reverse("books_popular"), {"fields": "title,search_vector"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("fields", response.json())
+
+
+class BookCursorPaginationTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(
+            [Book(title=f"History {i}", author=f"Author {i}", genre="History", popularity=i % 3) for i in range(120)]
+        )
+
+    def walk(self, url, params=None, staff=False):
+        params = dict(params or {}, cursor="")
+        ids = []
+        while True:
+            response = self.get(url, params, staff=staff)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            ids += [book["id"] for book in response.data["results"]]
+            if response.data["next"] is None:
+                return ids
+            params["cursor"] = response.data["next"]
+
+    def test_cursor_popular(self):
+        ids = self.walk(reverse("books_popular"))
+        expected = Book.objects.order_by("-popularity", "id").values_list("id", flat=True)
+        self.assertEqual(ids, [str(id) for id in expected])
+
+    def test_cursor_popular_is_capped(self):
+        with mock.patch("bookstoreapi.views.book.POPULAR_LIMIT", 70):
+            ids = self.walk(reverse("books_popular"))
+        expected = Book.objects.order_by("-popularity", "id").values_list("id", flat=True)[:70]
+        self.assertEqual(ids, [str(id) for id in expected])
+
+    def test_cursor_search(self):
+        ids = self.walk(reverse("books_search"), {"query": "history"})
+        self.assertEqual(len(ids), 120)
+        self.assertEqual(len(set(ids)), 120)
+
+    def test_cursor_list(self):
+        ids = self.walk(reverse("books"), staff=True)
+        self.assertEqual(ids, sorted(str(id) for id in Book.objects.values_list("id", flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.get(reverse("books_popular"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_values_of_the_wrong_type(self):
+        def cursor(*position):
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        book = str(Book.objects.first().id)
+        for url, params in [
+            (reverse("books_popular"), {"cursor": cursor("many", book, 50)}),
+            (reverse("books_popular"), {"cursor": cursor(None, book, 50)}),
+            (reverse("books_popular"), {"cursor": cursor(1, "not-a-uuid", 50)}),
+            (reverse("books_popular"), {"cursor": cursor(1, book)}),
+            (reverse("books_popular"), {"cursor": cursor(1, book, "50")}),
+            (reverse("books_popular"), {"cursor": cursor(1, book, 0)}),
+            (reverse("books_popular"), {"cursor": cursor(1, book, 999)}),
+            (reverse("books_search"), {"query": "history", "cursor": cursor("high", book)}),
+            (reverse("books_search"), {"query": "history", "cursor": cursor([0.5], book)}),
+        ]:
+            response = self.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, params)
+
+
+class PopularBookTests(JWTTestCase):
+    def test_popular_ordering(self):
+        low = Book.objects.create(title="Low", author="Author", genre="Genre", popularity=1)
+        high = Book.objects.create(title="High", author="Author", genre="Genre", popularity=10)
+        response = self.get(reverse("books_popular"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(high.id), str(low.id)])
+
+    def test_decay_popularity(self):
+        book = Book.objects.create(title="Book", author="Author", genre="Genre", popularity=9)
+        call_command("decay_popularity", factor=0.5, stdout=StringIO())
+        book.refresh_from_db()
+        self.assertEqual(book.popularity, 4)
+
+
+class BookCacheTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="History of Rome", author="Author", genre="History", quantity=5)
+
+    def test_book_detail_is_cached(self):
+        url = reverse("book_detail", kwargs={"id": self.book.id})
+        first = self.get(url)
+        with self.assertNumQueries(0):
+            second = self.get(url)
+        self.assertEqual(first.data, second.data)
+
+    def test_book_detail_not_modified(self):
+        url = reverse("book_detail", kwargs={"id": self.book.id})
+        etag = self.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # any change to the catalog gives a new etag
+        self.put(url, data={"title": "Rome", "author": "Author", "genre": "History"}, staff=True)
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["title"], "Rome")
+
+    def test_search_is_cached_per_normalized_query(self):
+        self.get(reverse("books_search"), {"query": "History"})
+        with self.assertNumQueries(0):
+            response = self.get(reverse("books_search"), {"query": "  history "})
+        self.assertEqual([book["id"] for book in response.data["results"]], [str(self.book.id)])
+
+    def test_reservation_invalidates_stock(self):
+        self.get(reverse("books_popular"))
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 2}
+        self.post(reverse("reservations"), data=data)
+
+        response = self.get(reverse("books_popular"))
+        self.assertEqual(response.data["results"][0]["quantity"], 3)
+
+    def test_reservation_only_invalidates_the_reserved_book(self):
+        other = Book.objects.create(title="History of Greece", author="Author", genre="History", quantity=5)
+        detail = reverse("book_detail", kwargs={"id": self.book.id})
+        etag = self.get(detail)["ETag"]
+        self.get(reverse("book_detail", kwargs={"id": other.id}))
+        self.get(reverse("books_search"), {"query": "history"})
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 2}
+        self.post(reverse("reservations"), data=data)
+
+        # the search page keeps its ids and the other book its entry, only the reserved book is read again
+        with self.assertNumQueries(1):
+            response = self.get(reverse("books_search"), {"query": "history"})
+        quantities = {book["id"]: book["quantity"] for book in response.data["results"]}
+        self.assertEqual(quantities, {str(self.book.id): 3, str(other.id): 5})
+        with self.assertNumQueries(0):
+            response = self.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["quantity"], 3)
+
+    def test_book_detail_by_hex_id(self):
+        response = self.get(reverse("book_detail", kwargs={"id": self.book.id.hex}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], str(self.book.id))
+
+        response = self.get(reverse("book_detail", kwargs={"id": "abc"}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncReadViewTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="History of Rome", author="Author", genre="History", quantity=5)
+
+    def test_requires_authentication(self):
+        for url in [reverse("books_search"), reverse("book_detail", kwargs={"id": self.book.id}), reverse("reservations")]:
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertIn("Bearer", response["WWW-Authenticate"])
+
+        response = APIClient(HTTP_AUTHORIZATION="Bearer invalid").get(reverse("books_popular"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_other_methods(self):
+        response = self.post(reverse("books_search"), data={})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        # writes on the same url still go to the DRF view
+        response = self.delete(reverse("book_detail", kwargs={"id": self.book.id}), staff=True)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    async def test_asgi_request(self):
+        response = await AsyncClient().get(
+            reverse("book_detail", kwargs={"id": self.book.id}), headers={"Authorization": f"Bearer {self.token}"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["title"], "History of Rome")
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
@@ -0,0 +1,82 @@
+import gzip
+
+import brotli
+from django.urls import reverse
+from rest_framework import status
+
+from ..models import Book, Customer, Reservation
+from .utils import JWTTestCase
+
+
+class CompressionTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(
+            [Book(title=f"History {i}", author="Author", genre="History", popularity=i) for i in range(50)]
+        )
+
+    def test_negotiated_encoding(self):
+        plain = self.get(reverse("books_popular"))
+        for accept, encoding, decompress in [
+            ("gzip, deflate, br", "br", brotli.decompress),
+            ("gzip;q=1.0, br;q=0.5", "gzip", gzip.decompress),
+            ("gzip", "gzip", gzip.decompress),
+        ]:
+            response = self.get(reverse("books_popular"), HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(response["Content-Encoding"], encoding)
+            self.assertIn("Accept-Encoding", response["Vary"])
+            self.assertEqual(decompress(response.content), plain.content)
+            self.assertEqual(response["ETag"], f"W/{plain['ETag']}")
+
+    def test_not_compressed(self):
+        for accept in ["", "identity", "br;q=0, gzip;q=0", "identity, gzip;q=0.5"]:
+            response = self.get(reverse("books_popular"), HTTP_ACCEPT_ENCODING=accept)
+            self.assertFalse(response.has_header("Content-Encoding"))
+        # under the size threshold
+        response = self.get(reverse("books_suggest"), {"prefix": "history 1", "limit": 1}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_weakened_etag_still_matches(self):
+        etag = self.get(reverse("books_popular"), HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        response = self.get(reverse("books_popular"), HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class ConditionalGetTests(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="History of Rome", author="Mary Beard", genre="History", quantity=5)
+
+    def assertNotModified(self, url, budget):
+        response = self.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(budget):
+            repeated = self.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(repeated.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(repeated.content, b"")
+        return response["ETag"]
+
+    def test_popular(self):
+        self.assertNotModified(reverse("books_popular"), 0)
+
+    def test_reservations(self):
+        customer = Customer.objects.get(user=self.user)
+        Reservation.objects.create(book=self.book, customer=customer, quantity=1)
+        etag = self.assertNotModified(reverse("reservations"), 1)
+
+        # a new reservation, or a change to the reserved books, changes it
+        response = self.post(reverse("reservations"), data={"book": self.book.id, "customer": customer.id, "quantity": 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.get(reverse("reservations"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_customer_detail(self):
+        customer = Customer.objects.get(user=self.user)
+        url = reverse("customer_detail", kwargs={"id": customer.id})
+        etag = self.assertNotModified(url, 1)
+
+        self.patch(url, data={"user": {"first_name": "Jane", "email": "jane@example.com"}})
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["user"]["first_name"], "Jane")
@@ -1,7 +1,7 @@
 import uuid
 from django.urls import reverse
 from rest_framework import status
-from ..models import Customer
+from ..models import Book, Customer, Reservation
 from ..serializers import CustomerSerializer
 from .utils import JWTTestCase
 from copy import deepcopy
@@ -124,6 +124,18 @@ class CustomerAPITest(JWTTestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Customer.objects.filter(pk=self.customer.id).exists(), False)
 
+    def test_delete_customer_releases_reservations(self):
+        book = Book.objects.create(title="Book", author="Author", genre="Genre", quantity=3)
+        Reservation.objects.create(book=book, customer=self.customer, quantity=2)
+        url = reverse("customer_detail", kwargs={"id": self.customer.id})
+
+        response = self.delete(url, staff=True)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        book.refresh_from_db()
+        self.assertEqual(book.quantity, 5)
+        self.assertFalse(Reservation.objects.exists())
+
     def test_delete_invalid_customer(self):
         url = reverse("customer_detail", kwargs={"id": uuid.uuid4()})
 
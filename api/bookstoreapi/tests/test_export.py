@@ -0,0 +1,89 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework import status
+
+from .. import export as exports
+from ..models import Book, Reservation
+from .utils import JWTTestCase, createCustomer
+
+
+class ExportTest(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [
+            Book.objects.create(title=f"Book {i}", author="Author", genre=genre, quantity=i)
+            for i, genre in enumerate(["History", "History", "Fiction"])
+        ]
+        customer = createCustomer(username="reader", password="password")
+        cls.old = Reservation.objects.create(book=cls.books[0], customer=customer, quantity=1)
+        cls.new = Reservation.objects.create(book=cls.books[2], customer=customer, quantity=2)
+        Reservation.objects.filter(pk=cls.old.pk).update(date=date(2024, 1, 15))
+
+    async def export(self, kind, token=None, headers=None, **params):
+        headers = {"Authorization": f"Bearer {token or self.staff_token}", **(headers or {})}
+        response = await AsyncClient().get(reverse("export", kwargs={"kind": kind}), params, headers=headers)
+        content = b"".join([part async for part in response.streaming_content]) if response.streaming else None
+        return response, content
+
+    async def test_books_ndjson(self):
+        response, content = await self.export("books", genre="History")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(sorted(row["title"] for row in rows), ["Book 0", "Book 1"])
+        self.assertEqual(set(rows[0]), {"id", "title", "author", "genre", "quantity", "popularity", "image_url"})
+
+    async def test_reservations_csv_gzipped(self):
+        response, content = await self.export(
+            "reservations", headers={"Accept-Encoding": "gzip, br"}, format="csv", since="2024-02-01"
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(content).decode())))
+        self.assertEqual([row["id"] for row in rows], [str(self.new.id)])
+        self.assertEqual((rows[0]["username"], rows[0]["title"], rows[0]["quantity"]), ("reader", "Book 2", "2"))
+
+    async def test_not_gzipped(self):
+        for accept in ["gzip;q=0", "identity, gzip;q=0.5", "br"]:
+            response, content = await self.export("books", headers={"Accept-Encoding": accept})
+
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertEqual(len(content.decode().splitlines()), len(self.books))
+
+    async def test_staff_only(self):
+        response, _ = await self.export("books", token=self.token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_invalid_filters(self):
+        for params in [{"format": "xml"}, {"since": "yesterday"}]:
+            response, _ = await self.export("reservations", **params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response, _ = await self.export("books", until="2024-01-01")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_chunks_without_server_side_cursors(self):
+        with mock.patch.dict(connection.settings_dict, {"DISABLE_SERVER_SIDE_CURSORS": True}):
+            chunks = list(exports.chunks(exports.queryset("books"), chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(sorted(row["id"] for chunk in chunks for row in chunk), sorted(book.id for book in self.books))
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reservations.ndjson.gz")
+            call_command("export", "reservations", "--output", path, "--until", "2024-01-31", "--chunk-size", "1")
+            with gzip.open(path, "rt") as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual([(row["id"], row["date"]) for row in rows], [(str(self.old.id), "2024-01-15")])
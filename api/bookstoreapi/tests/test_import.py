@@ -0,0 +1,78 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..importer import CatalogImporter
+from ..models import Book, CatalogImport
+
+
+class ImportBooksTest(TestCase):
+    def import_file(self, content, suffix=".csv", *args):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+            out = StringIO()
+            call_command("import_books", file.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_import(self):
+        Book.objects.create(title="Existing", author="Author", genre="Old", quantity=1)
+        output = self.import_file(
+            "title,author,genre,quantity,image_url\n"
+            "History of Rome,Mary Beard,History,5,\n"
+            "Existing,Author,New,3,http://example.com/cover.png\n"
+            "History of Rome,Mary Beard,History,7,\n"
+            ",No Title,Genre,1,\n"
+            "Dune,Frank Herbert,,not a number,\n"
+        )
+
+        self.assertIn("Imported 5 rows: 1 inserted, 1 updated, 2 skipped", output)
+        self.assertIn("Skipped row 4: title is required", output)
+        self.assertIn("Skipped row 5: quantity is not a number", output)
+        # the last occurrence in the input wins
+        rome = Book.objects.get(title="History of Rome")
+        self.assertEqual(rome.quantity, 7)
+        self.assertIsNone(rome.image_url)
+        existing = Book.objects.get(title="Existing")
+        self.assertEqual((existing.genre, existing.quantity), ("New", 3))
+        self.assertEqual(list(Book.objects.search("beard")), [rome])
+
+    def test_jsonl_import(self):
+        lines = [
+            json.dumps({"title": "Dune", "author": "Frank Herbert", "quantity": 2}),
+            "{not json",
+            "",
+            json.dumps(["a", "list"]),
+        ]
+        output = self.import_file("\n".join(lines) + "\n", ".jsonl")
+
+        self.assertIn("Imported 3 rows: 1 inserted, 0 updated, 2 skipped", output)
+        dune = Book.objects.get(title="Dune")
+        self.assertEqual((dune.genre, dune.quantity), ("", 2))
+
+    def test_reimport_changes_nothing(self):
+        content = "title,author,genre,quantity\nDune,Frank Herbert,Fiction,2\n"
+        self.import_file(content)
+        output = self.import_file(content)
+        self.assertIn("Imported 1 rows: 0 inserted, 0 updated, 0 skipped", output)
+        self.assertEqual(Book.objects.count(), 1)
+
+    def test_resume_after_interruption(self):
+        rows = [{"title": f"Book {i}", "author": "Author", "genre": "Genre", "quantity": i} for i in range(5)]
+
+        def interrupted():
+            yield from rows[:3]
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            CatalogImporter("books", batch_size=2).run(interrupted())
+        self.assertEqual(CatalogImport.objects.get(name="books").rows, 2)
+        self.assertEqual(Book.objects.count(), 2)
+
+        result = CatalogImporter("books", batch_size=2, resume=True).run(iter(rows))
+        self.assertEqual((result.rows, result.inserted), (5, 5))
+        self.assertIsNotNone(result.finished_at)
+        self.assertEqual(Book.objects.count(), 5)
@@ -0,0 +1,86 @@
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .. import metrics
+from ..models import Book
+from .utils import JWTTestCase
+
+
+class QueryBudgetTest(JWTTestCase):
+    """
+    Query budgets per endpoint, authentication is free so these are the queries the views themselves run
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="History of Rome", author="Author", genre="History", quantity=5)
+
+    def test_book_detail_budget(self):
+        with self.assertQueryBudget(1):
+            self.get(reverse("book_detail", kwargs={"id": self.book.id}))
+
+    def test_book_listing_budgets(self):
+        with self.assertQueryBudget(2):
+            self.get(reverse("books_popular"))
+        # whether anything matches exactly (or similar books are searched instead), the page and its count
+        with self.assertQueryBudget(3):
+            self.get(reverse("books_search"), {"query": "rome"})
+        with self.assertQueryBudget(1):
+            self.get(reverse("books_popular"), {"cursor": ""})
+
+    def test_reservation_budgets(self):
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 1}
+        # three statements plus the savepoint around them
+        with self.assertQueryBudget(5):
+            self.post(reverse("reservations"), data=data)
+        with self.assertQueryBudget(1):
+            self.get(reverse("reservations"))
+
+    def test_customer_detail_budget(self):
+        with self.assertQueryBudget(1):
+            self.get(reverse("customer_detail", kwargs={"id": self.user.customer.id}))
+
+
+class MetricsTest(JWTTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_server_timing_header(self):
+        book = Book.objects.create(title="Book", author="Author", genre="Genre")
+        response = self.get(reverse("book_detail", kwargs={"id": book.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+        self.assertIn("serialize;dur=", response["Server-Timing"])
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    def test_metrics_endpoint(self):
+        # one COUNT as there are no books to select, the second request is served from the cache
+        self.get(reverse("books_popular"))
+        self.get(reverse("books_popular"))
+        response = self.get(reverse("metrics"), staff=True)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('bookstore_requests_total{view="books_popular"} 2', body)
+        self.assertIn('bookstore_queries_total{view="books_popular"} 1', body)
+        self.assertIn('# TYPE bookstore_queries_max gauge', body)
+        self.assertIn('bookstore_serialize_seconds_total{view="books_popular"}', body)
+
+    def test_metrics_need_a_token_or_staff(self):
+        self.assertEqual(self.get(reverse("metrics")).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(APIClient().get(reverse("metrics")).status_code, status.HTTP_401_UNAUTHORIZED)
+        invalid = APIClient()
+        invalid.credentials(HTTP_AUTHORIZATION="Bearer not-a-jwt")
+        self.assertEqual(invalid.get(reverse("metrics")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with override_settings(METRICS_TOKEN="scraper-token"):
+            scraper = APIClient()
+            scraper.credentials(HTTP_AUTHORIZATION="Bearer scraper-token")
+            self.assertEqual(scraper.get(reverse("metrics")).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.get(reverse("metrics")).status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.get(reverse("metrics"), staff=True).status_code, status.HTTP_200_OK)
@@ -0,0 +1,93 @@
+import psycopg2
+from django.db import connection
+from django.test import SimpleTestCase
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from ..db.base import DatabaseWrapper, close_pools
+from ..db.pool import ConnectionPool, PoolTimeout
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    # the pools use connections of their own, outside of any test transaction
+    databases = {"default"}
+
+    def setUp(self):
+        params = connection.get_connection_params()
+        self.connect = lambda: psycopg2.connect(**params)
+        self.pool = ConnectionPool(size=2, timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_reuses_released_connections(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(self.connect), first)
+        self.assertEqual(self.pool.open, 1)
+
+    def test_open_transaction_is_rolled_back(self):
+        conn = self.pool.acquire(self.connect)
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMPORARY TABLE leftover (id int)")
+        self.pool.release(conn)
+
+        self.assertEqual(conn.get_transaction_status(), TRANSACTION_STATUS_IDLE)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pg_temp.leftover')")
+            self.assertIsNone(cursor.fetchone()[0])
+
+    def test_session_state_is_reset(self):
+        conn = self.pool.acquire(self.connect)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout = 1234")
+            cursor.execute("CREATE TEMPORARY TABLE leftover (id int)")
+            cursor.execute("SELECT pg_advisory_lock(42)")
+        self.pool.release(conn)
+
+        self.assertIs(self.pool.acquire(self.connect), conn)
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            self.assertNotEqual(cursor.fetchone()[0], "1234ms")
+            cursor.execute("SELECT to_regclass('pg_temp.leftover')")
+            self.assertIsNone(cursor.fetchone()[0])
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertTrue(conn.autocommit)
+
+    def test_waits_then_times_out(self):
+        self.pool.acquire(self.connect)
+        self.pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire(self.connect)
+
+    def test_broken_connections_are_replaced(self):
+        self.pool.check_after = 0
+        conn = self.pool.acquire(self.connect)
+        self.pool.release(conn)
+        # the server ends the idle connection behind the pool's back
+        killer = self.connect()
+        killer.autocommit = True
+        with killer.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [conn.get_backend_pid()])
+        killer.close()
+
+        replacement = self.pool.acquire(self.connect)
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(self.pool.open, 1)
+        with replacement.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    def test_backend_returns_connections_to_the_pool(self):
+        wrapper = DatabaseWrapper({**connection.settings_dict, "POOL": {"SIZE": 1}}, alias=connection.alias)
+        try:
+            wrapper.ensure_connection()
+            raw = wrapper.connection
+            wrapper.close()
+            wrapper.ensure_connection()
+            self.assertIs(wrapper.connection, raw)
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        finally:
+            wrapper.close()
+            close_pools(connection.alias)
@@ -0,0 +1,82 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Book, CounterReconciliation, Customer, Reservation
+from ..reconciliation import reconcile
+from .utils import createCustomer
+
+
+class ReconciliationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Book", author="Author", genre="Genre", quantity=5)
+        cls.customers = [createCustomer(username=f"customer{n}", password="testpassword") for n in range(5)]
+        for customer in cls.customers:
+            Reservation.objects.create(book=cls.book, customer=customer, quantity=2)
+        Customer.objects.update(current_reservations=2)
+        # a reservation that lost its counter update and one that was cascaded away
+        cls.customers[1].current_reservations = 1
+        cls.customers[1].save()
+        cls.customers[3].current_reservations = 5
+        cls.customers[3].save()
+
+    def counters(self):
+        return {customer.pk: customer.current_reservations for customer in Customer.objects.all()}
+
+    def test_report(self):
+        before = self.counters()
+        drifts = []
+
+        run = reconcile("customer.current_reservations", chunk_size=2, report=drifts.append)
+
+        self.assertEqual((run.checked, run.drifted, run.drift, run.fixed), (5, 2, 4, 0))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(
+            sorted((drift.id, drift.stored, drift.expected) for drift in drifts),
+            sorted([(self.customers[1].pk, 1, 2), (self.customers[3].pk, 5, 2)]),
+        )
+        self.assertEqual(self.counters(), before)
+
+    def test_fix(self):
+        run = reconcile("customer.current_reservations", fix=True, chunk_size=2)
+
+        self.assertEqual(run.fixed, 2)
+        self.assertEqual(set(self.counters().values()), {2})
+        self.assertEqual(reconcile("customer.current_reservations").drifted, 0)
+
+    def test_negative_stock(self):
+        Book.objects.filter(pk=self.book.pk).update(quantity=-3)
+
+        run = reconcile("book.quantity", fix=True)
+
+        self.assertEqual((run.checked, run.drifted, run.drift, run.fixed), (1, 1, 3, 1))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("reconcile_counters", "customer.current_reservations", fix=True, stdout=out)
+
+        self.assertIn(f"customer.current_reservations of {self.customers[3].pk} is 5, expected 2", out.getvalue())
+        self.assertIn("customer.current_reservations: 5 checked, 2 drifted by 4 in total, 2 fixed", out.getvalue())
+        self.assertEqual(CounterReconciliation.objects.get().fixed, 2)
+        with self.assertRaises(CommandError):
+            call_command("reconcile_counters", "book.popularity", stdout=out)
+
+    def test_metrics(self):
+        reconcile("customer.current_reservations")
+        reconcile("book.quantity")
+        # the latest run of a counter replaces the earlier ones
+        reconcile("customer.current_reservations", fix=True)
+
+        with override_settings(METRICS_TOKEN="scraper-token"):
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scraper-token")
+        content = response.content.decode()
+
+        self.assertIn('bookstore_counter_drift{counter="customer.current_reservations"} 4', content)
+        self.assertIn('bookstore_counter_fixed{counter="customer.current_reservations"} 2', content)
+        self.assertIn('bookstore_counter_drifted{counter="book.quantity"} 0', content)
+        self.assertEqual(content.count('bookstore_counter_checked{counter="customer.current_reservations"}'), 1)
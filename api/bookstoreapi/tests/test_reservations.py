@@ -1,9 +1,23 @@
+import base64
+import json
+import threading
 import uuid
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..holds import release_expired
 from ..models import Book, Customer, Reservation
 from ..serializers import ReservationSerializer, ReservationBookSerializer
-from .utils import JWTTestCase
+from .utils import JWTTestCase, createCustomer
 
 
 class ReservationAPITest(JWTTestCase):
@@ -33,6 +47,7 @@ class ReservationAPITest(JWTTestCase):
         self.assertEqual(reservation.customer, self.user.customer)
         self.assertEqual(reservation.quantity, 2)
         self.assertEqual(self.book.quantity, 3)  # Book quantity should be updated
+        self.assertEqual(self.book.popularity, 2)  # Reserved copies count towards popularity
 
     def test_create_reservation_not_enough_books(self):
         url = reverse("reservations")
@@ -66,6 +81,28 @@ class ReservationAPITest(JWTTestCase):
         self.assertEqual(response.data["message"], "Reservation limit exceeded")
         self.assertEqual(self.book.quantity, 5)  # Book quantity should not change
 
+    def test_create_reservation_rolls_back_stock_on_limit(self):
+        self.user.customer.max_reservations = 1
+        self.user.customer.save()
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 2}
+
+        response = self.post(reverse("reservations"), data=data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 5)
+        self.assertEqual(self.book.popularity, 0)
+
+    def test_create_reservation_invalid_quantity(self):
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 0}
+        response = self.post(reverse("reservations"), data=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_reservation_book_not_found(self):
+        data = {"book": str(uuid.uuid4()), "customer": str(self.user.customer.id), "quantity": 1}
+        response = self.post(reverse("reservations"), data=data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_all_reservations_for_customer(self):
         # Create a reservation for the customer
         reservation = Reservation.objects.create(
@@ -96,9 +133,409 @@ class ReservationAPITest(JWTTestCase):
         self.book.refresh_from_db()
         self.assertFalse(Reservation.objects.filter(pk=reservation.id).exists())
         self.assertEqual(self.book.quantity, 6)  # Book quantity should be updated
+        self.assertEqual(self.book.popularity, 0)  # Popularity never goes negative
 
     def test_delete_invalid_reservation(self):
         url = reverse("reservation_delete", kwargs={"id": uuid.uuid4()})
         response = self.delete(url)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_reservation_is_one_statement(self):
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": 2}
+        self.post(reverse("reservations"), data=data)
+        reservation = Reservation.objects.get(book=self.book)
+
+        with self.assertQueryBudget(1):
+            response = self.delete(reverse("reservation_delete", kwargs={"id": str(reservation.id)}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.book.refresh_from_db()
+        self.user.customer.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.popularity), (5, 0))
+        self.assertEqual(self.user.customer.current_reservations, 0)
+
+    def test_delete_reservation_of_another_customer(self):
+        reservation = Reservation.objects.create(book=self.book, customer=self.staff_user.customer, quantity=1)
+
+        response = self.delete(reverse("reservation_delete", kwargs={"id": str(reservation.id)}))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Reservation.objects.filter(pk=reservation.id).exists())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 5)
+
+
+class ReservationBulkAPITest(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Book 1", author="Author", genre="Genre", quantity=5)
+        cls.other_book = Book.objects.create(title="Book 2", author="Author", genre="Genre", quantity=1)
+
+    def cart(self, *items):
+        return {
+            "customer": str(self.user.customer.id),
+            "items": [{"book": str(book.id), "quantity": quantity} for book, quantity in items],
+        }
+
+    def test_bulk_reservation_success(self):
+        response = self.post(reverse("reservations_bulk"), data=self.cart((self.book, 2), (self.other_book, 1)))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["ids"]), 2)
+        self.book.refresh_from_db()
+        self.other_book.refresh_from_db()
+        self.user.customer.refresh_from_db()
+        self.assertEqual(self.book.quantity, 3)
+        self.assertEqual(self.other_book.quantity, 0)
+        self.assertEqual(self.book.popularity, 2)
+        self.assertEqual(self.user.customer.current_reservations, 3)
+
+    def test_bulk_reservation_is_all_or_nothing(self):
+        missing = Book(title="Missing", author="Author", genre="Genre")
+        response = self.post(
+            reverse("reservations_bulk"), data=self.cart((self.book, 2), (self.other_book, 2), (missing, 1))
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            [(error["index"], error["message"]) for error in response.data["errors"]],
+            [(1, "Not enough books in stock"), (2, "Book not found")],
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 5)
+        self.assertEqual(Reservation.objects.count(), 0)
+
+    def test_bulk_reservation_counts_repeated_books(self):
+        response = self.post(reverse("reservations_bulk"), data=self.cart((self.other_book, 1), (self.other_book, 1)))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_reservation_limit_exceeded(self):
+        self.user.customer.max_reservations = 2
+        self.user.customer.save()
+        response = self.post(reverse("reservations_bulk"), data=self.cart((self.book, 2), (self.other_book, 1)))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["message"], "Reservation limit exceeded")
+        self.assertEqual(Reservation.objects.count(), 0)
+
+    def test_bulk_reservation_for_another_customer(self):
+        cart = {**self.cart((self.book, 1)), "customer": str(self.staff_user.customer.id)}
+        response = self.post(reverse("reservations_bulk"), data=cart)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Reservation.objects.count(), 0)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 5)
+
+    def test_bulk_reservation_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post(reverse("reservations_bulk"), data=self.cart((self.book, 1), (self.other_book, 1)))
+        cart_of_two = len(queries)
+        self.other_book.quantity = 5
+        self.other_book.save()
+        third_book = Book.objects.create(title="Book 3", author="Author", genre="Genre", quantity=5)
+        with CaptureQueriesContext(connection) as queries:
+            self.post(reverse("reservations_bulk"), data=self.cart((self.book, 1), (self.other_book, 1), (third_book, 1)))
+        self.assertEqual(len(queries), cart_of_two)
+
+
+class ReservationCancelAPITest(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Book 1", author="Author", genre="Genre", quantity=5)
+        cls.other_book = Book.objects.create(title="Book 2", author="Author", genre="Genre", quantity=5)
+
+    def setUp(self):
+        super().setUp()
+        cart = {
+            "customer": str(self.user.customer.id),
+            "items": [
+                {"book": str(self.book.id), "quantity": 2},
+                {"book": str(self.other_book.id), "quantity": 1},
+                {"book": str(self.book.id), "quantity": 1},
+            ],
+        }
+        self.ids = self.post(reverse("reservations_bulk"), data=cart).data["ids"]
+
+    def cancel(self, **data):
+        return self.post(reverse("reservations_cancel"), data={"customer": str(self.user.customer.id), **data})
+
+    def assertStock(self, book, other_book, current_reservations):
+        self.book.refresh_from_db()
+        self.other_book.refresh_from_db()
+        self.user.customer.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.other_book.quantity), (book, other_book))
+        self.assertEqual(self.user.customer.current_reservations, current_reservations)
+
+    def test_cancel_all(self):
+        with self.assertQueryBudget(3):
+            response = self.cancel()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data["ids"]), sorted(self.ids))
+        self.assertEqual(response.data["quantity"], 4)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertStock(5, 5, 0)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.popularity, 0)
+
+    def test_cancel_some(self):
+        response = self.cancel(ids=[str(self.ids[0]), str(self.ids[1])])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Reservation.objects.get().id, self.ids[2])
+        self.assertStock(4, 5, 1)
+
+    def test_cancel_is_all_or_nothing(self):
+        missing = uuid.uuid4()
+        response = self.cancel(ids=[str(self.ids[0]), str(missing)])
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data["ids"], [str(missing)])
+        self.assertEqual(Reservation.objects.count(), 3)
+        self.assertStock(2, 4, 4)
+
+    def test_cancel_for_another_customer(self):
+        response = self.post(reverse("reservations_cancel"), data={"customer": str(self.staff_user.customer.id)})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.post(reverse("reservations_cancel"), data={"customer": str(self.user.customer.id)}, staff=True)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertStock(5, 5, 0)
+
+
+@override_settings(RESERVATION_HOLD_SECONDS=60)
+class ReservationHoldTest(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Book 1", author="Author", genre="Genre", quantity=10)
+
+    def reserve(self, quantity=1):
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": quantity}
+        return Reservation.objects.get(pk=self.post(reverse("reservations"), data=data).data["id"])
+
+    def expire(self, *reservations):
+        Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_reservation_holds_for_the_hold_time(self):
+        before = timezone.now()
+        reservation = self.reserve()
+        self.assertGreaterEqual(reservation.expires_at, before + timedelta(seconds=60))
+        self.assertLessEqual(reservation.expires_at, timezone.now() + timedelta(seconds=60))
+
+        with self.settings(RESERVATION_HOLD_SECONDS=0):
+            self.assertIsNone(self.reserve().expires_at)
+
+    def test_release_expired(self):
+        expired, other_expired, held = self.reserve(2), self.reserve(3), self.reserve(1)
+        kept = Reservation.objects.create(book=self.book, customer=self.user.customer, quantity=1)
+        self.expire(expired, other_expired)
+
+        cancellation = release_expired()
+
+        self.assertEqual(sorted(cancellation.ids), sorted([expired.id, other_expired.id]))
+        self.assertEqual(cancellation.quantity, 5)
+        self.assertEqual(set(Reservation.objects.values_list("pk", flat=True)), {held.id, kept.id})
+        self.book.refresh_from_db()
+        self.user.customer.refresh_from_db()
+        self.assertEqual(self.book.quantity, 9)
+        self.assertEqual(self.user.customer.current_reservations, 1)
+        self.assertEqual(release_expired().ids, [])
+
+    def test_expire_holds_command_releases_in_batches(self):
+        reservations = [self.reserve() for _ in range(5)]
+        self.expire(*reservations)
+        out = StringIO()
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("expire_holds", batch_size=2, stdout=out)
+
+        self.assertIn("Released 5 expired holds, 5 copies back in stock", out.getvalue())
+        # three batches, each a savepoint around one statement
+        self.assertEqual(len(queries), 9)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_expire_holds_command_retries_deadlocks(self):
+        deadlock = OperationalError("deadlock detected")
+        deadlock.__cause__ = type("DeadlockDetected", (Exception,), {"pgcode": "40P01"})()
+
+        release = mock.Mock(side_effect=deadlock)
+        with (
+            mock.patch("bookstoreapi.management.commands.expire_holds.release_expired", release),
+            mock.patch("bookstoreapi.decorators.connection", in_atomic_block=False),
+            mock.patch("bookstoreapi.decorators.time.sleep") as sleep,
+        ):
+            with self.assertRaises(OperationalError):
+                call_command("expire_holds", stdout=StringIO())
+
+        self.assertEqual(release.call_count, 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.05, 0.1])
+
+    def test_confirm(self):
+        held, expired = self.reserve(), self.reserve()
+        self.expire(expired)
+
+        response = self.post(reverse("reservation_confirm", kwargs={"id": held.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        held.refresh_from_db()
+        self.assertIsNone(held.expires_at)
+        self.assertEqual(release_expired().ids, [expired.id])
+        self.assertTrue(Reservation.objects.filter(pk=held.pk).exists())
+
+    def test_confirm_expired_or_not_own(self):
+        expired, held = self.reserve(), self.reserve()
+        self.expire(expired)
+
+        response = self.post(reverse("reservation_confirm", kwargs={"id": expired.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.post(reverse("reservation_confirm", kwargs={"id": held.id}), staff=True)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        held.refresh_from_db()
+        self.assertIsNotNone(held.expires_at)
+
+    def test_active_filter(self):
+        expired, held = self.reserve(), self.reserve()
+        self.expire(expired)
+
+        response = self.get(reverse("reservations"), data={"active": "true"})
+
+        self.assertEqual([reservation["id"] for reservation in response.data], [str(held.id)])
+        self.assertIsNotNone(response.data[0]["expires_at"])
+
+
+class ReservationHistoryTest(JWTTestCase):
+    def setUp(self):
+        super().setUp()
+        book = Book.objects.create(title="Test Book", author="Test Author", genre="Test Genre", quantity=5)
+        customer = Customer.objects.get(user=self.user)
+        Reservation.objects.bulk_create([Reservation(book=book, customer=customer, quantity=1) for _ in range(120)])
+        for day, reservation in enumerate(Reservation.objects.all()):
+            Reservation.objects.filter(pk=reservation.pk).update(date=date(2024, 1, 1) + timedelta(days=day % 30))
+        # another customer's reservations are never listed
+        other = createCustomer(username="other", password="password")
+        Reservation.objects.create(book=book, customer=other, quantity=1)
+
+    def test_cursor_pages_newest_first(self):
+        params = {"cursor": ""}
+        rows = []
+        while True:
+            response = self.get(reverse("reservations"), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            rows += response.data["results"]
+            if response.data["next"] is None:
+                break
+            params["cursor"] = response.data["next"]
+
+        expected = Reservation.objects.filter(customer__user=self.user).order_by("-date", "-id")
+        self.assertEqual([row["id"] for row in rows], [str(id) for id in expected.values_list("id", flat=True)])
+
+    def test_page_not_modified(self):
+        response = self.get(reverse("reservations"), {"cursor": ""})
+        response = self.get(reverse("reservations"), {"cursor": ""}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cursor_of_the_wrong_type(self):
+        cursor = base64.urlsafe_b64encode(json.dumps(["notadate", "x"]).encode()).decode()
+        response = self.get(reverse("reservations"), {"cursor": cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_date_filters(self):
+        response = self.get(reverse("reservations"), {"since": "2024-01-10", "until": "2024-01-11", "active": "true"})
+        self.assertEqual(len(response.data), 8)
+        self.assertEqual({row["date"] for row in response.data}, {"2024-01-10", "2024-01-11"})
+
+        response = self.get(reverse("reservations"), {"since": "last week"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationConcurrencyTest(TransactionTestCase):
+    """
+    Hammers one book from many threads, each with its own database connection, to check stock is never oversold
+    """
+
+    threads = 24
+    stock = 10
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Hot Book", author="Author", genre="Genre", quantity=self.stock)
+        self.customer = createCustomer(username="hammer", password="testpassword")
+        self.customer.max_reservations = self.threads
+        self.customer.save()
+        response = APIClient().post(
+            reverse("token_obtain_pair"), {"username": "hammer", "password": "testpassword"}, format="json"
+        )
+        self.token = response.data["access"]
+
+    def stock_left(self):
+        self.book.refresh_from_db()
+        return self.book.quantity
+
+    def reserve(self, barrier, statuses):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        data = {"book": str(self.book.id), "customer": str(self.customer.id), "quantity": 1}
+        try:
+            barrier.wait()
+            statuses.append(client.post(reverse("reservations"), data, format="json").status_code)
+        finally:
+            connection.close()
+
+    def test_concurrent_reservations_do_not_oversell(self):
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+        workers = [threading.Thread(target=self.reserve, args=(barrier, statuses)) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.customer.refresh_from_db()
+        self.assertEqual(statuses.count(status.HTTP_201_CREATED), self.stock)
+        self.assertEqual(statuses.count(status.HTTP_400_BAD_REQUEST), self.threads - self.stock)
+        self.assertEqual(self.stock_left(), 0)
+        self.assertEqual(Reservation.objects.filter(book=self.book).count(), self.stock)
+        self.assertEqual(self.customer.current_reservations, self.stock)
+
+
+class ReservationHoldSweepTest(TransactionTestCase):
+    """
+    Sweeps expired holds while another connection has one of them locked
+    """
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Book", author="Author", genre="Genre", quantity=0)
+        customer = createCustomer(username="sweeper", password="testpassword")
+        expires_at = timezone.now() - timedelta(minutes=1)
+        self.reservations = Reservation.objects.bulk_create(
+            [Reservation(book=self.book, customer=customer, quantity=1, expires_at=expires_at) for _ in range(3)]
+        )
+
+    def test_sweep_skips_locked_holds(self):
+        locked, released = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    Reservation.objects.select_for_update().get(pk=self.reservations[0].pk)
+                    locked.set()
+                    released.wait(10)
+            finally:
+                connections["default"].close()
+
+        worker = threading.Thread(target=hold_lock)
+        worker.start()
+        locked.wait(10)
+        try:
+            cancellation = release_expired()
+        finally:
+            released.set()
+            worker.join()
+
+        self.assertEqual(sorted(cancellation.ids), sorted(reservation.id for reservation in self.reservations[1:]))
+        self.assertEqual(release_expired().ids, [self.reservations[0].id])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 3)
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from .. import router
+from ..cache import (
+    CHANGED_KEY,
+    TIMEOUT,
+    CatalogCache,
+    bump_catalog_version,
+    pin_writer,
+    remember_writer,
+    writer_key,
+)
+from ..middleware import ReplicaRoutingMiddleware
+from ..models import Book, Customer, Reservation
+from ..router import REPLICA, ReplicaRouter, request_routing
+
+
+class ReplicaRouterTest(SimpleTestCase):
+    # outside of a test transaction, reads inside one always go to the primary
+    databases = {"default"}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        router._replica_down_until = 0.0
+        cache.clear()
+
+    def tearDown(self):
+        router._replica_down_until = 0.0
+
+    @contextmanager
+    def replica(self, **settings):
+        """
+        A replica alias pointing at the test database, or wherever settings say
+        """
+        with mock.patch.dict(connections.settings, {REPLICA: {**connections["default"].settings_dict, **settings}}):
+            try:
+                yield
+            finally:
+                connections[REPLICA].close()
+                del connections[REPLICA]
+
+    def test_without_replica(self):
+        with request_routing("GET"):
+            self.assertEqual(self.router.db_for_read(Book), "default")
+
+    def test_catalog_reads_go_to_replica(self):
+        with self.replica(), request_routing("GET"):
+            self.assertEqual(self.router.db_for_read(Book), REPLICA)
+            self.assertEqual(self.router.db_for_read(Reservation), "default")
+            self.assertEqual(self.router.db_for_read(Customer), "default")
+
+    def test_writes_pin_the_request(self):
+        with self.replica():
+            with request_routing("GET"):
+                self.assertEqual(self.router.db_for_write(Reservation), "default")
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            with request_routing("PUT"):
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            with request_routing("GET"):
+                self.assertEqual(self.router.db_for_read(Book), REPLICA)
+
+    def test_writers_read_their_writes(self):
+        writer, reader = mock.Mock(id=1, is_authenticated=True), mock.Mock(id=2, is_authenticated=True)
+        with self.replica():
+            bump_catalog_version()
+            remember_writer(writer.id)
+            with request_routing("GET"):
+                async_to_sync(CatalogCache.aopen)(writer)
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            with request_routing("GET"):
+                pin_writer(writer)
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            # a change by someone else doesn't keep the others off the replica
+            with request_routing("GET"):
+                async_to_sync(CatalogCache.aopen)(reader)
+                pin_writer(reader)
+                self.assertEqual(self.router.db_for_read(Book), REPLICA)
+
+    def test_recent_catalog_change_shortens_caching(self):
+        reader = mock.Mock(id=2, is_authenticated=True)
+        with self.replica():
+            bump_catalog_version()
+            with request_routing("GET"):
+                self.assertEqual(async_to_sync(CatalogCache.aopen)(reader).timeout, settings.REPLICA_PIN_SECONDS)
+
+            cache.delete(CHANGED_KEY)
+            with request_routing("GET"):
+                self.assertEqual(async_to_sync(CatalogCache.aopen)(reader).timeout, TIMEOUT)
+
+    def test_middleware_remembers_writers(self):
+        user = mock.Mock(id=1, is_authenticated=True)
+
+        def view(request):
+            request.user = user
+            if request.method == "POST":
+                self.router.db_for_write(Reservation)
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(view)(RequestFactory().get("/"))
+        self.assertIsNone(cache.get(writer_key(user.id)))
+        ReplicaRoutingMiddleware(view)(RequestFactory().post("/"))
+        self.assertTrue(cache.get(writer_key(user.id)))
+
+    def test_falls_back_when_replica_is_down(self):
+        with self.replica(HOST="127.0.0.1", PORT="1"), request_routing("GET"):
+            with self.assertLogs("bookstoreapi.router", "WARNING"):
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            # not retried right away
+            with mock.patch.object(connections[REPLICA], "ensure_connection") as ensure_connection:
+                self.assertEqual(self.router.db_for_read(Book), "default")
+            ensure_connection.assert_not_called()
@@ -0,0 +1,164 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+
+from .. import stock
+from ..models import Book, Reservation, StockShard
+from ..reconciliation import reconcile
+from . import test_reservations
+from .utils import JWTTestCase
+
+
+def shard_quantities(book):
+    return list(StockShard.objects.filter(book=book).order_by("shard").values_list("quantity", flat=True))
+
+
+class StockShardTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Hot Book", author="Author", genre="Genre", quantity=10)
+        stock.shard(self.book.pk, 4)
+
+    def test_shard_and_unshard(self):
+        self.assertEqual(shard_quantities(self.book), [3, 3, 2, 2])
+        self.assertEqual(stock.available(self.book.pk), 10)
+
+        stock.unshard(self.book.pk)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.stock_shards), (10, 0))
+        self.assertFalse(StockShard.objects.exists())
+
+    def test_take_skips_shards_without_enough(self):
+        StockShard.objects.filter(book=self.book).update(quantity=0)
+        StockShard.objects.filter(book=self.book, shard=3).update(quantity=7)
+
+        with transaction.atomic():
+            self.assertTrue(stock.take(self.book.pk, 4, 5))
+            self.assertFalse(stock.take(self.book.pk, 4, 3))
+
+        self.assertEqual(sum(shard_quantities(self.book)), 2)
+
+    def test_take_rebalances_when_no_shard_has_enough(self):
+        with transaction.atomic():
+            self.assertTrue(stock.take(self.book.pk, 4, 6))
+
+        self.assertEqual(shard_quantities(self.book), [1, 1, 1, 1])
+
+    def test_refresh_folds_reserved_copies_into_popularity(self):
+        with transaction.atomic():
+            stock.take(self.book.pk, 4, 2)
+            stock.take(self.book.pk, 4, 1)
+
+        self.assertTrue(stock.refresh(self.book.pk))
+        self.assertTrue(stock.refresh(self.book.pk))
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.popularity), (7, 3))
+
+    def test_reconcile_refreshes_the_cached_total(self):
+        with transaction.atomic():
+            stock.take(self.book.pk, 4, 2)
+
+        run = reconcile("book.quantity", fix=True)
+
+        self.assertEqual((run.drifted, run.drift, run.fixed), (1, 2, 1))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 8)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("shard_stock", str(self.book.pk), "--off", stdout=out)
+        call_command("shard_stock", str(self.book.pk), "--shards", "2", stdout=out)
+
+        self.assertIn(f"Split the 10 copies of book {self.book.pk} into 2 shards", out.getvalue())
+        self.assertEqual(shard_quantities(self.book), [5, 5])
+        with self.assertRaises(CommandError):
+            call_command("shard_stock", "not-a-book", stdout=out)
+
+
+class ShardedReservationTest(JWTTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Hot Book", author="Author", genre="Genre", quantity=8)
+        stock.shard(cls.book.pk, 4)
+
+    def reserve(self, quantity):
+        data = {"book": str(self.book.id), "customer": str(self.user.customer.id), "quantity": quantity}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.post(reverse("reservations"), data=data)
+
+    def test_reserve(self):
+        response = self.reserve(2)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(shard_quantities(self.book)), 6)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.popularity), (6, 2))
+        self.user.customer.refresh_from_db()
+        self.assertEqual(self.user.customer.current_reservations, 2)
+
+    def test_reserve_more_than_in_stock(self):
+        response = self.reserve(9)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(shard_quantities(self.book), [2, 2, 2, 2])
+
+    def test_limit_exceeded_gives_the_copies_back(self):
+        self.user.customer.max_reservations = 1
+        self.user.customer.save()
+
+        response = self.reserve(2)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(shard_quantities(self.book), [2, 2, 2, 2])
+
+    def test_bulk_and_cancel(self):
+        cart = {"customer": str(self.user.customer.id), "items": [{"book": str(self.book.id), "quantity": 3}]}
+        response = self.post(reverse("reservations_bulk"), data=cart)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(shard_quantities(self.book)), 5)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.popularity), (5, 3))
+
+        response = self.post(reverse("reservations_cancel"), data={"customer": str(self.user.customer.id)})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(sum(shard_quantities(self.book)), 8)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.popularity), (8, 0))
+
+    def test_bulk_short_rolls_back_the_shards(self):
+        cart = {"customer": str(self.user.customer.id), "items": [{"book": str(self.book.id), "quantity": 9}]}
+        response = self.post(reverse("reservations_bulk"), data=cart)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(shard_quantities(self.book), [2, 2, 2, 2])
+
+    def test_staff_update_spreads_the_new_quantity(self):
+        data = {"title": "Hot Book", "author": "Author", "genre": "Genre", "quantity": 12}
+        response = self.put(reverse("book_detail", kwargs={"id": self.book.id}), data=data, staff=True)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(shard_quantities(self.book), [3, 3, 3, 3])
+
+
+class ShardedReservationConcurrencyTest(test_reservations.ReservationConcurrencyTest):
+    """
+    The same hammering, on a book sharded in fewer shards than there are copies so some shards run dry
+    """
+
+    def setUp(self):
+        super().setUp()
+        stock.shard(self.book.pk, 4)
+
+    def stock_left(self):
+        self.assertEqual(shard_quantities(self.book), [0, 0, 0, 0])
+        # the last refreshes may have been skipped while another one held the book row
+        stock.refresh(self.book.pk, wait=True)
+        return super().stock_left()
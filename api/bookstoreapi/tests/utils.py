@@ -1,5 +1,10 @@
+from contextlib import contextmanager
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -63,6 +68,20 @@ class JWTTestCase(TestCase):
         cls.staff_user.delete()
         super().tearDownClass()
 
+    def setUp(self):
+        # cached catalog entries would otherwise outlive the rolled back rows of the previous test
+        cache.clear()
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """
+        Fail if the block runs more than budget queries, the queries are listed in the failure message
+        """
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = "\n".join(query["sql"] for query in context.captured_queries)
+        self.assertLessEqual(len(context), budget, f"{len(context)} queries over a budget of {budget}:\n{queries}")
+
     # Custom methods that override the client methods with format='json'
     @classmethod
     def _json_request(cls, method, url, *args, **kwargs):
@@ -1,19 +1,47 @@
 from django.contrib import admin
 from django.urls import path, re_path
 
-from .views.book import BookAPIView, BookDetailAPIView, book_search, book_popular
-from .views.customer import CustomerAPIView, CustomerCreateAPIView, CustomerDetailAPIView, CustomerLookupAPIView
-from .views.reservation import ReservationAPIView, ReservationDeleteAPIView
+from .views.authentication import with_async_get
+from .views.book import BookAPIView, BookDetailAPIView, book_detail, book_search, book_suggest, book_popular
+from .views.customer import (
+    CustomerAPIView,
+    CustomerCreateAPIView,
+    CustomerDetailAPIView,
+    CustomerLoginAPIView,
+    CustomerLookupAPIView,
+)
+from .views.export import export
+from .views.metrics import metrics
+from .views.reservation import (
+    ReservationAPIView,
+    ReservationBulkAPIView,
+    ReservationCancelAPIView,
+    ReservationConfirmAPIView,
+    ReservationDeleteAPIView,
+    reservation_list,
+)
 
+# the read-heavy GETs are async views, see README "Serving in production"
 urlpatterns = [
     re_path(r"^books/?$", BookAPIView.as_view(), name="books"),
     re_path(r"^books/search/?$", book_search, name="books_search"),
+    re_path(r"^books/suggest/?$", book_suggest, name="books_suggest"),
     re_path(r"^books/popular/?$", book_popular, name="books_popular"),
-    re_path(r"^books/(?P<id>[0-9a-f-]+)/?$", BookDetailAPIView.as_view(), name="book_detail"),
+    re_path(r"^books/(?P<id>[0-9a-f-]+)/?$", with_async_get(BookDetailAPIView.as_view(), book_detail), name="book_detail"),
     re_path(r"^customers/?$", CustomerAPIView.as_view(), name="customers"),
     re_path(r"^customers/create/?$", CustomerCreateAPIView.as_view(), name="customer_create"),
     re_path(r"^customers/lookup/?$", CustomerLookupAPIView.as_view(), name="customer_lookup"),
+    re_path(r"^customers/login/?$", CustomerLoginAPIView.as_view(), name="customer_login"),
     re_path(r"^customers/(?P<id>[0-9a-f-]+)/?$", CustomerDetailAPIView.as_view(), name="customer_detail"),
-    re_path(r"^reservations/?$", ReservationAPIView.as_view(), name="reservations"),
+    re_path(r"^export/(?P<kind>books|reservations)/?$", export, name="export"),
+    re_path(r"^metrics/?$", metrics, name="metrics"),
+    re_path(
+        r"^reservations/?$", with_async_get(ReservationAPIView.as_view(), reservation_list), name="reservations"
+    ),
+    re_path(r"^reservations/bulk/?$", ReservationBulkAPIView.as_view(), name="reservations_bulk"),
+    re_path(r"^reservations/cancel/?$", ReservationCancelAPIView.as_view(), name="reservations_cancel"),
     re_path(r"^reservations/(?P<id>[0-9a-f-]+)/?$", ReservationDeleteAPIView.as_view(), name="reservation_delete"),
+    re_path(
+        r"^reservations/(?P<id>[0-9a-f-]+)/confirm/?$", ReservationConfirmAPIView.as_view(), name="reservation_confirm"
+    ),
 ]
@@ -1,12 +1,17 @@
-from django.contrib.postgres.search import SearchVector
+import uuid
+
+from asgiref.sync import sync_to_async
 from rest_framework import status
-from rest_framework.decorators import api_view
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from .. import facets, stock
+from ..cache import CatalogCache, normalize_query, not_modified, pin_writer
 from ..models import Book
-from ..serializers import BookSerializer
-from .authentication import JWTAuthenticatedView
+from ..pagination import AsyncPageNumberPagination, KeysetPagination
+from ..popularity import POPULAR_LIMIT, popular_books
+from ..serializers import BOOK_FIELDS, BookSerializer, book_rows, sparse_fields
+from .authentication import JWTAuthenticatedView, async_api_view
 from ..decorators import staff_member_required
 
 
@@ -18,12 +23,14 @@ class BookAPIView(JWTAuthenticatedView, PageNumberPagination):
     @staff_member_required
     def get(self, request):
         """
-        Get all books
+        Get all books, pass fields to only get some of them (e.g. fields=id,title)
         """
-        books = Book.objects.all()
-        paged_books = self.paginate_queryset(books, request, view=self)
-        serializer = BookSerializer(paged_books, many=True)
-        return self.get_paginated_response(serializer.data)
+        pin_writer(request.user)
+        fields = sparse_fields(request, BOOK_FIELDS)
+        paginator = KeysetPagination(ordering=("id",)) if KeysetPagination.requested(request) else self
+        books = Book.objects.values(*dict.fromkeys(["id", *fields]))
+        paged_books = paginator.paginate_queryset(books, request, view=self)
+        return paginator.get_paginated_response(book_rows(paged_books, fields))
 
     @staff_member_required
     def post(self, request):
@@ -32,8 +39,8 @@ class BookAPIView(JWTAuthenticatedView, PageNumberPagination):
         """
         serializer = BookSerializer(data=request.data)
         if serializer.is_valid():
+            # search_vector is filled in by a database trigger, see migration 0003
             serializer.save()
-            (Book.objects.filter(pk=serializer.data["id"]).update(search_vector=SearchVector("title", "author", "genre")))
             return Response(
                 {"message": "Created book", "id": serializer.data["id"]},
                 status=status.HTTP_201_CREATED,
@@ -41,51 +48,138 @@ class BookAPIView(JWTAuthenticatedView, PageNumberPagination):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(["GET"])
-def book_search(request):
+@async_api_view
+async def book_search(request):
     """
     Search for books, not part of the BookAPIView class
+    Results are ranked, pass cursor to page by (rank, id) instead of page number. Books similar to the query are only
+    searched for when nothing matches it, see BookManager.lookup.
+    Narrow the results with genre, author (both repeatable) and in_stock, pass facets=true for the counts of the
+    whole query by genre, author and stock, see facets.py. Pages and facets are cached per normalized query.
+    Pass fields to only get some fields of the books (e.g. fields=id,title).
     """
-    paginator = PageNumberPagination()
-    paginator.page_size = 50
-    query = request.query_params.get("query")
-    if query is None or len(query) < 3:
+    if KeysetPagination.requested(request):
+        paginator = KeysetPagination(ordering=("-rank", "id"))
+    else:
+        paginator = AsyncPageNumberPagination()
+        paginator.page_size = 50
+    query = normalize_query(request.query_params.get("query") or "")
+    if len(query) < 3:
         return Response({"message": "Missing or invalid query"}, status=status.HTTP_400_BAD_REQUEST)
-    books = Book.objects.search(query)
-    paged_books = paginator.paginate_queryset(books, request, view=book_search)
-    serializer = BookSerializer(paged_books, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    try:
+        selected = facets.filters(request.query_params)
+    except facets.InvalidFilter as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    with_facets = request.query_params.get("facets") == "true"
+    fields = sparse_fields(request, BOOK_FIELDS)
+
+    async def fetch():
+        books = facets.apply(await Book.objects.alookup(query), selected).values(*BOOK_FIELDS, "rank")
+        paged_books = await paginator.apaginate_queryset(books, request)
+        return paginator.get_paginated_response(book_rows(paged_books)).data
+
+    catalog = await CatalogCache.aopen(request.user)
+    # the stock counts of the facets and the in_stock filter go stale with every reservation
+    key = catalog.stock_key if with_facets or "in_stock" in selected else catalog.key
+    key = key("search", query, sorted(selected.items()), with_facets, fields, *page_cache_key(request))
+    response = await catalog.abook_list(request, key, fetch, fields)
+    if with_facets and response.status_code == status.HTTP_200_OK:
+        response.data["facets"] = await catalog.aget_or_set(
+            catalog.stock_key("facets", query), sync_to_async(lambda: facets.facet_counts(Book.objects.lookup(query)))
+        )
+    return response
+
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+
+
+@async_api_view
+async def book_suggest(request):
+    """
+    Completions for a search box, books whose title or author starts with prefix
+    Title matches come first, only id, title and author are returned. Cached per prefix, see cache.py.
+    """
+    prefix = " ".join(request.query_params.get("prefix", "").split())
+    try:
+        limit = min(int(request.query_params.get("limit", SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = 0
+    if not prefix or limit < 1:
+        return Response({"message": "Missing prefix or invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    async def fetch():
+        suggestions = {}
+        for field in ["title", "author"]:
+            books = Book.objects.suggest(field, prefix).values("id", "title", "author")[:limit]
+            async for book in books:
+                suggestions.setdefault(str(book["id"]), {**book, "id": str(book["id"])})
+        return list(suggestions.values())[:limit]
+
+    catalog = await CatalogCache.aopen(request.user)
+    suggestions = await catalog.aget_or_set(catalog.key("suggest", prefix.upper(), limit), fetch)
+    return Response({"results": suggestions})
+
+
+@async_api_view
+async def book_popular(request):
+    """
+    Get the most popular books, read in order from the popularity index
+    Pass cursor to page by (popularity, id) instead of page number, and fields to only get some fields of the books.
+    Either way only the first POPULAR_LIMIT books are listed.
+    """
+    if KeysetPagination.requested(request):
+        paginator = KeysetPagination(ordering=("-popularity", "id"), limit=POPULAR_LIMIT)
+        books = popular_books()
+    else:
+        paginator = AsyncPageNumberPagination()
+        paginator.page_size = 50
+        books = popular_books()[:POPULAR_LIMIT]
+    fields = sparse_fields(request, BOOK_FIELDS)
+
+    async def fetch():
+        paged_books = await paginator.apaginate_queryset(books.values(*BOOK_FIELDS, "popularity"), request)
+        return paginator.get_paginated_response(book_rows(paged_books)).data
+
+    catalog = await CatalogCache.aopen(request.user)
+    key = catalog.stock_key("popular", fields, *page_cache_key(request))
+    return await catalog.abook_list(request, key, fetch, fields)
+
+
+def page_cache_key(request):
+    """
+    The parts of the request that select a page, for cache keys
+    """
+    if KeysetPagination.requested(request):
+        return ("cursor", request.query_params.get(KeysetPagination.cursor_query_param))
+    return ("page", request.query_params.get("page", "1"))
 
 
-@api_view(["GET"])
-def book_popular(request):
+@async_api_view
+async def book_detail(request, id):
     """
-    Get the most popular books
+    Get a book by id, read through the catalog cache
     """
-    paginator = PageNumberPagination()
-    paginator.page_size = 50
-    books = Book.objects.order_by("-popularity")[:999]
-    paged_books = paginator.paginate_queryset(books, request, view=book_popular)
-    serializer = BookSerializer(paged_books, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    try:
+        id = uuid.UUID(id)
+    except ValueError:
+        return Response({"message": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
+    catalog = await CatalogCache.aopen(request.user)
+    books = await catalog.aget_books([id])
+    if not books:
+        return Response({"message": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
+    etag = catalog.etag(catalog.key("book", id), books[0])
+    if not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(books[0], headers={"ETag": etag})
 
 
 class BookDetailAPIView(JWTAuthenticatedView):
     """
     Book Detail API View
+    GET is served by the async book_detail view, see urls.py
     """
 
-    def get(self, request, id):
-        """
-        Get a book by id
-        """
-        try:
-            book = Book.objects.get(pk=id)
-        except Book.DoesNotExist:
-            return Response({"message": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = BookSerializer(book)
-        return Response(serializer.data)
-
     @staff_member_required
     def delete(self, request, id):
         """
@@ -110,5 +204,7 @@ class BookDetailAPIView(JWTAuthenticatedView):
         serializer = BookSerializer(book, data=request.data)
         if serializer.is_valid():
             serializer.save()
+            if book.stock_shards:
+                stock.reset(book.id)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
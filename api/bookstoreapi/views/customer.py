@@ -1,15 +1,27 @@
+from django.db import transaction
+from django.db.models.expressions import RawSQL
 from rest_framework import status
 from rest_framework.decorators import permission_classes
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
 
+from ..cache import make_etag, not_modified
+from ..cancellation import cancel
 from ..decorators import customer_authorization
-from ..models import Customer
-from ..serializers import CustomerSerializer
+from ..models import Customer, Reservation
+from ..serializers import CustomerSerializer, LoginSerializer, ReservationSummarySerializer
 from .authentication import JWTAuthenticatedView
 
+# row versions of the customer and of the user joined by select_related: the transaction that wrote each row and
+# where it wrote it, every update writes a new row so one of them changes even within a transaction
+CUSTOMER_VERSION = RawSQL(
+    """concat_ws(':', "bookstoreapi_customer".xmin, "bookstoreapi_customer".ctid, "auth_user".xmin, "auth_user".ctid)""",
+    [],
+)
+
 
 @permission_classes((AllowAny,))
 class CustomerCreateAPIView(APIView):
@@ -32,6 +44,44 @@ class CustomerCreateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CustomerLoginAPIView(APIView):
+    """
+    Customer Login API View
+    Public like the token endpoint, it answers what logging in used to take the token, lookup and detail requests for
+    """
+
+    authentication_classes = []
+    permission_classes = []
+
+    def get_authenticate_header(self, request):
+        # wrong credentials are a 401 like on the token endpoint, DRF makes it a 403 without a challenge
+        return JWTStatelessUserAuthentication().authenticate_header(request)
+
+    def post(self, request):
+        """
+        Check a username and password and return the access and refresh tokens, the customer and their reservation
+        totals, customer is null for users without one
+        The password is checked once, then the customer and the reservation totals are one query each
+        """
+        serializer = LoginSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        customer = serializer.validated_data["customer"]
+        profile = summary = None
+        if customer is not None:
+            profile = CustomerSerializer(customer).data
+            # remove password, even though it's hashed
+            profile["user"].pop("password")
+            summary = ReservationSummarySerializer(Reservation.objects.summary(customer.id)).data
+        return Response(
+            {
+                "access": serializer.validated_data["access"],
+                "refresh": serializer.validated_data["refresh"],
+                "customer": profile,
+                "reservations": summary,
+            }
+        )
+
+
 class CustomerAPIView(JWTAuthenticatedView, PageNumberPagination):
     """
     Customer API View
@@ -44,7 +94,7 @@ class CustomerAPIView(JWTAuthenticatedView, PageNumberPagination):
         """
         if not request.user.is_staff:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        customers = Customer.objects.all()
+        customers = Customer.objects.select_related("user")
         paged_customers = self.paginate_queryset(customers, request, view=self)
         serializer = CustomerSerializer(paged_customers, many=True)
         return self.get_paginated_response(serializer.data)
@@ -53,7 +103,7 @@ class CustomerAPIView(JWTAuthenticatedView, PageNumberPagination):
 class CustomerLookupAPIView(JWTAuthenticatedView):
     """
     Customer Lookup API View
-    This is necessary because when logging in with a username, we need to get the customer id
+    Maps a username to its customer, logging in gets the customer from the login endpoint instead
     """
 
     def get(self, request):
@@ -61,7 +111,7 @@ class CustomerLookupAPIView(JWTAuthenticatedView):
         Get a customer by username
         """
         try:
-            customer = Customer.objects.get(user__username=request.query_params["username"])
+            customer = Customer.objects.select_related("user").get(user__username=request.query_params["username"])
         except Customer.DoesNotExist:
             return Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = CustomerSerializer(customer)
@@ -79,26 +129,32 @@ class CustomerDetailAPIView(JWTAuthenticatedView):
     def get(self, request, id):
         """
         Get a customer by id
+        The ETag is made of the row versions of the customer and its user, read along with them, so a 304 skips
+        serialization
         """
         try:
-            customer = Customer.objects.get(pk=id)
+            customer = Customer.objects.select_related("user").annotate(version=CUSTOMER_VERSION).get(pk=id)
         except Customer.DoesNotExist:
             return Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
+        etag = make_etag("customer", customer.id, customer.version)
+        if not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
         serializer = CustomerSerializer(customer)
         # remove password, even though it's hashed
         serializer.data["user"].pop("password")
-        return Response(serializer.data)
+        return Response(serializer.data, headers={"ETag": etag})
 
     @customer_authorization
     def delete(self, request, id):
         """
         Delete a customer by id
+        Their reservations are cancelled first so the copies go back to stock instead of being cascaded away
         """
-        try:
-            customer = Customer.objects.get(pk=id)
-        except Customer.DoesNotExist:
+        with transaction.atomic():
+            cancel(Reservation.objects.filter(customer=id))
+            deleted, _ = Customer.objects.filter(pk=id).delete()
+        if not deleted:
             return Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
-        customer.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @customer_authorization
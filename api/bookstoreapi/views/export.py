@@ -0,0 +1,40 @@
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .. import export as exports
+from ..middleware import CompressionMiddleware
+from .authentication import async_api_view
+
+
+@async_api_view
+async def export(request, kind):
+    """
+    Stream every book or reservation as NDJSON or CSV, staff only
+    Filter with genre, and reservations with since and until (ISO dates, inclusive). The output is gzipped on the fly
+    for clients that accept it, see export.py.
+    """
+    if not await request.user.ais_staff():
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    format = request.query_params.get("format", "ndjson")
+    if format not in exports.FORMATS:
+        message = f"format must be one of {', '.join(exports.FORMATS)}"
+        return Response({"message": message}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        rows = exports.queryset(
+            kind,
+            genre=request.query_params.get("genre"),
+            since=request.query_params.get("since"),
+            until=request.query_params.get("until"),
+        )
+    except exports.InvalidFilter as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    compress = CompressionMiddleware.encoding(request, choices=["gzip"]) == "gzip"
+    response = StreamingHttpResponse(exports.astream(rows, format, compress), content_type=exports.FORMATS[format])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{format}"'
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
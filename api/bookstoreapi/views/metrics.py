@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+from .. import metrics as request_metrics
+from ..reconciliation import render_metrics as reconciliation_metrics
+
+
+def metrics(request):
+    """
+    Per-view request metrics and the drift found by counter reconciliation, in the Prometheus text format
+    A plain django view so a scraper can authenticate with the DJANGO_METRICS_TOKEN bearer token instead of a JWT.
+    Staff can read it with their JWT, anyone else gets a 401, including when no token is configured.
+    """
+    token = settings.METRICS_TOKEN
+    scraper = token and constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}")
+    if not scraper and not is_staff(request):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        request_metrics.registry.render() + reconciliation_metrics(), content_type="text/plain; version=0.0.4"
+    )
+
+
+def is_staff(request):
+    """
+    Whether the request carries the JWT of a staff user
+    """
+    try:
+        authenticated = JWTStatelessUserAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
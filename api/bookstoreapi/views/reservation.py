@@ -1,62 +1,275 @@
-import json
+from collections import defaultdict
+
 from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Value, When
 from rest_framework import status
 from rest_framework.response import Response
 
-from ..models import Book, Customer, Reservation
-from ..serializers import ReservationBookSerializer, ReservationSerializer
-from .authentication import JWTAuthenticatedView
-
-from datetime import datetime
+from .. import holds, popularity, stock
+from ..cancellation import cancel
+from ..cache import CatalogCache, invalidate_stock, make_etag, not_modified
+from ..decorators import retry_on_conflict
+from ..models import Book, Customer, Reservation, row_version
+from ..pagination import KeysetPagination
+from ..serializers import (
+    RESERVATION_COLUMNS,
+    RESERVATION_FIELDS,
+    ReservationBulkCreateSerializer,
+    ReservationCancelSerializer,
+    ReservationCreateSerializer,
+    ReservationFilterSerializer,
+    reservation_rows,
+    sparse_fields,
+)
+from .authentication import JWTAuthenticatedView, async_api_view
 
 
 class ReservationAPIView(JWTAuthenticatedView):
     """
     Reservation API View
+    GET is served by the async reservation_list view, see urls.py
     """
 
-    @transaction.atomic
+    @retry_on_conflict
     def post(self, request):
         """
         Create a new reservation only if the book is in stock and the user has not exceeded their reservation limit
+        Stock and limit are checked and taken by conditional updates, the row lock they take makes concurrent
+        reservations of the same book queue up instead of overselling. The happy path is three statements.
+        Copies of a sharded book are taken from one of its shards instead, so they only queue up per shard.
+        """
+        serializer = ReservationCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        book_id = serializer.validated_data["book"]
+        customer_id = serializer.validated_data["customer"]
+        quantity = serializer.validated_data["quantity"]
+
+        with transaction.atomic():
+            # book before customer, every reservation path locks rows in this order
+            reserved = Book.objects.filter(pk=book_id, quantity__gte=quantity, stock_shards=0).update(
+                quantity=F("quantity") - quantity, popularity=popularity.reserved(quantity)
+            )
+            if not reserved:
+                shards = Book.objects.filter(pk=book_id).values_list("stock_shards", flat=True).first()
+                if shards is None:
+                    return Response({"message": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
+                if not shards or not stock.take(book_id, shards, quantity):
+                    return Response({"message": "Not enough books in stock"}, status=status.HTTP_400_BAD_REQUEST)
+                transaction.on_commit(lambda: stock.refresh(book_id))
+
+            held = Customer.objects.filter(
+                pk=customer_id, current_reservations__lte=F("max_reservations") - quantity
+            ).update(current_reservations=F("current_reservations") + quantity)
+            if not held:
+                customer_exists = Customer.objects.filter(pk=customer_id).exists()
+                # give the stock back
+                transaction.set_rollback(True)
+                if not customer_exists:
+                    return Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
+                return Response({"message": "Reservation limit exceeded"}, status=status.HTTP_400_BAD_REQUEST)
+
+            reservation = Reservation.objects.create(
+                book_id=book_id, customer_id=customer_id, quantity=quantity, expires_at=holds.expires_at()
+            )
+            invalidate_stock([book_id])
+        return Response({"message": "Created reservation", "id": reservation.id}, status=status.HTTP_201_CREATED)
+
+
+@async_api_view
+async def reservation_list(request):
+    """
+    Get the reservations and books of the current user newest first, joining reservation and book on book id
+    Filter with since and until (inclusive dates) and active=true, and pass fields to only get some fields of the
+    reservations (e.g. fields=id,book). Pass cursor to page by (date, id) instead of getting the whole history, each
+    page is a range scan of the reservation_customer_date_idx index whatever the size of the history.
+    The ETag of the whole history is made of the number of reservations, the newest row version among them (which
+    changes with any insert or delete) and the catalog and stock versions for the embedded books. A conditional
+    request checks it with one aggregate query, skipping the join and serialization. A page's ETag covers the rows
+    on it.
+    """
+    fields = sparse_fields(request, RESERVATION_FIELDS)
+    filters = ReservationFilterSerializer(data=request.query_params)
+    filters.is_valid(raise_exception=True)
+    customer_id = await request.user.acustomer_id()
+    reservations = Reservation.objects.history(customer_id)
+    if filters.validated_data.get("since"):
+        reservations = reservations.filter(date__gte=filters.validated_data["since"])
+    if filters.validated_data.get("until"):
+        reservations = reservations.filter(date__lte=filters.validated_data["until"])
+    if filters.validated_data.get("active"):
+        reservations = reservations.active()
+    catalog = await CatalogCache.aopen(request.user)
+
+    def etag(*versions):
+        catalog_versions = (catalog.version, catalog.stock_version)
+        return make_etag("reservations", customer_id, *catalog_versions, request.query_params.urlencode(), *versions)
+
+    rows = reservations.values(*RESERVATION_COLUMNS, version=row_version(Reservation))
+    if KeysetPagination.requested(request):
+        paginator = KeysetPagination(ordering=("-date", "-id"))
+        rows = await paginator.apaginate_queryset(rows, request)
+        page_etag = etag(paginator.next_cursor, [(row["id"], row["version"]) for row in rows])
+        if not_modified(request, page_etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": page_etag})
+        response = paginator.get_paginated_response(reservation_rows(rows, fields))
+        response["ETag"] = page_etag
+        return response
+
+    if request.META.get("HTTP_IF_NONE_MATCH"):
+        versions = await reservations.aaggregate(count=Count("pk"), version=Max(row_version(Reservation)))
+        history_etag = etag(versions["count"], versions["version"])
+        if not_modified(request, history_etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": history_etag})
+    rows = [row async for row in rows]
+    headers = {"ETag": etag(len(rows), max((row["version"] for row in rows), default=None))}
+    return Response(reservation_rows(rows, fields), status=status.HTTP_200_OK, headers=headers)
+
+
+class ReservationBulkAPIView(JWTAuthenticatedView):
+    """
+    Reservation Bulk API View
+    Reserves a whole cart in one transaction, all items are reserved or none are
+    """
+
+    @retry_on_conflict
+    def post(self, request):
+        """
+        Create reservations for several books at once
+        The books are validated with one IN lookup that locks them in primary key order, so concurrent checkouts
+        can't deadlock, then stock, popularity and the customer counter are each taken with one set-based update
+        and the reservations are inserted with bulk_create. The cost doesn't grow with the number of items.
         """
-        book = Book.objects.filter(pk=request.data["book"]).first()
-        if book is None:
-            return Response({"message": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
-        if book.quantity < request.data["quantity"]:
-            return Response(
-                {"message": "Not enough books in stock"},
-                status=status.HTTP_400_BAD_REQUEST,
+        serializer = ReservationBulkCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        customer_id = serializer.validated_data["customer"]
+        if not request.user.is_staff and request.user.customer_id != str(customer_id):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        items = serializer.validated_data["items"]
+        wanted = defaultdict(int)
+        for item in items:
+            wanted[item["book"]] += item["quantity"]
+
+        with transaction.atomic():
+            # books before customer, every reservation path locks rows in this order
+            books = {
+                book_id: (quantity, shards)
+                for book_id, quantity, shards in Book.objects.select_for_update(no_key=True)
+                .filter(pk__in=wanted)
+                .order_by("pk")
+                .values_list("pk", "quantity", "stock_shards")
+            }
+            short = set()
+            for book_id, (quantity, shards) in books.items():
+                # copies of sharded books are taken right away, a failed checkout rolls them back
+                if shards:
+                    enough = stock.take(book_id, shards, wanted[book_id], popularity=False)
+                else:
+                    enough = quantity >= wanted[book_id]
+                if not enough:
+                    short.add(book_id)
+            errors = []
+            for index, item in enumerate(items):
+                if item["book"] not in books:
+                    errors.append({"index": index, "book": item["book"], "message": "Book not found"})
+                elif item["book"] in short:
+                    errors.append({"index": index, "book": item["book"], "message": "Not enough books in stock"})
+
+            customer = (
+                Customer.objects.select_for_update(no_key=True)
+                .filter(pk=customer_id)
+                .values("current_reservations", "max_reservations")
+                .first()
             )
-        customer = Customer.objects.filter(pk=request.data["customer"]).first()
-        if customer is None:
-            return Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
-        if customer.current_reservations + request.data["quantity"] > customer.max_reservations:
-            return Response(
-                {"message": "Reservation limit exceeded"},
-                status=status.HTTP_400_BAD_REQUEST,
+            total = sum(wanted.values())
+            failure = None
+            if customer is None:
+                failure = Response({"message": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
+            elif errors:
+                failure = Response(
+                    {"message": "Reservation failed", "errors": errors}, status=status.HTTP_400_BAD_REQUEST
+                )
+            elif customer["current_reservations"] + total > customer["max_reservations"]:
+                failure = Response({"message": "Reservation limit exceeded"}, status=status.HTTP_400_BAD_REQUEST)
+            if failure:
+                transaction.set_rollback(True)
+                return failure
+
+            taken = Case(*[When(pk=book_id, then=Value(n)) for book_id, n in wanted.items()], output_field=IntegerField())
+            Book.objects.filter(pk__in=wanted).update(
+                quantity=F("quantity") - taken, popularity=popularity.reserved(taken)
             )
-        serializer = ReservationSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            book.quantity -= request.data["quantity"]
-            book.save()
-            customer.current_reservations += request.data["quantity"]
-            customer.save()
-            book.refresh_from_db()
-            assert book.quantity >= 0, "Book was reserved more times than it was in stock"
-            return Response(
-                {"message": "Created reservation", "id": serializer.data["id"]}, status=status.HTTP_201_CREATED
+            Customer.objects.filter(pk=customer_id).update(current_reservations=F("current_reservations") + total)
+            expires_at = holds.expires_at()
+            reservations = Reservation.objects.bulk_create(
+                [
+                    Reservation(
+                        book_id=item["book"], customer_id=customer_id, quantity=item["quantity"], expires_at=expires_at
+                    )
+                    for item in items
+                ]
             )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            invalidate_stock(wanted)
+        return Response(
+            {"message": "Created reservations", "ids": [reservation.id for reservation in reservations]},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ReservationCancelAPIView(JWTAuthenticatedView):
+    """
+    Reservation Cancel API View
+    Cancels many reservations of a customer at once, e.g. a whole cart
+    """
+
+    @retry_on_conflict
+    def post(self, request):
+        """
+        Cancel the given reservations of a customer, or all of them, and give their copies back
+        All of them are cancelled or none are, with one statement whatever their number, see cancellation.py
+        """
+        serializer = ReservationCancelSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        customer_id = serializer.validated_data["customer"]
+        if not request.user.is_staff and request.user.customer_id != str(customer_id):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        reservations = Reservation.objects.filter(customer=customer_id)
+        ids = set(serializer.validated_data.get("ids", []))
+        if ids:
+            reservations = reservations.filter(pk__in=ids)
+
+        with transaction.atomic():
+            cancellation = cancel(reservations)
+            missing = ids.difference(cancellation.ids)
+            if missing:
+                transaction.set_rollback(True)
+                return Response(
+                    {"message": "Reservation not found", "ids": sorted(str(id) for id in missing)},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+        return Response(
+            {"message": "Cancelled reservations", "ids": cancellation.ids, "quantity": cancellation.quantity},
+            status=status.HTTP_200_OK,
+        )
+
 
-    def get(self, request):
+class ReservationConfirmAPIView(JWTAuthenticatedView):
+    """
+    Reservation Confirm API View
+    """
+
+    @retry_on_conflict
+    def post(self, request, id):
         """
-        Get all reservations and books for the current user, joining reservation and book on book id
+        Keep a hold until it is cancelled instead of letting it expire, see holds.py
+        One conditional update, a hold that has expired or that the sweeper is releasing is not found
         """
-        reservations = Reservation.objects.filter(customer=request.user.customer.id).select_related("book")
-        serializer = ReservationBookSerializer(reservations, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        reservation = Reservation.objects.active().filter(pk=id, customer=request.user.customer_id)
+        if not reservation.update(expires_at=None):
+            return Response({"message": "Reservation not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"message": "Confirmed reservation"}, status=status.HTTP_200_OK)
 
 
 class ReservationDeleteAPIView(JWTAuthenticatedView):
@@ -64,22 +277,12 @@ class ReservationDeleteAPIView(JWTAuthenticatedView):
     Reservation Delete API View
     """
 
+    @retry_on_conflict
     def delete(self, request, id):
         """
-        Delete a reservation
+        Delete a reservation and give its copies back, in a single statement, see cancellation.py
+        Reservations of other customers are not found either, so the response doesn't give away whether one exists
         """
-        try:
-            reservation = Reservation.objects.get(pk=id)
-        except Reservation.DoesNotExist:
-            return Response({"message": "Reservation not found"}, status=status.HTTP_404_NOT_FOUND)
-        # auto-generated code, it made the correct choice not to give a 400 so the request doesn't give away whether a reservation exists
-        if reservation.customer.id != request.user.customer.id:
+        if not cancel(Reservation.objects.filter(pk=id, customer=request.user.customer_id)).ids:
             return Response({"message": "Reservation not found"}, status=status.HTTP_404_NOT_FOUND)
-        book = reservation.book
-        book.quantity += reservation.quantity
-        book.save()
-        customer = reservation.customer
-        customer.current_reservations -= reservation.quantity
-        customer.save()
-        reservation.delete()
         return Response({"message": "Deleted reservation"}, status=status.HTTP_200_OK)
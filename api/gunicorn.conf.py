@@ -0,0 +1,23 @@
+"""
+Production server: gunicorn managing uvicorn ASGI workers, run from the api directory with
+gunicorn -c gunicorn.conf.py
+Each worker is an event loop serving the async read views concurrently, writes run in a thread per request.
+Workers don't share the default local memory cache, set DJANGO_CACHE_BACKEND to a shared cache (e.g. redis) when
+running more than one, otherwise catalog invalidations only reach the worker that made the change.
+"""
+import multiprocessing
+import os
+
+wsgi_app = "web_project.asgi:application"
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# restart workers now and then so a slow leak can't grow without bound
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+keepalive = 5
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG")
+
+# every request runs in a thread of its own, only a pool reuses connections across them, see settings.DATABASES
+os.environ.setdefault("DJANGO_DB_POOL_SIZE", "10")
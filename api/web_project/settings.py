@@ -18,6 +18,10 @@ import os
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
+def env_flag(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
@@ -25,12 +29,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG also keeps every SQL query in memory, only the development setup in docker-compose.yml turns it on
+DEBUG = env_flag("DJANGO_DEBUG")
 
-ALLOWED_HOSTS = [
-    "localhost",
-    "10.0.2.2",
-]
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,10.0.2.2").split(",")
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -55,6 +57,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "bookstoreapi.middleware.QueryMetricsMiddleware",
+    "bookstoreapi.middleware.CompressionMiddleware",
+    "bookstoreapi.middleware.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -85,20 +90,34 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "web_project.wsgi.application"
 
+# production serving, see gunicorn.conf.py
+ASGI_APPLICATION = "web_project.asgi.application"
+
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "bookstoreapi.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "PAGE_SIZE": 50,
     "MAX_PAGE_SIZE": 300,
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
 }
 
+# bearer token for scraping the bookstore/metrics endpoint ("Authorization: Bearer <token>"), when unset only staff
+# users can read it with their JWT
+METRICS_TOKEN = os.environ.get("DJANGO_METRICS_TOKEN")
+
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # authenticate from the token claims without loading the user, see bookstoreapi.views.authentication
+    "TOKEN_OBTAIN_SERIALIZER": "bookstoreapi.serializers.BookstoreTokenObtainPairSerializer",
+    "TOKEN_USER_CLASS": "bookstoreapi.views.authentication.ClaimsUser",
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
     "SLIDING_TOKEN_REFRESH_LIFETIME_GRACE_PERIOD": timedelta(days=1),
@@ -108,15 +127,37 @@ SIMPLE_JWT = {
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# Connections are kept open for DJANGO_DB_CONN_MAX_AGE seconds and health checked before a request reuses them.
+# DJANGO_DB_POOL_SIZE > 0 switches to a pool of that many connections per process instead (bookstoreapi/db), the
+# way to reuse connections under ASGI, where every request runs in a new thread. Behind PgBouncer in transaction
+# mode set DJANGO_DB_PGBOUNCER: consecutive transactions may then run on different server connections, so nothing
+# may rely on session state, and server-side cursors (used by QuerySet.iterator()) are turned off.
+
+DB_POOL_SIZE = int(os.environ.get("DJANGO_DB_POOL_SIZE", 0))
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "bookstoreapi.db" if DB_POOL_SIZE else "django.db.backends.postgresql_psycopg2",
         "NAME": os.environ.get("DJANGO_DATABASE_NAME"),
         "USER": os.environ.get("DJANGO_DATABASE_USER"),
         "PASSWORD": os.environ.get("DJANGO_DATABASE_PASSWORD"),
         "HOST": os.environ.get("DJANGO_DATABASE_HOST"),
         "PORT": os.environ.get("DJANGO_DATABAE_PORT"),
+        # pooled connections go back to the pool at the end of every request
+        "CONN_MAX_AGE": 0 if DB_POOL_SIZE else int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": env_flag("DJANGO_DB_PGBOUNCER"),
+        "POOL": {
+            "SIZE": DB_POOL_SIZE,
+            "TIMEOUT": float(os.environ.get("DJANGO_DB_POOL_TIMEOUT", 10)),
+            "MAX_LIFETIME": int(os.environ.get("DJANGO_DB_POOL_MAX_LIFETIME", 3600)),
+            # DISCARD ALL would also drop PgBouncer's prepared statements on whichever server connection it lands on
+            "RESET_QUERY": (
+                "RESET ALL; UNLISTEN *; SELECT pg_advisory_unlock_all()"
+                if env_flag("DJANGO_DB_PGBOUNCER")
+                else "DISCARD ALL"
+            ),
+        },
         "TEST": {
             "NAME": "test_database",
             "USER": "test_user",
@@ -127,6 +168,45 @@ DATABASES = {
     },
 }
 
+# Optional read replica for catalog reads, e.g. a streaming replica of the primary, see bookstoreapi/router.py
+# Tests run the replica alias against the primary's test database.
+
+if os.environ.get("DJANGO_REPLICA_DATABASE_HOST") or os.environ.get("DJANGO_REPLICA_DATABASE_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ.get("DJANGO_REPLICA_DATABASE_NAME", DATABASES["default"]["NAME"]),
+        "USER": os.environ.get("DJANGO_REPLICA_DATABASE_USER", DATABASES["default"]["USER"]),
+        "PASSWORD": os.environ.get("DJANGO_REPLICA_DATABASE_PASSWORD", DATABASES["default"]["PASSWORD"]),
+        "HOST": os.environ.get("DJANGO_REPLICA_DATABASE_HOST", DATABASES["default"]["HOST"]),
+        "PORT": os.environ.get("DJANGO_REPLICA_DATABASE_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["bookstoreapi.router.ReplicaRouter"]
+
+# a user's catalog reads go to the primary for this long after they wrote, and catalog entries read from the replica
+# this soon after a change are only cached this long, cover the replication lag
+REPLICA_PIN_SECONDS = int(os.environ.get("DJANGO_REPLICA_PIN_SECONDS", 5))
+# how long an unreachable replica is left alone before it is tried again
+REPLICA_RETRY_SECONDS = int(os.environ.get("DJANGO_REPLICA_RETRY_SECONDS", 30))
+
+# reservations hold their copies for this long and are then released by the expire_holds command, 0 keeps them
+# until they are cancelled, see bookstoreapi/holds.py
+RESERVATION_HOLD_SECONDS = int(os.environ.get("DJANGO_RESERVATION_HOLD_SECONDS", 0))
+
+# Cache, local memory unless configured, e.g. DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# and DJANGO_CACHE_LOCATION=redis://localhost:6379
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "bookstore"),
+        # room for a few thousand books, culling would otherwise evict the catalog version key along with them
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("DJANGO_CACHE_MAX_ENTRIES", 10000))},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
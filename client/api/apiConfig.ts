@@ -5,7 +5,10 @@ export const API_BOOKS_PATH = 'bookstore/books/';
 export const API_CUSTOMER_PATH = 'bookstore/customers/';
 export const API_CUSTOMER_LOOKUP_PATH = 'bookstore/customers/lookup?username=';
 export const API_CUSTOMER_CREATE_PATH = 'bookstore/customers/create/';
+export const API_CUSTOMER_LOGIN_PATH = 'bookstore/customers/login/';
 export const API_RESERVATION_PATH = 'bookstore/reservations/';
+export const API_RESERVATION_BULK_PATH = 'bookstore/reservations/bulk/';
+export const API_RESERVATION_CANCEL_PATH = 'bookstore/reservations/cancel/';
 export const API_HEADERS = {
     'Content-Type': 'application/json',
     Accept: 'application/json',
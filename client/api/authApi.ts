@@ -1,16 +1,23 @@
 import axios from 'axios';
+import { Session } from '../types/AuthTypes';
+import { deserializeCustomer } from '../utils/customerUtils';
 import { saveAccessToken } from '../utils/tokenUtils';
-import { API_BASE_URL, API_HEADERS, API_JWT_TOKEN_PATH } from './apiConfig';
+import { API_BASE_URL, API_CUSTOMER_LOGIN_PATH, API_HEADERS } from './apiConfig';
 
-export const login = async (username: string, password: string): Promise<void> => {
+// one request for the tokens, the customer and their reservation totals
+export const login = async (username: string, password: string): Promise<Session> => {
   try {
     const payload = {
       username,
       password,
     };
-    const response = await axios.post(`${API_BASE_URL}${API_JWT_TOKEN_PATH}`, payload, { headers: API_HEADERS });
+    const response = await axios.post(`${API_BASE_URL}${API_CUSTOMER_LOGIN_PATH}`, payload, { headers: API_HEADERS });
 
-    saveAccessToken(response.data);
+    await saveAccessToken({ access: response.data.access, refresh: response.data.refresh });
+    return {
+      customer: response.data.customer ? deserializeCustomer({ data: response.data.customer }) : null,
+      reservations: response.data.reservations,
+    };
   } catch (error) {
     // Handle error
     throw error;
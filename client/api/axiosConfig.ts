@@ -1,4 +1,4 @@
-import axios from 'axios';
+import axios, { AxiosResponse, InternalAxiosRequestConfig } from 'axios';
 import jwtDecode from 'jwt-decode';
 import { getAccessToken, getRefreshToken, saveAccessToken } from '../utils/tokenUtils';
 import { API_BASE_URL, API_JWT_TOKEN_PATH } from './apiConfig';
@@ -7,8 +7,31 @@ let isRefreshing = false;
 
 const axiosInstance = axios.create({
   baseURL: `${API_BASE_URL}${API_JWT_TOKEN_PATH}`, // Replace with your API base URL
+  // 304 Not Modified is answered from the ETag cache below
+  validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
 });
 
+// GET responses that came with an ETag are remembered per URL, so the next GET of the same URL sends If-None-Match
+// and an unchanged page costs the server a 304 with no body instead of a full JSON download
+const ETAG_CACHE_SIZE = 100;
+const etagCache = new Map<string, { etag: string; data: any }>();
+
+const etagCacheKey = (config: InternalAxiosRequestConfig) => axiosInstance.getUri(config);
+
+const rememberResponse = (response: AxiosResponse) => {
+  const etag = response.headers['etag'];
+  if (response.config.method !== 'get' || response.status !== 200 || !etag) {
+    return;
+  }
+  const key = etagCacheKey(response.config);
+  etagCache.delete(key);
+  etagCache.set(key, { etag, data: response.data });
+  if (etagCache.size > ETAG_CACHE_SIZE) {
+    // Maps iterate in insertion order, the first key is the least recently stored
+    etagCache.delete(etagCache.keys().next().value);
+  }
+};
+
 const handleTokenRefresh = async () => {
   try {
     const refreshToken = await getRefreshToken();
@@ -32,6 +55,10 @@ axiosInstance.interceptors.request.use(
     if (token) {
       config.headers['Authorization'] = `Bearer ${token}`;
     }
+    const cached = config.method === 'get' ? etagCache.get(etagCacheKey(config)) : undefined;
+    if (cached) {
+      config.headers['If-None-Match'] = cached.etag;
+    }
     return config;
   },
   (error) => {
@@ -41,6 +68,13 @@ axiosInstance.interceptors.request.use(
 
 axiosInstance.interceptors.response.use(
     (response) => {
+      if (response.status === 304) {
+        const cached = etagCache.get(etagCacheKey(response.config));
+        if (cached) {
+          return { ...response, status: 200, data: cached.data };
+        }
+      }
+      rememberResponse(response);
       return response;
     },
     async (error) => {
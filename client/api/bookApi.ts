@@ -10,7 +10,7 @@ export const searchBooks = async (
     const response = await axiosInstance.get<{ count: number; results: Book[] }>(
       `${API_BASE_URL}bookstore/books/search`,
       {
-        params: { query: encodeURIComponent(query), page },
+        params: { query, page },
         headers: API_HEADERS,
       }
     );
@@ -33,4 +33,5 @@ export const getPopularBooks = async (page: number): Promise<{ count: number; re
   } catch (error: any) {
     throw error.response?.data || error.message;
   }
-};
\ No newline at end of file
+};
+
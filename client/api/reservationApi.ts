@@ -1,6 +1,13 @@
 // reservationApi.ts
-import { Reservation, ReservationRequest } from '../types/ReservationTypes';
-import { API_BASE_URL, API_RESERVATION_PATH } from './apiConfig';
+import { CursorPage } from '../types/BookTypes';
+import {
+  Reservation,
+  ReservationBulkRequest,
+  ReservationCancelRequest,
+  ReservationFilters,
+  ReservationRequest,
+} from '../types/ReservationTypes';
+import { API_BASE_URL, API_RESERVATION_BULK_PATH, API_RESERVATION_CANCEL_PATH, API_RESERVATION_PATH } from './apiConfig';
 import axiosInstance from './axiosConfig';
 
 export const makeReservation = async (reservation: ReservationRequest): Promise<void> => {
@@ -18,6 +25,21 @@ export const makeReservation = async (reservation: ReservationRequest): Promise<
   }
 };
 
+// Reserves a whole cart in one request, either every item is reserved or none are
+export const makeReservations = async (request: ReservationBulkRequest): Promise<string[]> => {
+  try {
+    const response = await axiosInstance.post(`${API_BASE_URL}${API_RESERVATION_BULK_PATH}`, request);
+    if (response.status === 201) {
+      return response.data.ids;
+    } else {
+      throw new Error(`Reservation failed ${response.status}`);
+    }
+  } catch (error: any) {
+    console.error('Error making reservations:', error.message);
+    throw error;
+  }
+};
+
 export const getAllReservations = async (): Promise<Reservation[]> => {
   try {
     const response = await axiosInstance.get(`${API_BASE_URL}${API_RESERVATION_PATH}`);
@@ -32,6 +54,23 @@ export const getAllReservations = async (): Promise<Reservation[]> => {
   }
 };
 
+// Cursor (keyset) variant for long histories, newest first. Pass an empty cursor for the first page and then the
+// returned `next` until it is null, every page costs the same on the server.
+export const getReservationsByCursor = async (
+  cursor: string = '',
+  filters: ReservationFilters = {}
+): Promise<CursorPage<Reservation>> => {
+  try {
+    const response = await axiosInstance.get<CursorPage<Reservation>>(`${API_BASE_URL}${API_RESERVATION_PATH}`, {
+      params: { ...filters, cursor },
+    });
+    return response.data;
+  } catch (error: any) {
+    console.error('Error fetching reservations:', error.message);
+    throw error;
+  }
+};
+
 export const deleteReservation = async (reservationId: string): Promise<void> => {
   try {
     const response = await axiosInstance.delete(`${API_BASE_URL}${API_RESERVATION_PATH}${reservationId}`);
@@ -45,3 +84,18 @@ export const deleteReservation = async (reservationId: string): Promise<void> =>
     throw error;
   }
 };
+
+// Cancels several reservations in one request, either all of them are cancelled or none are
+export const cancelReservations = async (request: ReservationCancelRequest): Promise<string[]> => {
+  try {
+    const response = await axiosInstance.post(`${API_BASE_URL}${API_RESERVATION_CANCEL_PATH}`, request);
+    if (response.status === 200) {
+      return response.data.ids;
+    } else {
+      throw new Error(`Error cancelling reservations ${response.status}`);
+    }
+  } catch (error: any) {
+    console.error('Error cancelling reservations:', error.message);
+    throw error;
+  }
+};
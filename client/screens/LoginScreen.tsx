@@ -6,7 +6,6 @@ import { SvgXml } from 'react-native-svg';
 
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { login } from '../api/authApi';
-import { getCustomerDetails } from '../api/customerApi';
 import AuthContext from '../contexts/AuthContext';
 
 import 'react-native-get-random-values';
@@ -34,9 +33,11 @@ const LoginScreen = (props: LoginScreenProps) => {
 
   const handleLogin = async () => {
     try {
-      await login(username, password);
-      const customerDetails = await getCustomerDetails(username);
-      setCustomer(customerDetails);
+      const session = await login(username, password);
+      if (!session.customer) {
+        throw new Error('No customer account for this user');
+      }
+      setCustomer(session.customer);
       await AsyncStorage.setItem('seed', nanoid());
       loginContext();
     } catch (error: any) {
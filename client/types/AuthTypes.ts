@@ -1,6 +1,15 @@
+import { Customer } from './CustomerTypes';
+import { ReservationSummary } from './ReservationTypes';
+
 type token = {
     access: string;
     refresh: string;
 }
 
+// customer and reservations are null for users without a customer
+export interface Session {
+    customer: Customer | null;
+    reservations: ReservationSummary | null;
+}
+
 export default token;
\ No newline at end of file
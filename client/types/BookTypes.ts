@@ -5,3 +5,8 @@ export interface Book {
   genre: string;
   quantity: number;
 }
+
+export interface CursorPage<T> {
+  next: string | null;
+  results: T[];
+}
@@ -6,10 +6,43 @@ export interface ReservationRequest {
   quantity: number;
 }
 
+export interface ReservationItem {
+  book: string;
+  quantity: number;
+}
+
+export interface ReservationBulkRequest {
+  customer: string;
+  items: ReservationItem[];
+}
+
+// leave ids out to cancel every reservation of the customer
+export interface ReservationCancelRequest {
+  customer: string;
+  ids?: string[];
+}
+
 export interface Reservation {
   id: string;
   customer: string;
   book: Book;
   quantity: number;
   date: string;
-}
\ No newline at end of file
+  // null when the reservation is kept until cancelled
+  expires_at: string | null;
+}
+
+// dates are YYYY-MM-DD and inclusive
+export interface ReservationFilters {
+  since?: string;
+  until?: string;
+  active?: boolean;
+}
+
+// totals of the customer's reservations, returned on login
+export interface ReservationSummary {
+  reservations: number;
+  active: number;
+  copies: number;
+  next_expiry: string | null;
+}